@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+
+# Shared by every course, so identical prompts cost one API call overall.
+DEFAULT_STORE_DIR = os.environ.get("NARRATOR_ASSET_STORE", ".cache/assets")
+DEFAULT_MAX_BYTES = int(os.environ.get("NARRATOR_ASSET_STORE_MAX_MB", "4096")) * 1024 * 1024
+
+_evict_lock = threading.Lock()
+# Running size of each store written by this process; walked once, then
+# kept up to date by put and evict.
+_store_sizes = {}
+
+
+def asset_key(model: str, payload: str, params: Optional[Dict] = None, template_version: str = "1") -> str:
+    """Build the content address of a generated asset.
+
+    Args:
+        model: Model that generates the asset
+        payload: Full prompt or narration text sent to the model
+        params: Generation parameters such as voice or style (default: none)
+        template_version: Version of the prompt template wrapped around the payload
+
+    Returns:
+        str: Hex digest identifying the asset
+    """
+    material = json.dumps(
+        {
+            "model": model,
+            "payload": payload,
+            "params": params or {},
+            "template_version": template_version,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _store_path(key: str, suffix: str, store_dir: Optional[str]) -> Path:
+    return Path(store_dir or DEFAULT_STORE_DIR) / key[:2] / f"{key}{suffix}"
+
+
+def _sidecar(path: Path) -> Path:
+    """Hidden file next to a course asset recording the key it was made for."""
+    return path.with_name(f".{path.name}.key")
+
+
+def _link(src: Path, dest: Path):
+    """Point dest at src via hardlink, falling back to a copy.
+
+    Never a symlink: evicting the store side would leave it dangling.
+    """
+    tmp_dest = dest.with_name(f".{dest.name}.link")
+    tmp_dest.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp_dest)
+    except OSError:
+        shutil.copy2(src, tmp_dest)
+    os.replace(tmp_dest, dest)
+
+
+def fetch(key: str, dest_path: Path, store_dir: Optional[str] = None) -> bool:
+    """Link a stored asset into place.
+
+    Args:
+        key: Content address from asset_key
+        dest_path: Course path the asset should appear at (e.g. images/section_0.png)
+        store_dir: Asset store directory (default: DEFAULT_STORE_DIR)
+
+    Returns:
+        bool: True if the asset was in the store and dest_path now holds it
+    """
+    dest_path = Path(dest_path)
+    stored = _store_path(key, dest_path.suffix, store_dir)
+    if not stored.exists():
+        return False
+
+    # Mark as recently used for LRU eviction
+    os.utime(stored)
+    if not (dest_path.exists() and os.path.samefile(stored, dest_path)):
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        _link(stored, dest_path)
+    _sidecar(dest_path).write_text(key, encoding="utf-8")
+    return True
+
+
+def adopt(key: str, dest_path: Path, store_dir: Optional[str] = None) -> bool:
+    """Add an asset already at its course path back to the store.
+
+    Covers course files the store lost, e.g. after eviction, a wiped store or
+    an upgrade from versions without one. A file whose key sidecar names a
+    different key was made for another request and is not adopted; files
+    without a sidecar predate it and are trusted, as they always were.
+
+    Args:
+        key: Content address from asset_key
+        dest_path: Course path of the asset
+        store_dir: Asset store directory (default: DEFAULT_STORE_DIR)
+
+    Returns:
+        bool: True if dest_path holds the asset and is now in the store
+    """
+    dest_path = Path(dest_path)
+    if not dest_path.is_file():
+        return False
+    sidecar = _sidecar(dest_path)
+    if sidecar.exists() and sidecar.read_text(encoding="utf-8").strip() != key:
+        return False
+    put(key, dest_path, store_dir)
+    return True
+
+
+def put(key: str, src_path: Path, store_dir: Optional[str] = None, max_bytes: Optional[int] = None) -> str:
+    """Add a freshly generated asset to the store and evict old entries over the size cap.
+
+    The store is only walked the first time this process writes to it and
+    when the running size total crosses the cap.
+
+    Args:
+        key: Content address from asset_key
+        src_path: Path of the generated asset
+        store_dir: Asset store directory (default: DEFAULT_STORE_DIR)
+        max_bytes: Size cap of the store (default: DEFAULT_MAX_BYTES)
+
+    Returns:
+        str: Path of the stored asset
+    """
+    src_path = Path(src_path)
+    stored = _store_path(key, src_path.suffix, store_dir)
+    stored.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        replaced = stored.stat().st_size
+    except OSError:
+        replaced = 0
+    _link(src_path, stored)
+    _sidecar(src_path).write_text(key, encoding="utf-8")
+
+    store = str(Path(store_dir or DEFAULT_STORE_DIR))
+    max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        if store in _store_sizes:
+            _store_sizes[store] += stored.stat().st_size - replaced
+        else:
+            _store_sizes[store] = _scan(Path(store))[1]
+        over_cap = _store_sizes[store] > max_bytes
+    if over_cap:
+        # Leave some headroom so the next puts do not walk the store again
+        evict(store_dir, int(max_bytes * 0.9))
+    return str(stored)
+
+
+def _scan(store: Path):
+    """Return the (mtime, size, path) of every stored asset and their total size."""
+    entries = []
+    total = 0
+    for path in store.glob("*/*"):
+        if path.name.startswith("."):
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    return entries, total
+
+
+def evict(store_dir: Optional[str] = None, max_bytes: Optional[int] = None) -> int:
+    """Remove least recently used assets until the store fits its size cap.
+
+    Course folders keep their hardlinked or copied files, which adopt puts
+    back into the store, so an evicted asset is only regenerated if it is
+    needed again under a different key or a wiped folder.
+
+    Returns:
+        int: Number of evicted assets
+    """
+    store = Path(store_dir or DEFAULT_STORE_DIR)
+    max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+
+    with _evict_lock:
+        entries, total = _scan(store)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        _store_sizes[str(store)] = total
+    return evicted
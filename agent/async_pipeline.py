@@ -0,0 +1,460 @@
+import asyncio
+import functools
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from agent import (
+    asset_store,
+    create_image,
+    digital_notes_json_genrator,
+    explentory_json_genrator,
+    genai_client,
+    input_encoder,
+    narration,
+    notes_degitalizer,
+    page_dedup,
+    page_preprocessor,
+    page_router,
+    prompt_cache,
+    resilience,
+    response_cache,
+    scheduler,
+    script_mapreduce,
+    video_genrator,
+    voice_genrator,
+)
+
+
+async def _digitize_page(image_file: Path, limiter: scheduler.AsyncLimiter) -> Optional[Dict[str, Any]]:
+    """Digitize one page image on the async client, routed and escalated like notes_degitalizer."""
+    page = f"{image_file.parent.name}/{image_file.name}"
+    try:
+        prepared = await asyncio.to_thread(page_preprocessor.prepare_page, str(image_file))
+        notes_degitalizer.print_prepared_page(page, prepared)
+
+        cache = response_cache.get_cache()
+        cached_response = await asyncio.to_thread(cache.get_any, notes_degitalizer.cached_page_keys(prepared))
+        if cached_response is not None:
+            print(f"      ✓ {page}: digitization found in response cache")
+            return notes_degitalizer.parse_response(cached_response)
+
+        features = await asyncio.to_thread(page_router.page_features, prepared)
+        for tier in page_router.escalation_path(page_router.route_page(features)):
+            settings = page_router.TIERS[tier]
+            started = time.monotonic()
+            result, error = None, None
+            try:
+                result = await resilience.acall(
+                    settings["model"],
+                    functools.partial(
+                        digital_notes_json_genrator.agenerate,
+                        model=settings["model"],
+                        thinking_budget=settings["thinking_budget"],
+                    ),
+                    prepared["data"],
+                    prepared["mime_type"],
+                    limiter=limiter,
+                )
+            except Exception as e:
+                error = e
+            parsed_data, done = await asyncio.to_thread(
+                notes_degitalizer.review_attempt,
+                page, prepared, features, tier, time.monotonic() - started, result, error,
+            )
+            if done:
+                return parsed_data
+        return None
+    except Exception as e:
+        print(f"      ✗ {page}: {e}")
+        return None
+
+
+async def digitize_folder(
+    folder: Path,
+    limiter: scheduler.AsyncLimiter,
+    page_index: Optional[page_dedup.PageIndex] = None
+) -> Dict[str, Any]:
+    """
+    Digitize every page of a folder concurrently and save the folder JSON.
+
+    Args:
+        folder: Folder containing the page images
+        limiter: Per-model limits of this run
+        page_index: Near-duplicate index of the whole course (default: an
+            index of this folder, if page_dedup.DEDUP_SETTINGS["enabled"])
+
+    Returns:
+        Dict with processing results, as returned by notes_degitalizer.process_folder
+    """
+    image_files = notes_degitalizer.find_images(folder)
+    if not image_files:
+        print(f"   ✗ No image files found in folder {folder.name}")
+        return {"error": f"No images found in {folder.name}"}
+
+    if page_index is None and page_dedup.DEDUP_SETTINGS["enabled"]:
+        page_index = await asyncio.to_thread(page_dedup.PageIndex, image_files)
+    unique_files = [f for f in image_files if page_index is None or page_index.representative(f) is None]
+
+    print(f"   Digitizing {len(unique_files)} page(s) of folder {folder.name}...")
+    unique_results = [None] * len(unique_files)
+    try:
+        unique_results = await asyncio.gather(*(_digitize_page(f, limiter) for f in unique_files))
+    finally:
+        if page_index is not None:
+            for image_file, parsed_data in zip(unique_files, unique_results):
+                page_index.resolve(image_file, parsed_data)
+
+    results_by_file = dict(zip(unique_files, unique_results))
+    page_results = []
+    for image_file in image_files:
+        if image_file in results_by_file:
+            page_results.append(results_by_file[image_file])
+        else:
+            await asyncio.wrap_future(page_index.future(image_file))
+            page_results.append(notes_degitalizer._duplicate_result(image_file, page_index))
+    return notes_degitalizer.save_folder_json(folder, image_files, page_results)
+
+
+async def stream_script(folder: Path, limiter: scheduler.AsyncLimiter) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield the sections of a digitized folder's script as they are written.
+
+    The script is streamed from the model, so assets of the first sections
+    can be generated while the rest is still being written; once complete it
+    is saved as output_<n>.json, like explentory_json_genrator.run, and reused
+    as long as <n>.json does not change. Scripts written in map-reduce mode
+    are yielded once all their sections are done. A failed request is retried
+    only while no section has been yielded yet.
+
+    Args:
+        folder: Folder containing <n>.json
+        limiter: Per-model limits of this run
+
+    Yields:
+        Section dicts with image_description and content
+    """
+    json_file = folder / f"{folder.name}.json"
+    digest = explentory_json_genrator.input_hash(json_file)
+    if explentory_json_genrator.script_is_current(folder, digest):
+        print(f"  ✓ Script of folder {folder.name} is up to date")
+        with open(folder / f"output_{folder.name}.json", "r", encoding="utf-8") as f:
+            script = explentory_json_genrator.extract_script(f.read())
+        for section in script.get("sections", []):
+            yield section
+        return
+
+    with open(json_file, "r", encoding="utf-8") as f:
+        input_data = json.load(f)
+
+    print(f"  Generating script for folder {folder.name}...")
+    text_input = explentory_json_genrator.build_text_input(input_data)
+    input_encoder.record(folder.name, input_data, text_input)
+    timeout = explentory_json_genrator.RUN_SETTINGS["timeout"]
+    if script_mapreduce.needs_mapreduce(text_input):
+        # The map requests run concurrently on the shared scheduler
+        script = await asyncio.to_thread(script_mapreduce.generate_script, input_data, timeout)
+        explentory_json_genrator.save_script(folder, script, digest)
+        for section in script.get("sections", []):
+            yield section
+        return
+
+    model = explentory_json_genrator.MODEL
+    policy = resilience.DEFAULT_POLICY
+    started = time.monotonic()
+    deadline = started + timeout
+    sections = []
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            async with limiter.slot(model):
+                stream = explentory_json_genrator.astream_sections(text_input)
+                try:
+                    while True:
+                        section = await asyncio.wait_for(
+                            anext(stream, None), timeout=max(0.0, deadline - time.monotonic())
+                        )
+                        if section is None:
+                            break
+                        if not sections:
+                            print(f"  ↳ First section of folder {folder.name} after {time.monotonic() - started:.1f}s")
+                        sections.append(section)
+                        yield section
+                finally:
+                    await stream.aclose()
+            break
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = resilience.DeadlineExceeded(f"{model} call exceeded its {timeout:g}s deadline")
+            if sections or not resilience.is_retryable(e) or attempts >= policy["max_attempts"]:
+                raise e
+            delay = resilience.backoff_delay(attempts, e, policy)
+            if delay >= deadline - time.monotonic():
+                raise e
+            print(f"   ↻ {model} attempt {attempts} failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    resilience.histogram(model).record(time.monotonic() - started)
+    explentory_json_genrator.save_script(folder, {"sections": sections}, digest)
+
+
+async def write_script(folder: Path, limiter: scheduler.AsyncLimiter) -> Dict[str, Any]:
+    """
+    Generate the video script of a digitized folder.
+
+    Args:
+        folder: Folder containing <n>.json
+        limiter: Per-model limits of this run
+
+    Returns:
+        Script dict with a "sections" list
+    """
+    return {"sections": [section async for section in stream_script(folder, limiter)]}
+
+
+async def _generation_attempt(agenerate_fn, payload: str, dest_path: Path) -> str:
+    """Async counterpart of video_genrator._generation_attempt."""
+    tmp_path = dest_path.with_name(f".{dest_path.stem}.{uuid.uuid4().hex[:8]}{dest_path.suffix}")
+    try:
+        generated = await agenerate_fn(payload, str(tmp_path))
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if not generated or not tmp_path.exists():
+        tmp_path.unlink(missing_ok=True)
+        raise resilience.EmptyResponse("model returned no data")
+    return str(tmp_path)
+
+
+async def _generate_asset(
+    kind: str,
+    idx: int,
+    model: str,
+    agenerate_fn,
+    payload: str,
+    dest_path: Path,
+    key: str,
+    limiter: scheduler.AsyncLimiter
+) -> Optional[str]:
+    """Async counterpart of video_genrator._submit_asset."""
+    # Store lookups and eviction touch the disk; keep them off the event loop
+    if (
+        await asyncio.to_thread(asset_store.fetch, key, dest_path)
+        or await asyncio.to_thread(asset_store.adopt, key, dest_path)
+    ):
+        print(f"{kind} for section {idx} already available. Skipping generation.")
+        return str(dest_path)
+
+    print(f"Generating {kind.lower()} for section {idx}...")
+    try:
+        tmp_path = await resilience.acall(
+            model,
+            _generation_attempt,
+            agenerate_fn,
+            payload,
+            dest_path,
+            limiter=limiter,
+            policy=video_genrator.ASSET_CALL_POLICY,
+            on_discard=video_genrator._discard_attempt,
+        )
+        await asyncio.to_thread(os.replace, tmp_path, dest_path)
+        await asyncio.to_thread(asset_store.put, key, dest_path)
+        return str(dest_path)
+    except Exception as e:
+        print(f"Error generating {kind.lower()} for section {idx}: {e}")
+        return None
+
+
+async def _generate_audio(
+    idx: int,
+    content: str,
+    audio_path: Path,
+    limiter: scheduler.AsyncLimiter
+) -> Optional[str]:
+    """Narrate a section; long texts are chunked on the shared scheduler."""
+    if len(narration.split_text(content)) > 1:
+        return await asyncio.wrap_future(video_genrator._submit_audio(idx, content, audio_path))
+    return await _generate_asset(
+        "Audio", idx, voice_genrator.MODEL, voice_genrator.agenerate,
+        content, audio_path, video_genrator.audio_asset_key(content), limiter,
+    )
+
+
+async def generate_assets(
+    sections: List[Dict[str, Any]],
+    output_dir: Path,
+    limiter: scheduler.AsyncLimiter
+) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """
+    Generate the image and audio of every section concurrently.
+
+    Each section's assets are started as soon as the section arrives, so
+    with a streamed script the first images and narration are generated
+    while the model is still writing.
+
+    Args:
+        sections: Script sections with "image_description" and "content",
+            as a list or an async iterator such as stream_script
+        output_dir: Video output directory
+        limiter: Per-model limits of this run
+
+    Returns:
+        Dict mapping section index to (image_path, audio_path)
+    """
+    images_dir = output_dir / "images"
+    audio_dir = output_dir / "audio"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    audio_dir.mkdir(parents=True, exist_ok=True)
+
+    async def section_assets(idx: int, section: Dict[str, Any]):
+        image_description = section.get("image_description", "")
+        content = section.get("content", "")
+        if not image_description or not content:
+            print(f"Warning: Section {idx} missing image_description or content. Skipping.")
+            return idx, (None, None)
+
+        image_prompt, image_key = video_genrator.image_asset(image_description)
+        image_path, audio_path = await asyncio.gather(
+            _generate_asset(
+                "Image", idx, create_image.MODEL, create_image.agenerate,
+                image_prompt, images_dir / f"section_{idx}.png", image_key, limiter,
+            ),
+            _generate_audio(idx, content, audio_dir / f"section_{idx}.wav", limiter),
+        )
+        print(f"✓ Section {idx} assets generated")
+        return idx, (image_path, audio_path)
+
+    async def arrivals():
+        if hasattr(sections, "__aiter__"):
+            async for section in sections:
+                yield section
+        else:
+            for section in sections:
+                yield section
+
+    tasks = []
+    try:
+        async for section in arrivals():
+            tasks.append(asyncio.ensure_future(section_assets(len(tasks), section)))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    results = await asyncio.gather(*tasks)
+    return dict(results)
+
+
+async def process_course_folder(
+    folder: Path,
+    video_dir: Path,
+    limiter: scheduler.AsyncLimiter,
+    engine: str = "ffmpeg",
+    page_index: Optional[page_dedup.PageIndex] = None
+) -> Tuple[str, bool, Optional[str]]:
+    """
+    Run notes → script → assets → video for one numbered folder.
+
+    Args:
+        folder: Numbered notes folder (e.g. vlsi/3)
+        video_dir: Directory holding the video JSON files and outputs (e.g. vlsi/video)
+        limiter: Per-model limits of this run
+        engine: Video assembly engine, "ffmpeg" or "moviepy" (default: ffmpeg)
+        page_index: Near-duplicate index of the whole course
+
+    Returns:
+        Tuple of (folder_name, success, error_message)
+    """
+    try:
+        result = await digitize_folder(folder, limiter, page_index)
+        if "error" in result:
+            return (folder.name, False, result["error"])
+
+        sections = []
+
+        async def streamed_sections():
+            async for section in stream_script(folder, limiter):
+                sections.append(section)
+                yield section
+
+        output_dir = video_dir / f"output_{folder.name}"
+        section_results = await generate_assets(streamed_sections(), output_dir, limiter)
+        if not sections:
+            return (folder.name, False, "No sections generated")
+
+        video_dir.mkdir(parents=True, exist_ok=True)
+        with open(video_dir / f"{folder.name}.json", "w", encoding="utf-8") as f:
+            json.dump({"sections": sections}, f, indent=2, ensure_ascii=False)
+
+        # Rendering is CPU-bound; keep it off the event loop
+        await asyncio.to_thread(video_genrator.render_video, section_results, str(output_dir), engine)
+        return (folder.name, True, None)
+    except Exception as e:
+        print(f"\n✗ Error processing folder {folder.name}: {e}")
+        return (folder.name, False, str(e))
+
+
+async def run_pipeline(
+    base_dir: str = "vlsi",
+    video_dir: str = "vlsi/video",
+    engine: str = "ffmpeg"
+) -> List[Tuple[str, bool, Optional[str]]]:
+    """
+    Run the whole notes → script → assets → video flow for every numbered folder.
+
+    All folders run concurrently on one event loop; the number of requests in
+    flight is bounded only by the per-model limits of the shared scheduler.
+
+    Args:
+        base_dir: Base directory containing numbered notes folders (default: vlsi)
+        video_dir: Directory for video JSON files and outputs (default: vlsi/video)
+        engine: Video assembly engine, "ffmpeg" or "moviepy" (default: ffmpeg)
+
+    Returns:
+        List of (folder_name, success, error_message)
+    """
+    base_path = Path(base_dir)
+    folders = sorted(
+        [d for d in base_path.iterdir() if d.is_dir() and d.name.isdigit()],
+        key=lambda d: int(d.name)
+    )
+    if not folders:
+        print(f"✗ No numbered folders found in '{base_dir}'")
+        return []
+
+    print(f"Running async pipeline over {len(folders)} folder(s)")
+    limiter = scheduler.AsyncLimiter()
+    page_index = None
+    if page_dedup.DEDUP_SETTINGS["enabled"]:
+        page_index = await asyncio.to_thread(
+            page_dedup.PageIndex,
+            [f for folder in folders for f in notes_degitalizer.find_images(folder)],
+        )
+    results = await asyncio.gather(
+        *(process_course_folder(folder, Path(video_dir), limiter, engine, page_index) for folder in folders)
+    )
+
+    print(f"\n{'='*60}")
+    print("SUMMARY")
+    print(f"{'='*60}")
+    for name, success, error in results:
+        print(f"  {'✓' if success else '✗'} {name}" + (f": {error}" if error else ""))
+    if page_index is not None:
+        page_index.print_report()
+    page_preprocessor.print_upload_report()
+    response_cache.get_cache().print_report()
+    response_cache.get_cache().record_run()
+    prompt_cache.get_prompt_cache().print_report()
+    input_encoder.print_report()
+    page_router.print_report()
+    resilience.print_latency_report()
+    genai_client.print_connection_stats()
+    await genai_client.aclose()
+    return list(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_pipeline())
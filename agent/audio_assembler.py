@@ -0,0 +1,223 @@
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+UNSET_SIZE = 0xFFFFFFFF
+
+
+def _chunks_fill(f, start: int, end: int) -> bool:
+    """True if the bytes from start to end are a chain of RIFF chunks."""
+    f.seek(start)
+    position = start
+    while position < end:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8 or not all(32 <= byte < 127 for byte in chunk_header[:4]):
+            return False
+        chunk_size = struct.unpack("<I", chunk_header[4:])[0]
+        position += 8 + chunk_size + (chunk_size & 1)
+        f.seek(position)
+    # The last chunk may omit its pad byte
+    return position in (end, end + 1)
+
+
+def read_wav_info(audio_path: str) -> Dict:
+    """Read the format and data layout of a PCM WAV file from its header.
+
+    Only the RIFF chunk headers are read; the sample data is never loaded.
+
+    Args:
+        audio_path: Path to the WAV file
+
+    Returns:
+        Dict with "sample_rate", "channels", "bits_per_sample", "data_offset",
+        "data_size" and "duration" (seconds) keys
+    """
+    with open(audio_path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"{audio_path} is not a RIFF/WAVE file")
+
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"{audio_path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+
+            if chunk_id == b"fmt ":
+                audio_format, channels, sample_rate, _, block_align, bits_per_sample = struct.unpack(
+                    "<HHIIHH", f.read(16)
+                )
+                if audio_format != 1:
+                    raise ValueError(f"{audio_path} is not PCM (format {audio_format})")
+                fmt = (channels, sample_rate, block_align, bits_per_sample)
+                f.seek(chunk_size - 16 + (chunk_size & 1), 1)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"{audio_path} has a data chunk before its fmt chunk")
+                channels, sample_rate, block_align, bits_per_sample = fmt
+                data_offset = f.tell()
+                end = f.seek(0, 2)
+                available = end - data_offset
+                # Streaming writers leave the size unset until they close;
+                # read to the end of the file instead. Some write 0 rather than
+                # UNSET_SIZE, which is only taken as unset when no chunks follow
+                unset = chunk_size == UNSET_SIZE or (
+                    chunk_size == 0 and available > 0 and not _chunks_fill(f, data_offset, end)
+                )
+                if unset:
+                    data_size = available - available % block_align
+                else:
+                    data_size = min(chunk_size, available)
+                return {
+                    "sample_rate": sample_rate,
+                    "channels": channels,
+                    "bits_per_sample": bits_per_sample,
+                    "data_offset": data_offset,
+                    "data_size": data_size,
+                    "duration": data_size / float(sample_rate * block_align),
+                }
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+
+def build_timeline(audio_paths: List[str]) -> List[Tuple[float, float]]:
+    """Compute the (start, duration) of every narration clip in playback order."""
+    timeline = []
+    start = 0.0
+    for audio_path in audio_paths:
+        duration = read_wav_info(audio_path)["duration"]
+        timeline.append((start, duration))
+        start += duration
+    return timeline
+
+
+def _wav_header(data_size: Optional[int], sample_rate: int, channels: int, bits_per_sample: int) -> bytes:
+    """Build a canonical 44-byte PCM WAV header; sizes are UNSET_SIZE if data_size is None."""
+    block_align = channels * (bits_per_sample // 8)
+    riff_size = UNSET_SIZE if data_size is None else 36 + data_size
+    data_size = UNSET_SIZE if data_size is None else data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits_per_sample,
+        b"data", data_size,
+    )
+
+
+class StreamingWavWriter:
+    """Write a PCM WAV file incrementally as audio arrives.
+
+    A header with unset sizes (UNSET_SIZE) is written up front, PCM is appended chunk by
+    chunk and the RIFF and data sizes are patched on close, so memory stays
+    flat however long the narration is.
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        sample_rate: int,
+        channels: int = 1,
+        bits_per_sample: int = 16,
+        started: Optional[float] = None
+    ):
+        self.output_path = str(output_path)
+        self.layout = (sample_rate, channels, bits_per_sample)
+        self.started = time.monotonic() if started is None else started
+        self.first_audio_at = None
+        self.finished_at = None
+        self.data_size = 0
+        self.file = open(self.output_path, "wb")
+        self.file.write(_wav_header(None, *self.layout))
+
+    def write(self, pcm: bytes):
+        """Append PCM samples to the data chunk."""
+        if self.first_audio_at is None:
+            self.first_audio_at = time.monotonic()
+        self.file.write(pcm)
+        self.data_size += len(pcm)
+
+    def close(self):
+        """Patch the header sizes and close the file."""
+        if self.file.closed:
+            return
+        self.file.seek(0)
+        self.file.write(_wav_header(self.data_size, *self.layout))
+        self.file.close()
+        self.finished_at = time.monotonic()
+
+    def abort(self):
+        """Close and delete a file whose stream failed part way."""
+        self.file.close()
+        Path(self.output_path).unlink(missing_ok=True)
+
+    def metrics(self) -> Dict:
+        """Return the size, duration, time to first audio and throughput of the stream."""
+        sample_rate, channels, bits_per_sample = self.layout
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started
+        return {
+            "bytes": self.data_size,
+            "duration": self.data_size / float(sample_rate * channels * (bits_per_sample // 8)),
+            "time_to_first_audio": (
+                self.first_audio_at - self.started if self.first_audio_at is not None else None
+            ),
+            "bytes_per_second": self.data_size / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def concat_wav(audio_paths: List[str], output_path: str, block_size: int = 1 << 20) -> str:
+    """Join WAV files into one track by concatenating their PCM data.
+
+    The samples are copied block by block from each file's data chunk, so no
+    decoding, float conversion or resampling happens and memory stays flat
+    regardless of the lecture length. All inputs must share one PCM format.
+
+    Args:
+        audio_paths: Paths of the WAV files in playback order
+        output_path: Path of the joined WAV file
+        block_size: Number of bytes copied per read (default: 1 MiB)
+
+    Returns:
+        str: Path to the joined WAV file
+    """
+    if not audio_paths:
+        raise ValueError("No audio files to join")
+
+    infos = [read_wav_info(path) for path in audio_paths]
+    first = infos[0]
+    layout = (first["sample_rate"], first["channels"], first["bits_per_sample"])
+    for path, info in zip(audio_paths, infos):
+        if (info["sample_rate"], info["channels"], info["bits_per_sample"]) != layout:
+            raise ValueError(f"{path} does not match the PCM format of {audio_paths[0]}")
+
+    total_size = sum(info["data_size"] for info in infos)
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+    with open(tmp_path, "wb") as out:
+        out.write(_wav_header(total_size, *layout))
+        for path, info in zip(audio_paths, infos):
+            with open(path, "rb") as src:
+                src.seek(info["data_offset"])
+                remaining = info["data_size"]
+                while remaining > 0:
+                    block = src.read(min(block_size, remaining))
+                    if not block:
+                        break
+                    out.write(block)
+                    remaining -= len(block)
+    os.replace(tmp_path, output_path)
+    return str(output_path)
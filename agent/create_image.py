@@ -1,15 +1,19 @@
 # To run this code you need to install the following dependencies:
 # pip install google-genai
 
+import asyncio
 import base64
 import mimetypes
-import os
-from google import genai
+from concurrent.futures import as_completed
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from google.genai import types
 from dotenv import load_dotenv
+from agent import genai_client, resilience, scheduler
 
 load_dotenv(override=True)
 
+MODEL = "gemini-2.5-flash-image"
+
 def save_binary_file(file_name, data):
     f = open(file_name, "wb")
     f.write(data)
@@ -17,21 +21,8 @@ def save_binary_file(file_name, data):
     print(f"File saved to to: {file_name}")
 
 
-def generate(text: str, output_path: str = None):
-    """Generate an image from text description.
-    
-    Args:
-        text: The text description for image generation
-        output_path: Optional path where to save the image. If None, uses default naming.
-    
-    Returns:
-        str: Path to the saved image file
-    """
-    client = genai.Client(
-        api_key=os.getenv("GEMINI_API_KEY"),
-    )
-
-    model = "gemini-2.5-flash-image"
+def _build_request(text: str):
+    """Build the contents and config of an image generation request."""
     contents = [
         types.Content(
             role="user",
@@ -46,38 +37,178 @@ def generate(text: str, output_path: str = None):
             "TEXT",
         ],
     )
+    return contents, generate_content_config
+
+
+def _save_chunk(chunk, output_path: str, file_index: int):
+    """Save the image carried by a stream chunk.
+
+    Returns:
+        str: Path of the saved file, or None if the chunk holds no image
+    """
+    if (
+        chunk.candidates is None
+        or chunk.candidates[0].content is None
+        or chunk.candidates[0].content.parts is None
+    ):
+        return None
+    if chunk.candidates[0].content.parts[0].inline_data and chunk.candidates[0].content.parts[0].inline_data.data:
+        inline_data = chunk.candidates[0].content.parts[0].inline_data
+        data_buffer = inline_data.data
+        file_extension = mimetypes.guess_extension(inline_data.mime_type)
+
+        if output_path:
+            file_name = output_path
+        else:
+            file_name = f"ENTER_FILE_NAME_{file_index}"
+            file_name = f"{file_name}{file_extension}"
+
+        save_binary_file(file_name, data_buffer)
+        return file_name
+    else:
+        print(chunk.text)
+        return None
+
+
+def generate(text: str, output_path: str = None):
+    """Generate an image from text description.
+
+    Args:
+        text: The text description for image generation
+        output_path: Optional path where to save the image. If None, uses default naming.
+
+    Returns:
+        str: Path to the saved image file
+    """
+    client = genai_client.get_client()
+
+    contents, generate_content_config = _build_request(text)
 
     file_index = 0
     saved_file_path = None
     for chunk in client.models.generate_content_stream(
-        model=model,
+        model=MODEL,
         contents=contents,
         config=generate_content_config,
     ):
-        if (
-            chunk.candidates is None
-            or chunk.candidates[0].content is None
-            or chunk.candidates[0].content.parts is None
-        ):
-            continue
-        if chunk.candidates[0].content.parts[0].inline_data and chunk.candidates[0].content.parts[0].inline_data.data:
-            inline_data = chunk.candidates[0].content.parts[0].inline_data
-            data_buffer = inline_data.data
-            file_extension = mimetypes.guess_extension(inline_data.mime_type)
-            
-            if output_path:
-                file_name = output_path
-            else:
-                file_name = f"ENTER_FILE_NAME_{file_index}"
-                file_name = f"{file_name}{file_extension}"
-            
-            save_binary_file(file_name, data_buffer)
+        file_name = _save_chunk(chunk, output_path, file_index)
+        if file_name:
             saved_file_path = file_name
             file_index += 1
-        else:
-            print(chunk.text)
-    
+
+    return saved_file_path
+
+
+async def agenerate(text: str, output_path: str = None):
+    """Async version of generate, built on the async genai client.
+
+    Args:
+        text: The text description for image generation
+        output_path: Optional path where to save the image. If None, uses default naming.
+
+    Returns:
+        str: Path to the saved image file
+    """
+    client = genai_client.get_client()
+
+    contents, generate_content_config = _build_request(text)
+
+    file_index = 0
+    saved_file_path = None
+    async for chunk in await client.aio.models.generate_content_stream(
+        model=MODEL,
+        contents=contents,
+        config=generate_content_config,
+    ):
+        file_name = _save_chunk(chunk, output_path, file_index)
+        if file_name:
+            saved_file_path = file_name
+            file_index += 1
+
     return saved_file_path
 
+
+def image_data(response) -> Optional[Tuple[bytes, str]]:
+    """Return the (data, mime_type) of the first image in a complete response, or None."""
+    for candidate in response.candidates or []:
+        if candidate.content is None:
+            continue
+        for part in candidate.content.parts or []:
+            if part.inline_data and part.inline_data.data:
+                return part.inline_data.data, part.inline_data.mime_type
+    return None
+
+
+def _generate_attempt(text: str, output_path: str) -> str:
+    """Run generate, treating a response without an image as a (retryable) failure."""
+    saved = generate(text, output_path)
+    if not saved:
+        raise resilience.EmptyResponse("model returned no image")
+    return saved
+
+
+async def _agenerate_attempt(text: str, output_path: str) -> str:
+    """Async form of _generate_attempt."""
+    saved = await agenerate(text, output_path)
+    if not saved:
+        raise resilience.EmptyResponse("model returned no image")
+    return saved
+
+
+def generate_many(
+    requests: List[Tuple[str, str]],
+    policy: Optional[Dict] = None
+) -> Iterator[Tuple[int, Optional[str], Optional[Exception]]]:
+    """Generate several images concurrently, yielding each as soon as it is done.
+
+    Every prompt is its own streaming request: an image request carries a
+    single prompt, so distinct prompts cannot share one request as
+    candidates. All requests go through the shared scheduler, which bounds
+    how many run at once under the model's limits.
+
+    Args:
+        requests: List of (prompt, output_path) pairs
+        policy: Overrides of resilience.DEFAULT_POLICY for every request
+
+    Yields:
+        Tuple of (index in requests, saved path or None, error or None), in
+        completion order; a response without an image is retried and, if it
+        keeps happening, reported as resilience.EmptyResponse
+    """
+    futures = {
+        resilience.submit(MODEL, _generate_attempt, prompt, output_path, policy=policy): index
+        for index, (prompt, output_path) in enumerate(requests)
+    }
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result(), None
+        except Exception as e:
+            yield futures[future], None, e
+
+
+async def agenerate_many(
+    requests: List[Tuple[str, str]],
+    limiter: scheduler.AsyncLimiter,
+    policy: Optional[Dict] = None
+) -> AsyncIterator[Tuple[int, Optional[str], Optional[Exception]]]:
+    """Async version of generate_many, bounded by the per-model limits of limiter."""
+
+    async def one(index: int, prompt: str, output_path: str):
+        try:
+            return index, await resilience.acall(
+                MODEL, _agenerate_attempt, prompt, output_path, limiter=limiter, policy=policy
+            ), None
+        except Exception as e:
+            return index, None, e
+
+    tasks = [asyncio.ensure_future(one(index, *request)) for index, request in enumerate(requests)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 if __name__ == "__main__":
     generate("A beautiful sunset over a calm ocean")
@@ -2,51 +2,21 @@
 # pip install google-genai
 
 import base64
-import os
+import json
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+from agent import prompt_cache, structured_output
 
 load_dotenv(override=True)
 
-def generate(image_data):
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
+MODEL = "gemini-2.5-pro"
+THINKING_BUDGET = 30000
+# Bump whenever the system prompt or response schema changes, so cached
+# digitizations made with the old prompt are not reused.
+PROMPT_VERSION = "1"
 
-    model = "gemini-2.5-pro"
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part.from_bytes(
-                    mime_type="image/png",
-                    data=image_data)
-            ],
-        ),
-    ]
-    generate_content_config = types.GenerateContentConfig(
-        thinking_config = types.ThinkingConfig(
-            thinking_budget=30000,
-        ),
-        response_mime_type="application/json",
-        response_schema=genai.types.Schema(
-            type = genai.types.Type.OBJECT,
-            required = ["Description"],
-            properties = {
-                "Description": genai.types.Schema(
-                    type = genai.types.Type.STRING,
-                ),
-                "Images": genai.types.Schema(
-                    type = genai.types.Type.ARRAY,
-                    items = genai.types.Schema(
-                        type = genai.types.Type.STRING,
-                    ),
-                ),
-            },
-        ),
-        system_instruction=[
-            types.Part.from_text(text="""
+SYSTEM_PROMPT = """
 # **System Prompt**
 
 ## **Identity**
@@ -108,19 +78,165 @@ Your primary task is to receive an image of notes and produce a structured JSON
   ]
 }
 ```
-</**assistant**>"""),
+</**assistant**>"""
+
+PAGE_SCHEMA = genai.types.Schema(
+    type = genai.types.Type.OBJECT,
+    required = ["Description"],
+    properties = {
+        "Description": genai.types.Schema(
+            type = genai.types.Type.STRING,
+        ),
+        "Images": genai.types.Schema(
+            type = genai.types.Type.ARRAY,
+            items = genai.types.Schema(
+                type = genai.types.Type.STRING,
+            ),
+        ),
+    },
+)
+
+# One {Page, Description, Images} entry per page of a batched request
+BATCH_SCHEMA = genai.types.Schema(
+    type = genai.types.Type.OBJECT,
+    required = ["Pages"],
+    properties = {
+        "Pages": genai.types.Schema(
+            type = genai.types.Type.ARRAY,
+            items = genai.types.Schema(
+                type = genai.types.Type.OBJECT,
+                required = ["Page", "Description"],
+                properties = dict(PAGE_SCHEMA.properties, Page=genai.types.Schema(
+                    type = genai.types.Type.INTEGER,
+                )),
+            ),
+        ),
+    },
+)
+
+BATCH_INSTRUCTION = (
+    "The following {count} images are separate pages of notes, each preceded by its page "
+    "number. Process every page on its own exactly as instructed, and return an object whose "
+    '"Pages" array holds one {{"Page", "Description", "Images"}} entry per page, in page order.'
+)
+
+# Limits of a batched request. Thinking and every page's description share the
+# model's output window, which caps the number of pages per request.
+BATCH_SETTINGS = {
+    "max_pages": 8,
+    "input_token_budget": 12000,
+    "output_tokens_per_page": 3000,
+    "max_output_tokens": 65536,
+}
+
+
+def _build_config(response_schema, thinking_budget=THINKING_BUDGET):
+    """Build the generation config shared by single-page and batched requests."""
+    return types.GenerateContentConfig(
+        thinking_config = types.ThinkingConfig(
+            thinking_budget=thinking_budget,
+        ),
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        system_instruction=[
+            types.Part.from_text(text=SYSTEM_PROMPT),
         ],
     )
 
-    response = client.models.generate_content(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    )
-    return response.model_dump_json()
+
+def _build_request(image_data, mime_type="image/png", thinking_budget=THINKING_BUDGET):
+    """Build the contents and config of a page digitization request."""
+    contents = [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_bytes(
+                    mime_type=mime_type,
+                    data=image_data)
+            ],
+        ),
+    ]
+    return contents, _build_config(PAGE_SCHEMA, thinking_budget)
+
+
+def _build_batch_request(pages):
+    """Build the contents and config of a request digitizing several pages.
+
+    Args:
+        pages: List of (image_data, mime_type) in page order
+    """
+    parts = [types.Part.from_text(text=BATCH_INSTRUCTION.format(count=len(pages)))]
+    for number, (image_data, mime_type) in enumerate(pages, 1):
+        parts.append(types.Part.from_text(text=f"Page {number}:"))
+        parts.append(types.Part.from_bytes(mime_type=mime_type, data=image_data))
+    contents = [
+        types.Content(
+            role="user",
+            parts=parts,
+        ),
+    ]
+    return contents, _build_config(BATCH_SCHEMA)
+
+
+def plan_batches(page_tokens):
+    """Group consecutive pages into batches that fit BATCH_SETTINGS.
+
+    Args:
+        page_tokens: Estimated image input tokens of each page, in page order
+
+    Returns:
+        List of batches, each a list of indexes into page_tokens
+    """
+    settings = BATCH_SETTINGS
+    output_room = settings["max_output_tokens"] - THINKING_BUDGET
+    max_pages = max(1, min(settings["max_pages"], output_room // settings["output_tokens_per_page"]))
+
+    batches = []
+    current, current_tokens = [], 0
+    for index, tokens in enumerate(page_tokens):
+        if current and (len(current) >= max_pages or current_tokens + tokens > settings["input_token_budget"]):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def generate(image_data, mime_type="image/png", model=MODEL, thinking_budget=THINKING_BUDGET):
+    """Digitize one page.
+
+    Returns:
+        structured_output.ModelResult whose data is {"Description", "Images"}
+    """
+    contents, generate_content_config = _build_request(image_data, mime_type, thinking_budget)
+    response = prompt_cache.generate_content(model, contents, generate_content_config)
+    return structured_output.from_response(response, model)
+
+
+def generate_batch(pages):
+    """Digitize several pages in one request.
+
+    Args:
+        pages: List of (image_data, mime_type) in page order
+
+    Returns:
+        structured_output.ModelResult whose data is {"Pages": [...]}
+    """
+    contents, generate_content_config = _build_batch_request(pages)
+    response = prompt_cache.generate_content(MODEL, contents, generate_content_config)
+    return structured_output.from_response(response, MODEL)
+
+
+async def agenerate(image_data, mime_type="image/png", model=MODEL, thinking_budget=THINKING_BUDGET):
+    """Async version of generate, built on the async genai client."""
+    contents, generate_content_config = _build_request(image_data, mime_type, thinking_budget)
+    response = await prompt_cache.agenerate_content(model, contents, generate_content_config)
+    return structured_output.from_response(response, model)
 
 
 if __name__ == "__main__":
     with open("bmsp/files/0.png", "rb") as image_file:
         image_data = image_file.read()
-    print(generate(image_data))
+    print(json.dumps(generate(image_data).data, indent=2, ensure_ascii=False))
@@ -1,28 +1,35 @@
 # To run this code you need to install the following dependencies:
 # pip install google-genai
 
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+from agent import input_encoder, prompt_cache, resilience, scheduler, structured_output
 
 load_dotenv(override=True)
 
-def generate(text_input: str) -> str:
-    """
-    Generate explanatory JSON from text input.
-    
-    Args:
-        text_input: The text content to be expanded and structured
-        
-    Returns:
-        JSON string with sections array containing image_description and content
-    """
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
+MODEL = "gemini-2.5-pro"
+# Bump whenever the system prompt or response schema changes, so scripts
+# written with the old prompt are regenerated.
+PROMPT_VERSION = "2"
+
+# "timeout" bounds the script request of one folder, retries included.
+# "max_workers" of None runs as many folders at once as the model's
+# concurrency limit allows.
+RUN_SETTINGS = {
+    "max_workers": None,
+    "timeout": float(os.getenv("NARRATOR_SCRIPT_TIMEOUT", "900")),
+}
 
-    model = "gemini-2.5-pro"
+def _build_request(text_input: str):
+    """Build the contents and config of a script generation request."""
     contents = [
         types.Content(
             role="user",
@@ -83,6 +90,7 @@ Your primary task is to process a JSON input containing a series of `description
 
 ## 4. Input and Output Format
 - **Input:** You will receive a user message containing a single JSON object with two keys: `descriptions` (an array of objects with `image` and `description` text) and `image_prompts` (an array of strings).
+- **Inline Figures:** Image prompts that belong to a specific place in the notes are given inside the `description`, where the figure appears, as `[Figure: <image prompt>]`. Treat them exactly like entries of `image_prompts`.
 - **Output:** You MUST respond with ONLY a single, valid JSON object. Do not include any introductory text, explanations, or markdown formatting outside of the JSON block. The JSON object must follow this exact structure:
 ```json
 {
@@ -141,27 +149,261 @@ Here is an example of how to transform a user's input into the desired output.
 """),
         ],
     )
+    return contents, generate_content_config
 
-    response = client.models.generate_content(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    )
-    return response.model_dump_json()
 
-def run():
+def generate(text_input: str) -> structured_output.ModelResult:
     """
-    Process all JSON files in vlsi folders and generate explanatory content.
+    Generate explanatory JSON from text input.
+    
+    Args:
+        text_input: The text content to be expanded and structured
+        
+    Returns:
+        ModelResult whose data is {"sections": [...]}, each section with
+        image_description and content
+    """
+    contents, generate_content_config = _build_request(text_input)
+    response = prompt_cache.generate_content(MODEL, contents, generate_content_config)
+    return structured_output.from_response(response, MODEL)
+
+
+async def agenerate(text_input: str) -> structured_output.ModelResult:
+    """
+    Async version of generate, built on the async genai client.
+    
+    Args:
+        text_input: The text content to be expanded and structured
+        
+    Returns:
+        ModelResult whose data is {"sections": [...]}
     """
-    import json
-    from pathlib import Path
+    contents, generate_content_config = _build_request(text_input)
+    response = await prompt_cache.agenerate_content(MODEL, contents, generate_content_config)
+    return structured_output.from_response(response, MODEL)
+
+
+def stream_sections(text_input: str) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming version of generate: yield each section as soon as it is complete.
+    
+    Lets images and narration of the first sections be generated while the
+    model is still writing the rest of the script.
+    
+    Args:
+        text_input: The text content to be expanded and structured
+        
+    Yields:
+        Section dicts with image_description and content
+        
+    Raises:
+        json.JSONDecodeError: If the stream ends before the script is complete
+    """
+    contents, generate_content_config = _build_request(text_input)
+    parser = structured_output.ArrayItemParser()
+    for chunk in prompt_cache.generate_content_stream(MODEL, contents, generate_content_config):
+        yield from parser.feed(chunk.text or "")
+    parser.close()
+
+
+async def astream_sections(text_input: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Async version of stream_sections, built on the async genai client.
+    
+    Args:
+        text_input: The text content to be expanded and structured
+        
+    Yields:
+        Section dicts with image_description and content
+    """
+    contents, generate_content_config = _build_request(text_input)
+    parser = structured_output.ArrayItemParser()
+    async for chunk in prompt_cache.agenerate_content_stream(MODEL, contents, generate_content_config):
+        for section in parser.feed(chunk.text or ""):
+            yield section
+    parser.close()
+
+def build_text_input(input_data: dict) -> str:
+    """
+    Format a digitized folder JSON as the user message of a script request.
     
-    # Define the base vlsi directory
-    vlsi_dir = Path("vlsi")
+    The folder is sent in the compact form of input_encoder.encode unless
+    ENCODER_SETTINGS["compact"] is off.
+    
+    Args:
+        input_data: Folder JSON with "descriptions" and "image_prompts"
+        
+    Returns:
+        User message text
+    """
+    if input_encoder.ENCODER_SETTINGS["compact"]:
+        encoded = input_encoder.encode(input_data)
+    else:
+        encoded = input_encoder.encode_verbose(input_data)
+    return f"""
+```json
+{encoded}
+```
+"""
+
+
+def extract_script(response) -> dict:
+    """
+    Extract the {"sections": [...]} script from a model result or a saved response.
+    
+    Args:
+        response: ModelResult returned by generate, or the text of a saved
+            output_<n>.json (older runs saved the whole SDK response)
+        
+    Returns:
+        Script dict with a "sections" list
+    """
+    if isinstance(response, structured_output.ModelResult):
+        return response.data
+    return structured_output.load_stored(response)
+
+
+def input_hash(json_file: Path) -> str:
+    """Hash a folder's input JSON together with the model, prompt version and input encoding."""
+    digest = hashlib.sha256(Path(json_file).read_bytes())
+    digest.update(f"\0{MODEL}\0{PROMPT_VERSION}\0{input_encoder.ENCODER_SETTINGS['compact']}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _meta_path(folder: Path) -> Path:
+    return folder / f".output_{folder.name}.meta.json"
+
+
+def script_is_current(folder: Path, digest: str) -> bool:
+    """True if output_<n>.json exists and was written from input with this hash."""
+    output_file = folder / f"output_{folder.name}.json"
+    meta_path = _meta_path(folder)
+    if not output_file.exists() or not meta_path.exists():
+        return False
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("input_sha256") == digest
+    except (OSError, ValueError):
+        return False
+
+
+def _write_json_atomic(path: Path, data: Dict):
+    """Write JSON to a temp file and rename it over path, so path is never truncated."""
+    tmp_path = path.with_name(f".{path.name}.part")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def save_script(folder: Path, script: Dict, digest: str) -> Path:
+    """
+    Save a folder's script as output_<n>.json and record the hash of its input.
+    
+    Args:
+        folder: Numbered folder
+        script: Script dict with a "sections" list
+        digest: input_hash of the folder's <n>.json
+        
+    Returns:
+        Path of output_<n>.json
+    """
+    output_file = folder / f"output_{folder.name}.json"
+    _write_json_atomic(output_file, script)
+    # Written last: a crash in between leaves a script that is regenerated next run
+    _write_json_atomic(_meta_path(folder), {"input_sha256": digest, "model": MODEL, "created_at": time.time()})
+    return output_file
+
+
+def process_folder(folder: Path, timeout: Optional[float] = None, force: bool = False) -> Tuple[str, str]:
+    """
+    Generate the script of one numbered folder.
+    
+    Args:
+        folder: Numbered folder containing <n>.json
+        timeout: Seconds allowed for the request, retries included
+            (default: RUN_SETTINGS["timeout"])
+        force: Regenerate even if the existing script is current
+        
+    Returns:
+        Tuple of (status, message); status is "written", "skipped", "missing" or "failed"
+    """
+    folder_num = folder.name
+    json_file = folder / f"{folder_num}.json"
+    if not json_file.exists():
+        print(f"⚠ Skipping folder {folder_num}: JSON file not found")
+        return "missing", "JSON file not found"
+    
+    digest = input_hash(json_file)
+    if not force and script_is_current(folder, digest):
+        print(f"  ✓ Folder {folder_num}: script is up to date, skipped")
+        return "skipped", "input unchanged"
+    
+    try:
+        with open(json_file, "r", encoding="utf-8") as f:
+            input_data = json.load(f)
+        
+        print(f"  Generating content for folder {folder_num}...")
+        timeout = RUN_SETTINGS["timeout"] if timeout is None else timeout
+        text_input = build_text_input(input_data)
+        input_encoder.record(folder_num, input_data, text_input)
+        # Imported here: script_mapreduce builds its requests with this module
+        from agent import script_mapreduce
+        if script_mapreduce.needs_mapreduce(text_input):
+            script = script_mapreduce.generate_script(input_data, timeout)
+            output_file = save_script(folder, script, digest)
+            print(f"  ✓ Folder {folder_num}: saved to {output_file} ({len(script.get('sections', []))} sections)")
+            return "written", str(output_file)
+        
+        result = resilience.call(MODEL, generate, text_input, policy={"deadline": timeout})
+        script = extract_script(result)
+        output_file = save_script(folder, script, digest)
+        
+        print(
+            f"  ✓ Folder {folder_num}: saved to {output_file} ({len(script.get('sections', []))} sections, "
+            f"{result.usage.input_tokens} input, {result.usage.output_tokens} output tokens)"
+        )
+        return "written", str(output_file)
+    except json.JSONDecodeError as e:
+        print(f"  ✗ JSON parsing error in folder {folder_num}: {str(e)}")
+        return "failed", str(e)
+    except Exception as e:
+        print(f"  ✗ Error processing folder {folder_num}: {str(e)}")
+        return "failed", str(e)
+
+
+def run(
+    base_dir: str = "vlsi",
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    force: bool = False
+) -> Dict[str, Tuple[str, str]]:
+    """
+    Process all JSON files in vlsi folders and generate explanatory content.
+    
+    Folders are processed concurrently, at most max_workers at a time; every
+    request still goes through the shared scheduler's limits for the model.
+    Folders whose <n>.json is unchanged since their output_<n>.json was
+    written are skipped.
+    
+    Args:
+        base_dir: Directory containing the numbered folders (default: vlsi)
+        max_workers: Folders processed at once (default: RUN_SETTINGS["max_workers"],
+            or the model's concurrency limit)
+        timeout: Seconds allowed per folder (default: RUN_SETTINGS["timeout"])
+        force: Regenerate every script, even unchanged ones
+        
+    Returns:
+        Dict of folder name to (status, message), in folder order
+    """
+    vlsi_dir = Path(base_dir)
     
     if not vlsi_dir.exists():
         print(f"✗ Directory '{vlsi_dir}' not found")
-        return
+        return {}
     
     # Find all numbered subdirectories
     folders = sorted([d for d in vlsi_dir.iterdir() if d.is_dir() and d.name.isdigit()], 
@@ -169,62 +411,28 @@ def run():
     
     if not folders:
         print(f"✗ No numbered folders found in '{vlsi_dir}'")
-        return
+        return {}
     
-    print(f"Found {len(folders)} folders to process\n")
+    max_workers = max_workers or RUN_SETTINGS["max_workers"] or \
+        scheduler.get_scheduler().limits.get(MODEL, scheduler.DEFAULT_LIMIT)["concurrency"]
+    print(f"Found {len(folders)} folders to process ({min(max_workers, len(folders))} at a time)\n")
     
-    # Process each folder
-    for folder in folders:
-        folder_num = folder.name
-        json_file = folder / f"{folder_num}.json"
-        
-        if not json_file.exists():
-            print(f"⚠ Skipping folder {folder_num}: JSON file not found")
-            continue
-        
-        print(f"Processing folder {folder_num}...")
-        
-        try:
-            # Read the input JSON file
-            with open(json_file, 'r', encoding='utf-8') as f:
-                input_data = json.load(f)
-            
-            # Convert to the format expected by generate function
-            text_input = f"""
-```json
-{{
-  "descriptions": {json.dumps(input_data.get('descriptions', []), indent=4)},
-  "image_prompts": {json.dumps(input_data.get('image_prompts', []), indent=4)}
-}}
-```
-"""
-            
-            # Generate the explanatory content
-            print(f"  Generating content for folder {folder_num}...")
-            response = generate(text_input)
-            
-            # Parse and save the response
-            parsed_data = json.loads(response)
-            
-            # Save to the same folder as output_{folder_num}.json
-            output_file = folder / f"output_{folder_num}.json"
-            with open(output_file, "w", encoding="utf-8") as json_file_out:
-                json.dump(parsed_data, json_file_out, indent=2, ensure_ascii=False)
-            
-            # Count sections
-            sections_count = len(parsed_data.get('parsed', {}).get('sections', []))
-            if sections_count == 0:
-                sections_count = len(parsed_data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', ''))
-            
-            print(f"  ✓ Saved to: {output_file}")
-            print(f"  ✓ Generated sections\n")
-            
-        except json.JSONDecodeError as e:
-            print(f"  ✗ JSON parsing error in folder {folder_num}: {str(e)}\n")
-        except Exception as e:
-            print(f"  ✗ Error processing folder {folder_num}: {str(e)}\n")
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(folders))) as executor:
+        statuses = list(executor.map(lambda folder: process_folder(folder, timeout, force), folders))
+    results = {folder.name: status for folder, status in zip(folders, statuses)}
     
+    counts = {}
+    for status, _ in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    print(
+        f"\nScripts: {counts.get('written', 0)} written, {counts.get('skipped', 0)} unchanged, "
+        f"{counts.get('failed', 0)} failed, {counts.get('missing', 0)} without input"
+    )
+    prompt_cache.get_prompt_cache().print_report()
+    input_encoder.print_report()
     print("Processing complete!")
+    return results
+
 
 if __name__ == "__main__":
     
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+
+load_dotenv(override=True)
+
+
+# Connection pool of every shared client. "max_connections" bounds the
+# connections one client opens; idle keep-alive connections are closed after
+# "keepalive_expiry" seconds.
+POOL_SETTINGS = {
+    "max_connections": int(os.getenv("NARRATOR_HTTP_POOL_SIZE", "20")),
+    "max_keepalive_connections": int(os.getenv("NARRATOR_HTTP_POOL_SIZE", "20")),
+    "keepalive_expiry": 60.0,
+}
+
+_clients = {}
+# Async callers get clients per event loop; entries go away with their loop
+_loop_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+_stats = {"requests": 0, "new_connections": 0, "tls_handshakes": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(event: str):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def _on_trace(event_name: str, info: Dict):
+    # httpcore only opens a TCP connection when no pooled one is available
+    if event_name == "connection.connect_tcp.started":
+        _count("new_connections")
+    elif event_name == "connection.start_tls.started":
+        _count("tls_handshakes")
+
+
+async def _on_trace_async(event_name: str, info: Dict):
+    _on_trace(event_name, info)
+
+
+def _trace_request(request: httpx.Request):
+    _count("requests")
+    request.extensions["trace"] = _on_trace
+
+
+async def _trace_request_async(request: httpx.Request):
+    _count("requests")
+    request.extensions["trace"] = _on_trace_async
+
+
+def _http_options() -> types.HttpOptions:
+    limits = httpx.Limits(**POOL_SETTINGS)
+    return types.HttpOptions(
+        client_args={"limits": limits, "event_hooks": {"request": [_trace_request]}},
+        async_client_args={"limits": limits, "event_hooks": {"request": [_trace_request_async]}},
+    )
+
+
+def get_client(api_key: Optional[str] = None) -> genai.Client:
+    """Return the shared genai client of this process.
+
+    Clients are cached per process, so worker processes never reuse sockets
+    inherited from their parent, and per event loop for async callers, since
+    pooled async connections cannot move between loops. Within a process the
+    sync client is shared by every thread.
+
+    Args:
+        api_key: API key; defaults to GEMINI_API_KEY
+
+    Returns:
+        genai.Client with a keep-alive connection pool
+    """
+    api_key = api_key or os.getenv("GEMINI_API_KEY")
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    key = (os.getpid(), api_key)
+    with _clients_lock:
+        clients = _clients if loop is None else _loop_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = genai.Client(api_key=api_key, http_options=_http_options())
+            clients[key] = client
+        return client
+
+
+async def aclose():
+    """Close the clients of the running event loop.
+
+    Call before the loop shuts down (e.g. at the end of the coroutine passed
+    to asyncio.run), so their pooled connections are released on the loop
+    that opened them.
+    """
+    with _clients_lock:
+        clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aio.aclose()
+        client.close()
+
+
+def _close_all():
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        loop_clients = list(_loop_clients.items())
+        _loop_clients.clear()
+    for client in clients:
+        client.close()
+    for loop, by_key in loop_clients:
+        for client in by_key.values():
+            client.close()
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(lambda c=client, target=loop: target.create_task(c.aio.aclose()))
+
+
+def configure(**pool_settings):
+    """Change the connection pool settings of clients created from now on.
+
+    Clients created with the old settings are closed.
+
+    Args:
+        **pool_settings: Keys of POOL_SETTINGS, e.g. max_connections=50
+    """
+    unknown = set(pool_settings) - set(POOL_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown pool settings: {sorted(unknown)}")
+    POOL_SETTINGS.update(pool_settings)
+    _close_all()
+
+
+def connection_stats() -> Dict[str, int]:
+    """Return request and connection counts of this process.
+
+    Returns:
+        Dict with requests, new_connections, reused_connections and tls_handshakes
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["reused_connections"] = max(0, stats["requests"] - stats["new_connections"])
+    return stats
+
+
+def print_connection_stats():
+    """Print how many requests reused a pooled connection."""
+    stats = connection_stats()
+    if not stats["requests"]:
+        return
+    print(
+        f"HTTP connections: {stats['requests']} requests, {stats['new_connections']} new "
+        f"connection(s), {stats['reused_connections']} reused, {stats['tls_handshakes']} TLS handshake(s)"
+    )
@@ -0,0 +1,325 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from google.genai import types
+from PIL import Image
+
+from agent import asset_store, create_image, genai_client, video_genrator
+
+
+# Offline bulk mode: every missing image of a course goes into one batch job,
+# which the service runs when it has capacity, at a lower price than
+# interactive requests. Jobs are recorded in "dir" so they can be waited for
+# and collected from another process, e.g. the morning after submitting.
+BATCH_SETTINGS = {
+    "dir": os.getenv("NARRATOR_IMAGE_BATCH_DIR", ".cache/image_batches"),
+    "poll_interval": float(os.getenv("NARRATOR_BATCH_POLL_INTERVAL", "60")),
+    "timeout": float(os.getenv("NARRATOR_BATCH_TIMEOUT", str(24 * 3600))),
+}
+
+TERMINAL_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+}
+
+
+class GeminiBatchBackend:
+    """Runs image batches as Gemini batch jobs with inlined requests."""
+
+    def create(self, model: str, requests: List[types.InlinedRequest], display_name: str) -> str:
+        job = genai_client.get_client().batches.create(
+            model=model,
+            src=requests,
+            config=types.CreateBatchJobConfig(display_name=display_name),
+        )
+        return job.name
+
+    def get(self, name: str) -> types.BatchJob:
+        return genai_client.get_client().batches.get(name=name)
+
+
+class LocalBatchBackend:
+    """Offline stand-in for GeminiBatchBackend.
+
+    Jobs move from pending to running to succeeded over "polls" calls of
+    get, and every request is answered with a small PNG whose colour is
+    derived from its prompt, so submitting, polling and collecting can be
+    exercised without the service. Requests whose prompt matches "fail" are
+    answered with an error instead.
+    """
+
+    def __init__(self, polls: int = 2, fail: Optional[Callable[[str], bool]] = None):
+        self.polls = polls
+        self.fail = fail
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def create(self, model: str, requests: List[types.InlinedRequest], display_name: str) -> str:
+        name = f"batches/local-{uuid.uuid4().hex[:12]}"
+        with self.lock:
+            self.jobs[name] = {"model": model, "requests": requests, "display_name": display_name, "polls": 0}
+        return name
+
+    def _respond(self, request: types.InlinedRequest) -> types.InlinedResponse:
+        prompt = "".join(part.text or "" for content in request.contents for part in content.parts)
+        if self.fail is not None and self.fail(prompt):
+            return types.InlinedResponse(error=types.JobError(code=400, message="request rejected by local batch service"))
+        colour = tuple(hashlib.sha256(prompt.encode("utf-8")).digest()[:3])
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), colour).save(buffer, format="PNG")
+        image = types.Part(inline_data=types.Blob(data=buffer.getvalue(), mime_type="image/png"))
+        return types.InlinedResponse(
+            response=types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[image]))]
+            )
+        )
+
+    def get(self, name: str) -> types.BatchJob:
+        with self.lock:
+            job = self.jobs[name]
+            job["polls"] += 1
+            polls = job["polls"]
+        if polls < self.polls:
+            state = types.JobState.JOB_STATE_PENDING if polls == 1 else types.JobState.JOB_STATE_RUNNING
+            return types.BatchJob(name=name, display_name=job["display_name"], model=job["model"], state=state)
+        return types.BatchJob(
+            name=name,
+            display_name=job["display_name"],
+            model=job["model"],
+            state=types.JobState.JOB_STATE_SUCCEEDED,
+            dest=types.BatchJobDestination(inlined_responses=[self._respond(r) for r in job["requests"]]),
+        )
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend() -> Any:
+    """Return the batch backend of this process."""
+    with _backends_lock:
+        pid = os.getpid()
+        if pid not in _backends:
+            _backends[pid] = GeminiBatchBackend()
+        return _backends[pid]
+
+
+def configure(backend: Any):
+    """Use the given batch backend in this process.
+
+    Args:
+        backend: GeminiBatchBackend, LocalBatchBackend or an object with the same methods
+    """
+    with _backends_lock:
+        _backends[os.getpid()] = backend
+
+
+def course_images(video_dir: str = "vlsi/video") -> List[Dict[str, Any]]:
+    """
+    List the section images of a course that the asset store cannot provide.
+
+    Images found in the asset store are linked into place on the way, and
+    images already in place are added back to it. Sections sharing an image
+    prompt, in one video or across videos, share one entry.
+
+    Args:
+        video_dir: Directory holding the video JSON files (<n>.json) and outputs
+
+    Returns:
+        List of {"prompt", "key", "paths"} dicts, one per image to generate
+    """
+    video_path = Path(video_dir)
+    json_files = sorted(
+        (f for f in video_path.glob("*.json") if f.stem.isdigit()),
+        key=lambda f: int(f.stem),
+    )
+    images = {}
+    for json_file in json_files:
+        with open(json_file, "r", encoding="utf-8") as f:
+            sections = json.load(f).get("sections", [])
+        images_dir = video_path / f"output_{json_file.stem}" / "images"
+        for idx, section in enumerate(sections):
+            if not section.get("image_description"):
+                continue
+            prompt, key = video_genrator.image_asset(section["image_description"])
+            path = images_dir / f"section_{idx}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if asset_store.fetch(key, path) or asset_store.adopt(key, path):
+                continue
+            images.setdefault(key, {"prompt": prompt, "key": key, "paths": []})["paths"].append(str(path))
+    return list(images.values())
+
+
+def _manifest_path(name: str) -> Path:
+    return Path(BATCH_SETTINGS["dir"]) / f"{name.replace('/', '_')}.json"
+
+
+def _load_manifest(name: str) -> Dict[str, Any]:
+    with open(_manifest_path(name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest: Dict[str, Any]):
+    path = _manifest_path(manifest["name"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.part")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def submit(video_dir: str = "vlsi/video") -> Optional[str]:
+    """
+    Submit every missing section image of a course as one batch job.
+
+    Args:
+        video_dir: Directory holding the video JSON files and outputs
+
+    Returns:
+        Name of the batch job, or None if no image is missing
+    """
+    images = course_images(video_dir)
+    if not images:
+        print(f"✓ Every image of {video_dir} is available, nothing to submit")
+        return None
+
+    requests = []
+    for image in images:
+        contents, config = create_image._build_request(image["prompt"])
+        requests.append(types.InlinedRequest(contents=contents, config=config))
+    display_name = f"notion-narrator-images-{Path(video_dir).parent.name or 'course'}-{int(time.time())}"
+    name = get_backend().create(create_image.MODEL, requests, display_name)
+    _save_manifest({
+        "name": name,
+        "model": create_image.MODEL,
+        "video_dir": str(video_dir),
+        "submitted_at": time.time(),
+        "collected": False,
+        "images": images,
+    })
+    sections = sum(len(image["paths"]) for image in images)
+    print(f"✓ Submitted {len(images)} image(s) for {sections} section(s) of {video_dir} as batch job {name}")
+    return name
+
+
+def wait(name: str, poll_interval: Optional[float] = None, timeout: Optional[float] = None) -> types.BatchJob:
+    """
+    Poll a batch job until it reaches a final state.
+
+    Args:
+        name: Batch job name returned by submit
+        poll_interval: Seconds between polls (default: BATCH_SETTINGS["poll_interval"])
+        timeout: Seconds to wait at most (default: BATCH_SETTINGS["timeout"])
+
+    Returns:
+        The finished BatchJob
+
+    Raises:
+        TimeoutError: If the job is still running after timeout seconds
+    """
+    poll_interval = BATCH_SETTINGS["poll_interval"] if poll_interval is None else poll_interval
+    deadline = time.monotonic() + (BATCH_SETTINGS["timeout"] if timeout is None else timeout)
+    state = None
+    while True:
+        job = get_backend().get(name)
+        if job.state != state:
+            state = job.state
+            print(f"  Batch job {name}: {state.name if state else 'unknown'}")
+        if state in TERMINAL_STATES:
+            return job
+        if time.monotonic() + poll_interval > deadline:
+            raise TimeoutError(f"batch job {name} still {state.name if state else 'unknown'}")
+        time.sleep(poll_interval)
+
+
+def collect(name: str, job: Optional[types.BatchJob] = None) -> Dict[str, int]:
+    """
+    Save the images of a finished batch job and add them to the asset store.
+
+    Args:
+        name: Batch job name returned by submit
+        job: The job as returned by wait (default: fetched from the backend)
+
+    Returns:
+        Dict with the number of section images "saved" and "failed"
+    """
+    manifest = _load_manifest(name)
+    job = job or get_backend().get(name)
+    if job.state not in TERMINAL_STATES:
+        print(f"⚠ Batch job {name} is still {job.state.name if job.state else 'unknown'}")
+        return {"saved": 0, "failed": 0}
+
+    responses = (job.dest.inlined_responses or []) if job.dest else []
+    counts = {"saved": 0, "failed": 0}
+    for index, image in enumerate(manifest["images"]):
+        paths = [Path(path) for path in image["paths"]]
+        inlined = responses[index] if index < len(responses) else None
+        found = create_image.image_data(inlined.response) if inlined and inlined.response else None
+        if found is None:
+            error = inlined.error.message if inlined and inlined.error else f"job {job.state.name}"
+            for path in paths:
+                print(f"  ✗ {path}: {error}")
+            counts["failed"] += len(paths)
+            continue
+        path = paths[0]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.part")
+        tmp_path.write_bytes(found[0])
+        os.replace(tmp_path, path)
+        asset_store.put(image["key"], path)
+        # Sections sharing the prompt get the same stored image
+        for other in paths[1:]:
+            if not asset_store.fetch(image["key"], other):
+                other.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(path, other)
+        counts["saved"] += len(paths)
+
+    manifest["collected"] = True
+    _save_manifest(manifest)
+    print(f"✓ Batch job {name}: {counts['saved']} section image(s) saved, {counts['failed']} failed")
+    return counts
+
+
+def run(video_dir: str = "vlsi/video", poll_interval: Optional[float] = None) -> Dict[str, int]:
+    """Submit a course's missing images as one batch job, wait for it and collect the images."""
+    name = submit(video_dir)
+    if name is None:
+        return {"saved": 0, "failed": 0}
+    return collect(name, wait(name, poll_interval))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a course's section images as one batch job")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="Submit the missing images and exit")
+    run_parser = subparsers.add_parser("run", help="Submit, wait for the job and save the images")
+    for subparser in (submit_parser, run_parser):
+        subparser.add_argument("--video-dir", default="vlsi/video", help="Video JSON directory (default: vlsi/video)")
+
+    wait_parser = subparsers.add_parser("wait", help="Wait for a submitted job and save its images")
+    collect_parser = subparsers.add_parser("collect", help="Save the images of a finished job")
+    for subparser in (wait_parser, collect_parser):
+        subparser.add_argument("job", help="Batch job name printed by submit")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        submit(args.video_dir)
+    elif args.command == "run":
+        run(args.video_dir)
+    elif args.command == "wait":
+        collect(args.job, wait(args.job))
+    else:
+        collect(args.job)
@@ -0,0 +1,177 @@
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+
+# With "compact" off, build_text_input sends the pretty-printed JSON of
+# earlier versions, e.g. to compare script quality between the two.
+ENCODER_SETTINGS = {
+    "compact": os.getenv("NARRATOR_COMPACT_INPUT", "1") != "0",
+}
+
+FIGURE = re.compile(r"!\[[^\]]*\]\(images/figure_(\d+)\.\w+\)")
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_LIST_MARKER = re.compile(r"^( *)([*+-]|\d+\.) {2,}")
+_INDENT = re.compile(r"^((?:    )+)")
+# Words of up to 8 letters are mostly one token, longer ones two or more;
+# digits, punctuation and line breaks are about one token each.
+_PIECE = re.compile(r"[^\W\d_]+|\d|\n+|[^\w\s]")
+
+_stats = {"folders": 0, "verbose_tokens": 0, "compact_tokens": 0}
+_stats_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the Gemini tokens of a text locally, without a count_tokens request."""
+    count = 0
+    for piece in _PIECE.findall(text):
+        count += 1 + (len(piece) - 1) // 8 if piece[0].isalpha() else 1
+    return count
+
+
+def figure_prompts(input_data: Dict[str, Any]) -> Optional[List[Dict[int, str]]]:
+    """Map every page's figure placeholders to the image prompts they stand for.
+
+    Each page's description numbers its placeholders images/figure_<n> from 1,
+    one per image prompt it contributed, and the folder's prompts are listed
+    in page order.
+
+    Returns:
+        Per page, {figure number: prompt}; None if the placeholders do not
+        account for exactly the folder's prompts
+    """
+    prompts = input_data.get("image_prompts", [])
+    figures = [
+        [int(number) for number in FIGURE.findall(entry.get("description", ""))]
+        for entry in input_data.get("descriptions", [])
+    ]
+    if sum(len(numbers) for numbers in figures) != len(prompts):
+        return None
+    mapping, start = [], 0
+    for numbers in figures:
+        if sorted(numbers) != list(range(1, len(numbers) + 1)):
+            return None
+        mapping.append({number: prompts[start + number - 1] for number in numbers})
+        start += len(numbers)
+    return mapping
+
+
+def _heading_key(heading: re.Match) -> tuple:
+    return len(heading.group(1)), " ".join(heading.group(2).lower().split())
+
+
+def page_headings(text: str) -> set:
+    """The headings a page continues under: its title and the headings it ends under."""
+    title = None
+    path = []
+    for line in text.splitlines():
+        heading = _HEADING.match(line.rstrip())
+        if not heading:
+            continue
+        key = _heading_key(heading)
+        title = title or key
+        path = [open_key for open_key in path if open_key[0] < key[0]] + [key]
+    return set(path) | ({title} if title else set())
+
+
+def compact_markdown(text: str, previous_headings: set) -> str:
+    """Strip formatting that costs tokens without carrying content.
+
+    Removes blank lines, trailing spaces and padding after list markers,
+    and halves indentation. Headings at the top of a page that repeat the
+    previous page's title or the headings it ended under (from
+    page_headings) are dropped, since pages continuing a topic often repeat
+    them; a heading that is new to the page ends this, so later sections
+    such as a second "## Example" keep their heading.
+    """
+    lines = []
+    continuing = True
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line:
+            continue
+        heading = _HEADING.match(line)
+        if heading:
+            if continuing and _heading_key(heading) in previous_headings:
+                continue
+            continuing = False
+        line = _LIST_MARKER.sub(r"\1\2 ", line)
+        line = _INDENT.sub(lambda m: "  " * (len(m.group(1)) // 4), line)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def compact_input(input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the compact form of a folder JSON for the script request.
+
+    Image prompts are moved into the description, in place of the figure
+    placeholder they belong to, as [Figure: <prompt>], so each is sent once
+    and where it is discussed; only prompts that cannot be placed stay in
+    "image_prompts". Descriptions are compacted with compact_markdown.
+
+    Args:
+        input_data: Folder JSON with "descriptions" and "image_prompts"
+
+    Returns:
+        Dict with "descriptions" and "image_prompts", in the shape the
+        script prompt expects
+    """
+    mapping = figure_prompts(input_data)
+    previous_headings = set()
+    descriptions = []
+    for index, entry in enumerate(input_data.get("descriptions", [])):
+        description = entry.get("description", "")
+        if mapping is not None:
+            page_figures = mapping[index]
+            description = FIGURE.sub(lambda m: f"[Figure: {page_figures[int(m.group(1))]}]", description)
+        compact = {"description": compact_markdown(description, previous_headings)}
+        previous_headings = page_headings(description)
+        if "image" in entry:
+            compact = {"image": entry["image"], **compact}
+        descriptions.append(compact)
+    return {
+        "descriptions": descriptions,
+        "image_prompts": [] if mapping is not None else list(input_data.get("image_prompts", [])),
+    }
+
+
+def encode(input_data: Dict[str, Any]) -> str:
+    """Serialize a folder JSON compactly: no indentation, no escaped non-ASCII text."""
+    return json.dumps(compact_input(input_data), ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_verbose(input_data: Dict[str, Any]) -> str:
+    """Serialize a folder JSON the way earlier versions did, pretty-printed with separate prompts."""
+    return f"""{{
+  "descriptions": {json.dumps(input_data.get('descriptions', []), indent=4)},
+  "image_prompts": {json.dumps(input_data.get('image_prompts', []), indent=4)}
+}}"""
+
+
+def record(label: str, input_data: Dict[str, Any], text_input: str):
+    """Print and add to the run totals the estimated input tokens a folder's encoding saved."""
+    verbose = estimate_tokens(encode_verbose(input_data))
+    compact = estimate_tokens(text_input)
+    with _stats_lock:
+        _stats["folders"] += 1
+        _stats["verbose_tokens"] += verbose
+        _stats["compact_tokens"] += compact
+    saved = 100 * (verbose - compact) / verbose if verbose else 0
+    print(f"  Input of folder {label}: ~{verbose} → ~{compact} tokens ({saved:.0f}% saved)")
+
+
+def print_report():
+    """Print the estimated input tokens of this run's script requests before and after compaction."""
+    with _stats_lock:
+        stats = dict(_stats)
+    if not stats["folders"]:
+        return
+    saved = stats["verbose_tokens"] - stats["compact_tokens"]
+    print(
+        f"Script input: ~{stats['verbose_tokens']} → ~{stats['compact_tokens']} estimated tokens "
+        f"over {stats['folders']} folder(s), ~{saved} saved "
+        f"({100 * saved / max(1, stats['verbose_tokens']):.0f}%)"
+    )
@@ -0,0 +1,246 @@
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from agent import asset_store, audio_assembler, resilience, voice_genrator
+
+
+# Sections longer than "max_chars" are narrated in chunks of at most that many
+# characters, split at paragraph and sentence boundaries and joined with
+# "silence_ms" of silence. A max_chars of 0 narrates every section in one request.
+CHUNK_SETTINGS = {
+    "max_chars": int(os.getenv("NARRATOR_TTS_CHUNK_CHARS", "1200")),
+    "silence_ms": int(os.getenv("NARRATOR_TTS_CHUNK_SILENCE_MS", "250")),
+}
+
+# Bump when chunk synthesis changes, so cached chunks are regenerated
+CHUNK_VERSION = "2"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+
+def _pack(parts: List[str], max_chars: int) -> List[str]:
+    """Join consecutive parts with spaces into pieces of at most max_chars characters."""
+    pieces = []
+    current = ""
+    for part in parts:
+        candidate = f"{current} {part}" if current else part
+        if current and len(candidate) > max_chars:
+            pieces.append(current)
+            candidate = part
+        current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Split a sentence longer than max_chars at commas, then at spaces.
+
+    Clauses are packed whole; only a clause still longer than max_chars is
+    broken between words.
+    """
+    clauses = []
+    for clause in re.split(r"(?<=,)\s+", sentence):
+        if len(clause) > max_chars:
+            clauses.extend(_pack(clause.split(), max_chars))
+        else:
+            clauses.append(clause)
+    return _pack(clauses, max_chars)
+
+
+def split_text(text: str, max_chars: Optional[int] = None) -> List[str]:
+    """Split narration text into chunks at paragraph and sentence boundaries.
+
+    Sentences are packed greedily into chunks of at most max_chars characters;
+    a paragraph break always ends a chunk. Only a single sentence longer than
+    max_chars is split inside the sentence.
+
+    Args:
+        text: Narration text of a section
+        max_chars: Chunk size limit (default: CHUNK_SETTINGS["max_chars"])
+
+    Returns:
+        List of chunk texts in reading order
+    """
+    max_chars = CHUNK_SETTINGS["max_chars"] if max_chars is None else max_chars
+    text = text.strip()
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        current = ""
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            sentence = " ".join(sentence.split())
+            if not sentence:
+                continue
+            for piece in (_split_long(sentence, max_chars) if len(sentence) > max_chars else [sentence]):
+                candidate = f"{current} {piece}" if current else piece
+                if current and len(candidate) > max_chars:
+                    chunks.append(current)
+                    candidate = piece
+                current = candidate
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def chunk_asset_key(text: str) -> str:
+    """Build the asset store key of one narration chunk."""
+    return asset_store.asset_key(
+        voice_genrator.MODEL,
+        text,
+        {"voice": voice_genrator.VOICE_NAME, "temperature": voice_genrator.TEMPERATURE, "chunk": True},
+        CHUNK_VERSION,
+    )
+
+
+def _chunk_attempt(text: str, chunk_path: Path) -> str:
+    """Synthesize one chunk into a private temp file (safe to retry and hedge)."""
+    tmp_path = chunk_path.with_name(f"{chunk_path.stem}.{uuid.uuid4().hex[:8]}{chunk_path.suffix}")
+    try:
+        generated = voice_genrator.generate(text, str(tmp_path))
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if not generated or not tmp_path.exists():
+        tmp_path.unlink(missing_ok=True)
+        raise resilience.EmptyResponse("model returned no audio")
+    return str(tmp_path)
+
+
+def _discard(tmp_path: str):
+    Path(tmp_path).unlink(missing_ok=True)
+
+
+def stitch_chunks(
+    chunk_paths: List[str],
+    output_path: str,
+    silence_ms: Optional[int] = None,
+    texts: Optional[List[str]] = None,
+    block_size: int = 1 << 20
+) -> List[Dict]:
+    """Join chunk WAV files in order, with silence between them.
+
+    Args:
+        chunk_paths: Chunk WAV files in reading order, all in one PCM format
+        output_path: Path of the joined WAV file
+        silence_ms: Silence inserted between chunks (default: CHUNK_SETTINGS["silence_ms"])
+        texts: Optional chunk texts to include in the timings
+        block_size: Number of bytes copied per read (default: 1 MiB)
+
+    Returns:
+        List of {"index", "start", "duration"} dicts (plus "text" if texts were
+        given), with offsets in seconds from the start of the joined file
+    """
+    silence_ms = CHUNK_SETTINGS["silence_ms"] if silence_ms is None else silence_ms
+    infos = [audio_assembler.read_wav_info(path) for path in chunk_paths]
+    layout = (infos[0]["sample_rate"], infos[0]["channels"], infos[0]["bits_per_sample"])
+    for path, info in zip(chunk_paths, infos):
+        if (info["sample_rate"], info["channels"], info["bits_per_sample"]) != layout:
+            raise ValueError(f"{path} does not match the PCM format of {chunk_paths[0]}")
+
+    sample_rate, channels, bits_per_sample = layout
+    block_align = channels * (bits_per_sample // 8)
+    silence = b"\x00" * (int(sample_rate * silence_ms / 1000) * block_align)
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+    timings = []
+    start = 0.0
+    with audio_assembler.StreamingWavWriter(str(tmp_path), *layout) as writer:
+        for index, (path, info) in enumerate(zip(chunk_paths, infos)):
+            if index:
+                writer.write(silence)
+                start += len(silence) / float(sample_rate * block_align)
+            with open(path, "rb") as src:
+                src.seek(info["data_offset"])
+                remaining = info["data_size"]
+                while remaining > 0:
+                    block = src.read(min(block_size, remaining))
+                    if not block:
+                        break
+                    writer.write(block)
+                    remaining -= len(block)
+            timing = {"index": index, "start": round(start, 3), "duration": round(info["duration"], 3)}
+            if texts is not None:
+                timing["text"] = texts[index]
+            timings.append(timing)
+            start += info["duration"]
+    os.replace(tmp_path, output_path)
+    return timings
+
+
+def submit_chunked(
+    text: str,
+    output_path: str,
+    max_chars: Optional[int] = None,
+    silence_ms: Optional[int] = None
+) -> Future:
+    """Narrate text as concurrently synthesized chunks joined into one WAV file.
+
+    Every chunk is a separate call through resilience.submit, so a failed chunk
+    is retried on its own while the others keep going, and the section is done
+    roughly when its slowest chunk is. Finished chunks are kept in the asset
+    store, so rerunning a section after a failure only synthesizes the chunks
+    that are still missing.
+
+    Args:
+        text: Narration text
+        output_path: Path of the joined WAV file
+        max_chars: Chunk size limit (default: CHUNK_SETTINGS["max_chars"])
+        silence_ms: Silence between chunks (default: CHUNK_SETTINGS["silence_ms"])
+
+    Returns:
+        Future resolving to the chunk timings returned by stitch_chunks
+    """
+    output_path = Path(output_path)
+    chunks = split_text(text, max_chars)
+    chunk_paths = [
+        output_path.with_name(f".{output_path.stem}.chunk{index}{output_path.suffix}")
+        for index in range(len(chunks))
+    ]
+    result = Future()
+    state = {"pending": len(chunks), "error": None}
+    lock = threading.Lock()
+
+    def settle(error: Optional[BaseException] = None):
+        with lock:
+            if error is not None and state["error"] is None:
+                state["error"] = error
+            state["pending"] -= 1
+            if state["pending"]:
+                return
+        try:
+            if state["error"] is not None:
+                raise state["error"]
+            result.set_result(stitch_chunks([str(p) for p in chunk_paths], str(output_path), silence_ms, chunks))
+        except BaseException as e:
+            result.set_exception(e)
+        finally:
+            for chunk_path in chunk_paths:
+                chunk_path.unlink(missing_ok=True)
+
+    def on_chunk_done(index: int, key: str, attempt: Future):
+        try:
+            os.replace(attempt.result(), chunk_paths[index])
+            asset_store.put(key, chunk_paths[index])
+        except BaseException as e:
+            print(f"   ✗ Narration chunk {index + 1}/{len(chunks)} failed: {e}")
+            settle(e)
+            return
+        settle()
+
+    for index, chunk in enumerate(chunks):
+        key = chunk_asset_key(chunk)
+        if asset_store.fetch(key, chunk_paths[index]):
+            settle()
+            continue
+        attempt = resilience.submit(voice_genrator.MODEL, _chunk_attempt, chunk, chunk_paths[index], on_discard=_discard)
+        attempt.add_done_callback(lambda done, index=index, key=key: on_chunk_done(index, key, done))
+    return result
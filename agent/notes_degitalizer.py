@@ -1,127 +1,350 @@
+import functools
 import json
 import os
 import sys
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from digital_notes_json_genrator import generate as generate_json
+from agent import (
+    genai_client,
+    page_dedup,
+    page_preprocessor,
+    page_router,
+    prompt_cache,
+    resilience,
+    response_cache,
+    scheduler,
+    structured_output,
+)
+from agent.digital_notes_json_genrator import (
+    BATCH_SETTINGS,
+    MODEL,
+    PROMPT_VERSION,
+    generate as generate_json,
+    generate_batch,
+    plan_batches,
+)
 
 
-def process_folder(
-    folder_path: str,
-    output_base_dir: str = "vlsi"
-) -> Dict[str, Any]:
+def find_images(folder: Path) -> List[Path]:
+    """List the page images of a folder in processing order."""
+    image_extensions = {".png", ".jpg", ".jpeg", ".gif", ".bmp"}
+    return sorted([
+        f for f in folder.iterdir()
+        if f.suffix.lower() in image_extensions and not f.name.startswith("Screenshot")
+    ])
+
+
+def parse_response(json_response: str) -> Dict[str, Any]:
     """
-    Process all images in a folder: generate combined JSON.
+    Parse a digitization stored in the response cache.
     
     Args:
-        folder_path: Path to the folder containing images
-        output_base_dir: Base directory for outputs (default: vlsi)
+        json_response: Stored {Description, Images} JSON (or, from older
+            runs, a whole serialized SDK response)
         
     Returns:
-        Dict with processing results
+        Parsed page data
+        
+    Raises:
+        json.JSONDecodeError: If the stored text holds no JSON
     """
-    folder = Path(folder_path)
-    folder_name = folder.name
-    
-    print(f"\n{'='*60}")
-    print(f"Processing Folder: {folder_name}")
-    print(f"{'='*60}")
+    return structured_output.load_stored(json_response)
+
+
+def default_in_flight() -> int:
+    """Number of pages digitized at once by default: the model's concurrency limit."""
+    return scheduler.get_scheduler().limits.get(MODEL, scheduler.DEFAULT_LIMIT)["concurrency"]
+
+
+def print_prepared_page(page: str, prepared: Dict[str, Any]):
+    """Print the upload size and estimated image tokens of a prepared page."""
+    tokens = f", ~{prepared['image_tokens']} image tokens" if prepared["image_tokens"] else ""
+    print(
+        f"      {page}: {prepared['original_bytes'] / 1024:.0f} KB → "
+        f"{prepared['upload_bytes'] / 1024:.0f} KB {prepared['mime_type']}{tokens}"
+    )
+
+
+def page_cache_key(prepared: Dict[str, Any], tier: str = "full") -> str:
+    """Build the response cache key of a prepared page digitized with a routing tier."""
+    settings = page_router.TIERS[tier]
+    return response_cache.cache_key(
+        prepared["data"], settings["model"], PROMPT_VERSION, settings["thinking_budget"], prepared["mime_type"]
+    )
+
+
+def cached_page_keys(prepared: Dict[str, Any]) -> List[str]:
+    """Cache keys a page may have been stored under, most thorough tier first."""
+    return [page_cache_key(prepared, tier) for tier in reversed(page_router.TIER_ORDER)]
+
+
+def _prepare_page(image_file: Path) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Read a page image and shrink it for upload.
     
-    # Find all image files in the folder
-    image_extensions = {".png", ".jpg", ".jpeg", ".gif", ".bmp"}
-    image_files = sorted([
-        f for f in folder.iterdir()
-        if f.suffix.lower() in image_extensions and not f.name.startswith("Screenshot")
-    ])
+    Returns:
+        Tuple of (page label, prepared page or None if the image could not be read)
+    """
+    page = f"{image_file.parent.name}/{image_file.name}"
+    try:
+        prepared = page_preprocessor.prepare_page(str(image_file))
+    except Exception as e:
+        print(f"   ✗ {page}: failed to read image: {str(e)}")
+        return page, None
+    print_prepared_page(page, prepared)
+    return page, prepared
+
+
+def _cached_page(page: str, prepared: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the cached digitization of an unchanged page, made with any tier, if any."""
+    cached_response = response_cache.get_cache().get_any(cached_page_keys(prepared))
+    if cached_response is None:
+        return None
+    print(f"      ✓ {page}: digitization found in response cache")
+    return parse_response(cached_response)
+
+
+def review_attempt(
+    page: str,
+    prepared: Dict[str, Any],
+    features: Dict[str, Any],
+    tier: str,
+    latency: float,
+    result: Optional[structured_output.ModelResult],
+    error: Optional[Exception] = None
+) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Judge the result of a page request made with a routing tier.
     
-    if not image_files:
-        print(f"   ✗ No image files found in folder")
-        return {"error": f"No images found in {folder_name}"}
+    An acceptable result is stored in the response cache under the tier's
+    key. A request that failed, or whose result fails
+    page_router.validate_page, is escalated to the next tier; on the last
+    tier any parsed result is kept, as before routing.
     
-    print(f"   Found {len(image_files)} image(s) in folder")
+    Returns:
+        Tuple of (parsed data or None, whether the page is done)
+    """
+    last = tier == page_router.TIER_ORDER[-1]
+    usage = result.usage if result is not None else None
+    parsed_data = result.data if result is not None else None
+    if error is None:
+        problem = page_router.validate_page(parsed_data, features)
+    elif isinstance(error, json.JSONDecodeError):
+        problem = f"JSON parse error: {str(error)}"
+    else:
+        problem = f"request failed: {str(error)}"
     
-    # Process each image and combine results
-    combined_descriptions = []
-    all_image_prompts = []
+    if problem is None or (last and isinstance(parsed_data, dict)):
+        page_router.record_attempt(page, tier, features, latency, usage, "accepted")
+        response_cache.get_cache().put(
+            page_cache_key(prepared, tier), page_router.TIERS[tier]["model"], PROMPT_VERSION,
+            json.dumps(parsed_data, ensure_ascii=False),
+        )
+        return parsed_data, True
+    if last:
+        page_router.record_attempt(page, tier, features, latency, usage, "failed")
+        print(f"      ✗ {page}: {problem}")
+        return None, True
     
-    for idx, image_file in enumerate(image_files, 1):
-        print(f"\n   Processing image {idx}/{len(image_files)}: {image_file.name}")
-        
-        # Read the image file
+    page_router.record_attempt(page, tier, features, latency, usage, "escalated")
+    next_tier = page_router.TIER_ORDER[page_router.TIER_ORDER.index(tier) + 1]
+    print(f"      ↻ {page}: {tier} result rejected ({problem}); retrying with the {next_tier} tier")
+    return None, False
+
+
+def _request_page(
+    page: str,
+    prepared: Dict[str, Any],
+    features: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """Digitize one prepared page with its own request, starting at its routed tier."""
+    features = features or page_router.page_features(prepared)
+    for tier in page_router.escalation_path(page_router.route_page(features)):
+        settings = page_router.TIERS[tier]
+        print(f"      Generating JSON for {page} ({tier} tier)...")
+        started = time.monotonic()
+        result, error = None, None
         try:
-            with open(image_file, "rb") as img_file:
-                image_data = img_file.read()
+            result = resilience.call(
+                settings["model"],
+                functools.partial(generate_json, model=settings["model"], thinking_budget=settings["thinking_budget"]),
+                prepared["data"],
+                prepared["mime_type"],
+            )
         except Exception as e:
-            print(f"   ✗ Failed to read image: {str(e)}")
+            error = e
+        parsed_data, done = review_attempt(
+            page, prepared, features, tier, time.monotonic() - started, result, error
+        )
+        if done:
+            return parsed_data
+    return None
+
+
+def _digitize_page(image_file: Path) -> Optional[Dict[str, Any]]:
+    """
+    Digitize one page image.
+    
+    The page is routed to the cheapest tier its complexity allows (see
+    page_router) and escalated when that tier's result is not good enough.
+    
+    Args:
+        image_file: Path to the page image
+        
+    Returns:
+        Parsed {Description, Images} data, or None if the page failed
+    """
+    page, prepared = _prepare_page(image_file)
+    if prepared is None:
+        return None
+    
+    cached = _cached_page(page, prepared)
+    if cached is not None:
+        return cached
+    return _request_page(page, prepared)
+
+
+def split_batch_response(batch_data: Dict[str, Any], page_count: int) -> List[Dict[str, Any]]:
+    """
+    Split a batched digitization response into per-page {Description, Images} data.
+    
+    Args:
+        batch_data: Result data of digital_notes_json_genrator.generate_batch
+        page_count: Number of pages sent in the batch
+        
+    Returns:
+        Parsed data of each page, in page order
+        
+    Raises:
+        ValueError: If the response does not hold exactly one entry per page
+    """
+    entries = (batch_data.get("Pages") if isinstance(batch_data, dict) else None) or []
+    by_number = {entry.get("Page"): entry for entry in entries if isinstance(entry, dict)}
+    if sorted(number for number in by_number if isinstance(number, int)) == list(range(1, page_count + 1)):
+        ordered = [by_number[number] for number in range(1, page_count + 1)]
+    elif len(entries) == page_count:
+        ordered = entries
+    else:
+        raise ValueError(f"expected {page_count} pages, got {len(entries)}")
+    
+    pages = []
+    for entry in ordered:
+        if not isinstance(entry, dict) or not entry.get("Description"):
+            raise ValueError("batch entry without a description")
+        pages.append({"Description": entry["Description"], "Images": entry.get("Images", [])})
+    return pages
+
+
+def _digitize_batch(batch: List[Tuple[str, Dict[str, Any]]]) -> List[Optional[Dict[str, Any]]]:
+    """Digitize several prepared pages in one request, falling back to one request per page."""
+    if len(batch) == 1:
+        return [_request_page(*batch[0])]
+    
+    labels = ", ".join(page for page, _ in batch)
+    print(f"      Generating JSON for {len(batch)} pages in one request ({labels})...")
+    try:
+        result = resilience.call(
+            MODEL, generate_batch, [(prepared["data"], prepared["mime_type"]) for _, prepared in batch]
+        )
+        page_results = split_batch_response(result.data, len(batch))
+    except Exception as e:
+        print(f"      ✗ Batch of {len(batch)} pages failed ({e}); retrying page by page")
+        return [_request_page(page, prepared) for page, prepared in batch]
+    
+    cache = response_cache.get_cache()
+    for (_, prepared), parsed_data in zip(batch, page_results):
+        cache.put(page_cache_key(prepared), MODEL, PROMPT_VERSION, json.dumps(parsed_data, ensure_ascii=False))
+    return page_results
+
+
+def _digitize_pages(image_files: List[Path], map_fn: Callable) -> List[Optional[Dict[str, Any]]]:
+    """Digitize every page with its own request."""
+    return list(map_fn(_digitize_page, image_files))
+
+
+def _digitize_batched(image_files: List[Path], map_fn: Callable) -> List[Optional[Dict[str, Any]]]:
+    """Digitize the uncached pages of a folder in multi-page requests.
+    
+    Consecutive uncached pages are grouped by plan_batches, so each request
+    carries the system prompt once for several pages.
+    """
+    prepared_pages = list(map_fn(_prepare_page, image_files))
+    page_results = [None] * len(image_files)
+    uncached = []
+    for index, (page, prepared) in enumerate(prepared_pages):
+        if prepared is None:
             continue
+        page_results[index] = _cached_page(page, prepared)
+        if page_results[index] is None:
+            uncached.append(index)
+    
+    # A page Pillow could not measure gets a batch of its own
+    page_tokens = [
+        prepared_pages[index][1]["image_tokens"] or BATCH_SETTINGS["input_token_budget"]
+        for index in uncached
+    ]
+    batches = [[uncached[position] for position in batch] for batch in plan_batches(page_tokens)]
+    batch_results = map_fn(_digitize_batch, [[prepared_pages[index] for index in batch] for batch in batches])
+    for batch, results in zip(batches, batch_results):
+        for index, parsed_data in zip(batch, results):
+            page_results[index] = parsed_data
+    return page_results
+
+
+def _duplicate_result(image_file: Path, page_index: page_dedup.PageIndex) -> Optional[Dict[str, Any]]:
+    """Result of a near-duplicate page: its representative's, unless both are in one folder."""
+    representative = page_index.representative(image_file)
+    if representative.parent == image_file.parent:
+        print(f"      ⊘ {image_file.name}: near-duplicate of {representative.name}, skipped")
+        return None
+    parsed_data = page_index.result(image_file)
+    print(
+        f"      ✓ {image_file.name}: near-duplicate of "
+        f"{representative.parent.name}/{representative.name}, reusing its digitization"
+    )
+    return parsed_data
+
+
+def save_folder_json(
+    folder: Path,
+    image_files: List[Path],
+    page_results: List[Optional[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    Combine per-page results in page order and save the folder JSON.
+    
+    Args:
+        folder: Folder containing the images
+        image_files: Page images in order
+        page_results: Parsed data of each page (None for failed pages)
         
-        # Generate JSON from image
-        print(f"      Generating JSON...")
-        try:
-            json_response = generate_json(image_data)
-            response_data = json.loads(json_response)
-            
-            # Extract the actual content from the nested response structure
-            if "candidates" in response_data:
-                # Check if there's a pre-parsed field (for structured output)
-                if "parsed" in response_data and response_data["parsed"]:
-                    parsed_data = response_data["parsed"]
-                    print(f"      ✓ Using pre-parsed structured output")
-                else:
-                    # Fallback: Extract from parts and combine all text parts
-                    parts = response_data["candidates"][0]["content"]["parts"]
-                    
-                    # Combine all text parts
-                    text_parts = []
-                    for part in parts:
-                        if "text" in part and part["text"]:
-                            text_parts.append(part["text"])
-                    
-                    content_text = "".join(text_parts)
-                    
-                    # Try different parsing approaches
-                    try:
-                        # First try: direct JSON parse
-                        parsed_data = json.loads(content_text)
-                    except json.JSONDecodeError:
-                        # Second try: fix common issues with escaped strings
-                        try:
-                            # Remove markdown code blocks if present
-                            content_text = content_text.strip()
-                            if content_text.startswith("```json"):
-                                content_text = content_text[7:]
-                            if content_text.startswith("```"):
-                                content_text = content_text[3:]
-                            if content_text.endswith("```"):
-                                content_text = content_text[:-3]
-                            content_text = content_text.strip()
-                            
-                            parsed_data = json.loads(content_text)
-                        except json.JSONDecodeError as e:
-                            print(f"      ✗ JSON parse error: {str(e)}")
-                            continue
-            else:
-                parsed_data = response_data
-            
-            # Extract description and image prompts
-            description = parsed_data.get("Description", "")
-            image_prompts = parsed_data.get("Images", [])
-            
-            if description:
-                combined_descriptions.append({
-                    "image": image_file.name,
-                    "description": description
-                })
-                print(f"      ✓ Description extracted ({len(description)} chars)")
-            
-            if image_prompts:
-                all_image_prompts.extend(image_prompts)
-                print(f"      ✓ Found {len(image_prompts)} image prompt(s)")
-                
-        except Exception as e:
-            print(f"      ✗ Failed to generate JSON: {str(e)}")
+    Returns:
+        Dict with processing results
+    """
+    folder_name = folder.name
+    combined_descriptions = []
+    all_image_prompts = []
+    
+    for image_file, parsed_data in zip(image_files, page_results):
+        if not parsed_data:
             continue
+        
+        # Extract description and image prompts
+        description = parsed_data.get("Description", "")
+        image_prompts = parsed_data.get("Images", [])
+        
+        if description:
+            combined_descriptions.append({
+                "image": image_file.name,
+                "description": description
+            })
+            print(f"      ✓ {image_file.name}: description extracted ({len(description)} chars)")
+        
+        if image_prompts:
+            all_image_prompts.extend(image_prompts)
+            print(f"      ✓ {image_file.name}: found {len(image_prompts)} image prompt(s)")
     
     if not combined_descriptions:
         return {"error": f"No descriptions generated for {folder_name}"}
@@ -153,17 +376,109 @@ def process_folder(
     }
 
 
+def process_folder(
+    folder_path: str,
+    output_base_dir: str = "vlsi",
+    max_in_flight: Optional[int] = None,
+    page_executor: Optional[Executor] = None,
+    batch: bool = False,
+    page_index: Optional[page_dedup.PageIndex] = None
+) -> Dict[str, Any]:
+    """
+    Process all images in a folder: generate combined JSON.
+    
+    Pages are digitized concurrently; the combined JSON always lists them in
+    page order. Only one page of each cluster of near-duplicates is sent to
+    the model (see page_dedup.PageIndex).
+    
+    Args:
+        folder_path: Path to the folder containing images
+        output_base_dir: Base directory for outputs (default: vlsi)
+        max_in_flight: Maximum number of requests in flight at once; 1 processes
+            the pages one by one (default: the model's concurrency limit)
+        page_executor: Executor to digitize pages on, shared by several folders;
+            overrides max_in_flight
+        batch: Send several pages per request, within BATCH_SETTINGS (default: False)
+        page_index: Near-duplicate index of the whole course; every folder in it
+            must be processed (default: an index of this folder, if
+            DEDUP_SETTINGS["enabled"])
+        
+    Returns:
+        Dict with processing results
+    """
+    folder = Path(folder_path)
+    folder_name = folder.name
+    
+    print(f"\n{'='*60}")
+    print(f"Processing Folder: {folder_name}")
+    print(f"{'='*60}")
+    
+    # Find all image files in the folder
+    image_files = find_images(folder)
+    
+    if not image_files:
+        print(f"   ✗ No image files found in folder")
+        return {"error": f"No images found in {folder_name}"}
+    
+    print(f"   Found {len(image_files)} image(s) in folder")
+    
+    if page_index is None and page_dedup.DEDUP_SETTINGS["enabled"]:
+        page_index = page_dedup.PageIndex(image_files)
+    unique_files = [
+        f for f in image_files
+        if page_index is None or page_index.representative(f) is None
+    ]
+    
+    # map() yields results in submission order, whatever order the pages finish in
+    digitize = _digitize_batched if batch else _digitize_pages
+    unique_results = [None] * len(unique_files)
+    try:
+        if page_executor is not None:
+            unique_results = digitize(unique_files, page_executor.map)
+        else:
+            max_in_flight = max_in_flight or default_in_flight()
+            if max_in_flight > 1 and len(unique_files) > 1:
+                with ThreadPoolExecutor(max_workers=min(max_in_flight, len(unique_files))) as executor:
+                    unique_results = digitize(unique_files, executor.map)
+            else:
+                unique_results = digitize(unique_files, map)
+    finally:
+        # Duplicates in other folders wait for these results, even failed ones
+        if page_index is not None:
+            for image_file, parsed_data in zip(unique_files, unique_results):
+                page_index.resolve(image_file, parsed_data)
+    
+    results_by_file = dict(zip(unique_files, unique_results))
+    page_results = [
+        results_by_file[f] if f in results_by_file else _duplicate_result(f, page_index)
+        for f in image_files
+    ]
+    return save_folder_json(folder, image_files, page_results)
+
+
 def process_all_folders(
-    base_dir: str = "vlsi"
+    base_dir: str = "vlsi",
+    parallel: bool = True,
+    max_in_flight: Optional[int] = None,
+    batch: bool = False
 ) -> List[Dict[str, Any]]:
     """
     Process all folders in the base directory.
     
+    In parallel mode every folder is started at once and all their pages share
+    one pool of max_in_flight workers, so a course takes about as long as its
+    slowest pages rather than the sum of its folders. Requests are still
+    capped by the shared scheduler's limits for the model.
+    
     Args:
         base_dir: Base directory containing numbered folders
+        parallel: Whether to process folders and pages concurrently (default: True)
+        max_in_flight: Maximum number of requests in flight at once across all
+            folders (default: the model's concurrency limit)
+        batch: Send several pages per request, within BATCH_SETTINGS (default: False)
         
     Returns:
-        List of processing results for each folder
+        List of processing results for each folder, in folder order
     """
     base_path = Path(base_dir)
     
@@ -189,10 +504,27 @@ def process_all_folders(
     
     print(f"\nFound {len(folders)} folder(s) to process: {[f.name for f in folders]}")
     
-    results = []
-    for folder in folders:
-        result = process_folder(str(folder), base_dir)
-        results.append(result)
+    # Near-duplicates are detected across the whole course, not just within a folder
+    page_index = None
+    if page_dedup.DEDUP_SETTINGS["enabled"]:
+        page_index = page_dedup.PageIndex([f for folder in folders for f in find_images(folder)])
+    
+    if parallel:
+        max_in_flight = max_in_flight or default_in_flight()
+        print(f"Pages in flight: {max_in_flight}")
+        with ThreadPoolExecutor(max_workers=max_in_flight) as page_executor, \
+                ThreadPoolExecutor(max_workers=len(folders)) as folder_executor:
+            results = list(folder_executor.map(
+                lambda folder: process_folder(
+                    str(folder), base_dir, page_executor=page_executor, batch=batch, page_index=page_index
+                ),
+                folders,
+            ))
+    else:
+        results = []
+        for folder in folders:
+            result = process_folder(str(folder), base_dir, max_in_flight=1, batch=batch, page_index=page_index)
+            results.append(result)
     
     # Print summary
     print(f"\n{'='*60}")
@@ -209,6 +541,15 @@ def process_all_folders(
         print(f"Total images processed: {total_images}")
         print(f"Total image prompts collected: {total_prompts}")
     
+    if page_index is not None:
+        page_index.print_report()
+    page_preprocessor.print_upload_report()
+    response_cache.get_cache().print_report()
+    response_cache.get_cache().record_run()
+    prompt_cache.get_prompt_cache().print_report()
+    page_router.print_report()
+    resilience.print_latency_report()
+    genai_client.print_connection_stats()
     return results
 
 
@@ -0,0 +1,163 @@
+import os
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+# Pages are hashed on a HASH_SIZE x HASH_SIZE grid (256 bits); two pages are
+# near-duplicates when both their dHash and their pHash differ in at most
+# "threshold" bits. Re-exports, rescaled copies and brightness changes of a
+# page stay below 40 bits, while two different pages of the same ruled
+# notebook (similar layout, different writing) are over 55 bits apart.
+DEDUP_SETTINGS = {
+    "enabled": os.getenv("NARRATOR_DEDUP", "1") != "0",
+    "threshold": int(os.getenv("NARRATOR_DEDUP_THRESHOLD", "40")),
+}
+
+HASH_SIZE = 16
+
+
+def _grayscale(image_path: Path) -> Image.Image:
+    with Image.open(image_path) as source:
+        return ImageOps.exif_transpose(source).convert("L")
+
+
+def dhash(image: Image.Image) -> int:
+    """Difference hash: whether each pixel is brighter than its right neighbour."""
+    pixels = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Orthonormal DCT-II basis of the given size."""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    basis = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    basis[0] /= np.sqrt(2.0)
+    return basis
+
+
+_DCT = _dct_matrix(HASH_SIZE * 4)
+
+
+def phash(image: Image.Image) -> int:
+    """Perceptual hash: signs of the lowest DCT frequencies against their median."""
+    size = HASH_SIZE * 4
+    pixels = np.asarray(image.resize((size, size), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    # The DC term is the page's overall brightness, not its content
+    bits = low > np.median(low[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits of two hashes."""
+    return bin(a ^ b).count("1")
+
+
+def page_hashes(image_path: Path) -> Optional[Tuple[int, int]]:
+    """Return the (dHash, pHash) of a page image, or None if Pillow cannot read it."""
+    try:
+        image = _grayscale(image_path)
+    except (OSError, ValueError):
+        return None
+    return dhash(image), phash(image)
+
+
+class PageIndex:
+    """Perceptual-hash index of the pages of a course.
+
+    Pages within the threshold of each other are clustered, and the first
+    page of each cluster in course order is its representative: the only one
+    sent to the model. A duplicate in another folder than its representative
+    takes over the representative's result, so both folders keep the
+    content; a duplicate in the same folder is skipped.
+    """
+
+    def __init__(self, image_files: List[Path], threshold: Optional[int] = None):
+        """
+        Args:
+            image_files: Page images in course order (folder by folder)
+            threshold: Maximum Hamming distance of near-duplicates
+                (default: DEDUP_SETTINGS["threshold"])
+        """
+        self.threshold = DEDUP_SETTINGS["threshold"] if threshold is None else threshold
+        self.representatives = {}
+        self.distances = {}
+        self.results = {}
+        self.lock = threading.Lock()
+
+        hashed = [(Path(f), page_hashes(Path(f))) for f in image_files]
+        parent = list(range(len(hashed)))
+        closest = {}
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, (_, hashes_i) in enumerate(hashed):
+            if hashes_i is None:
+                continue
+            for j in range(i + 1, len(hashed)):
+                hashes_j = hashed[j][1]
+                if hashes_j is None:
+                    continue
+                distance = max(hamming(hashes_i[0], hashes_j[0]), hamming(hashes_i[1], hashes_j[1]))
+                if distance <= self.threshold:
+                    # The earlier page always stays the root of its cluster
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+                    closest[j] = min(distance, closest.get(j, distance))
+
+        for i, (image_file, _) in enumerate(hashed):
+            root = find(i)
+            if root != i:
+                self.representatives[image_file] = hashed[root][0]
+                self.distances[image_file] = closest.get(i)
+                self.results.setdefault(hashed[root][0], Future())
+
+    def representative(self, image_file: Path) -> Optional[Path]:
+        """Return the page a near-duplicate is represented by, or None for representatives."""
+        return self.representatives.get(Path(image_file))
+
+    def duplicates(self) -> List[Tuple[Path, Path, Optional[int]]]:
+        """List (duplicate, representative, distance to its closest earlier match) of every skipped page."""
+        return [
+            (image_file, representative, self.distances.get(image_file))
+            for image_file, representative in self.representatives.items()
+        ]
+
+    def resolve(self, image_file: Path, result: Optional[Dict[str, Any]]):
+        """Publish the digitization of a representative to its duplicates."""
+        future = self.results.get(Path(image_file))
+        with self.lock:
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    def future(self, image_file: Path) -> Future:
+        """Return the Future that receives the digitization of a duplicate's representative."""
+        return self.results[self.representative(image_file)]
+
+    def result(self, image_file: Path) -> Optional[Dict[str, Any]]:
+        """Wait for and return the digitization of a duplicate's representative."""
+        return self.future(image_file).result()
+
+    def print_report(self):
+        """Print every page that was not sent to the model because of a near-duplicate."""
+        duplicates = self.duplicates()
+        if not duplicates:
+            return
+        print(f"Near-duplicate pages: {len(duplicates)} skipped (threshold {self.threshold} bits)")
+        for image_file, representative, distance in duplicates:
+            print(
+                f"  • {image_file.parent.name}/{image_file.name} ≈ "
+                f"{representative.parent.name}/{representative.name} (distance {distance})"
+            )
@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import math
+import mimetypes
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+
+# How page photos are prepared before upload. "mode" is "color", "grayscale"
+# or "binarize" (black ink on white; "threshold" of None picks one per page).
+# Pages are never upscaled, and the original file is sent unchanged when
+# re-encoding would not make it smaller.
+DEFAULT_POLICY = {
+    "max_long_edge": 2048,
+    "mode": "color",
+    "threshold": None,
+    "format": "JPEG",
+    "quality": 85,
+}
+
+DEFAULT_CACHE_DIR = os.environ.get("NARRATOR_PAGE_CACHE", ".cache/pages")
+
+# Gemini bills an image of at most 384x384 px as one 258-token tile; larger
+# images are cut into 768x768 px tiles of 258 tokens each.
+TOKENS_PER_TILE = 258
+SMALL_IMAGE_EDGE = 384
+TILE_EDGE = 768
+
+FORMAT_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+    "BMP": "image/bmp",
+}
+
+_totals = {"pages": 0, "original_bytes": 0, "upload_bytes": 0, "image_tokens": 0, "cache_hits": 0}
+_totals_lock = threading.Lock()
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate the input tokens Gemini charges for an image of the given size."""
+    if width <= SMALL_IMAGE_EDGE and height <= SMALL_IMAGE_EDGE:
+        return TOKENS_PER_TILE
+    return TOKENS_PER_TILE * math.ceil(width / TILE_EDGE) * math.ceil(height / TILE_EDGE)
+
+
+def _otsu_threshold(image: Image.Image) -> int:
+    """Pick the gray level that best separates ink from paper."""
+    histogram = image.histogram()
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background_count = 0
+    background_sum = 0
+    best_threshold, best_variance = 128, -1.0
+    for level, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += level * count
+        background_mean = background_sum / background_count
+        foreground_mean = (weighted_total - background_sum) / foreground_count
+        variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+
+def _transform(image: Image.Image, policy: Dict) -> Image.Image:
+    """Apply orientation, downscaling and color reduction to a page."""
+    # Phone photos are often stored sideways with an EXIF rotation flag
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image)
+    image = image.convert("RGB")
+
+    max_long_edge = policy["max_long_edge"]
+    if max_long_edge and max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+    if policy["mode"] in ("grayscale", "binarize"):
+        image = image.convert("L")
+    if policy["mode"] == "binarize":
+        threshold = policy["threshold"]
+        if threshold is None:
+            threshold = _otsu_threshold(image)
+        image = image.point(lambda level: 255 if level > threshold else 0, mode="1")
+    return image
+
+
+def _encode(image: Image.Image, policy: Dict, source_format: Optional[str]) -> Tuple[bytes, str]:
+    """Encode a page in the policy format, or as PNG if that is smaller.
+
+    Bilevel pages and scans that were lossless to begin with (flat colors,
+    thin strokes) often compress better as PNG than as JPEG.
+
+    Returns:
+        Tuple of (encoded bytes, format name)
+    """
+    formats = [policy["format"].upper()]
+    if image.mode == "1":
+        formats = ["PNG"]
+    elif source_format in ("PNG", "GIF", "BMP") and "PNG" not in formats:
+        formats.append("PNG")
+
+    candidates = []
+    for image_format in formats:
+        buffer = io.BytesIO()
+        if image_format in ("JPEG", "WEBP"):
+            image.save(buffer, format=image_format, quality=policy["quality"], optimize=True)
+        else:
+            image.save(buffer, format=image_format, optimize=True)
+        candidates.append((buffer.getvalue(), image_format))
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+def _record(page: Dict):
+    with _totals_lock:
+        _totals["pages"] += 1
+        _totals["original_bytes"] += page["original_bytes"]
+        _totals["upload_bytes"] += page["upload_bytes"]
+        _totals["image_tokens"] += page["image_tokens"]
+        _totals["cache_hits"] += int(page["cached"])
+
+
+def prepare_page(
+    image_path: str,
+    policy: Optional[Dict] = None,
+    cache_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """Prepare a page image for upload according to the preprocessing policy.
+
+    The result is cached on disk under a hash of the original bytes and the
+    policy, so a page is only decoded and re-encoded once.
+
+    Args:
+        image_path: Path to the page image
+        policy: Overrides of DEFAULT_POLICY
+        cache_dir: Directory of processed pages (default: DEFAULT_CACHE_DIR)
+
+    Returns:
+        Dict with "data" (bytes to upload), "mime_type", "width", "height",
+        "original_bytes", "upload_bytes", "image_tokens" and "cached" keys
+    """
+    page_policy = dict(DEFAULT_POLICY, **(policy or {}))
+    original = Path(image_path).read_bytes()
+    digest = hashlib.sha256(original)
+    digest.update(json.dumps(page_policy, sort_keys=True).encode("utf-8"))
+    cache_path = Path(cache_dir or DEFAULT_CACHE_DIR) / f"{digest.hexdigest()}.json"
+
+    if cache_path.exists():
+        with open(cache_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        data_path = cache_path.with_suffix(meta["suffix"])
+        if meta["suffix"] == "" or data_path.exists():
+            data = original if meta["suffix"] == "" else data_path.read_bytes()
+            page = dict(meta["page"], data=data, original_bytes=len(original), upload_bytes=len(data), cached=True)
+            _record(page)
+            return page
+
+    try:
+        with Image.open(io.BytesIO(original)) as source:
+            source_format = source.format
+            source_size = source.size
+            upright = source.getexif().get(0x0112, 1) == 1
+            transformed = _transform(source, page_policy)
+    except (OSError, ValueError) as e:
+        # Pillow cannot decode it; let the model try the original bytes
+        print(f"      ⚠ {Path(image_path).name}: preprocessing skipped ({e})")
+        mime_type = mimetypes.guess_type(str(image_path))[0] or "application/octet-stream"
+        return {
+            "data": original,
+            "mime_type": mime_type,
+            "width": None,
+            "height": None,
+            "original_bytes": len(original),
+            "upload_bytes": len(original),
+            "image_tokens": None,
+            "cached": False,
+        }
+
+    encoded, image_format = _encode(transformed, page_policy, source_format)
+    unchanged = page_policy["mode"] == "color" and upright and transformed.size == source_size
+    if unchanged and len(encoded) >= len(original) and source_format in FORMAT_MIME_TYPES:
+        data, mime_type, suffix = original, FORMAT_MIME_TYPES[source_format], ""
+    else:
+        data, mime_type, suffix = encoded, FORMAT_MIME_TYPES[image_format], f".{image_format.lower()}"
+
+    width, height = transformed.size
+    page = {
+        "mime_type": mime_type,
+        "width": width,
+        "height": height,
+        "image_tokens": estimate_image_tokens(width, height),
+    }
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    if suffix:
+        tmp_data_path = cache_path.with_name(f".{cache_path.stem}{suffix}.part")
+        tmp_data_path.write_bytes(data)
+        os.replace(tmp_data_path, cache_path.with_suffix(suffix))
+    tmp_meta_path = cache_path.with_name(f".{cache_path.name}.part")
+    with open(tmp_meta_path, "w", encoding="utf-8") as f:
+        json.dump({"suffix": suffix, "page": page}, f)
+    os.replace(tmp_meta_path, cache_path)
+
+    page = dict(page, data=data, original_bytes=len(original), upload_bytes=len(data), cached=False)
+    _record(page)
+    return page
+
+
+def print_upload_report():
+    """Print the upload savings of the pages prepared so far."""
+    with _totals_lock:
+        totals = dict(_totals)
+    if not totals["pages"]:
+        return
+    saved = 100.0 * (1 - totals["upload_bytes"] / totals["original_bytes"]) if totals["original_bytes"] else 0.0
+    print(
+        f"Page uploads: {totals['pages']} page(s), {totals['original_bytes'] / 1e6:.1f} MB → "
+        f"{totals['upload_bytes'] / 1e6:.1f} MB ({saved:.0f}% saved), "
+        f"~{totals['image_tokens']} image tokens, {totals['cache_hits']} from cache"
+    )
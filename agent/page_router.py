@@ -0,0 +1,252 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageChops, ImageFilter
+
+from agent import page_preprocessor, resilience, structured_output
+from agent.digital_notes_json_genrator import MODEL, THINKING_BUDGET
+
+
+# Request configurations a page can be digitized with, cheapest first. A page
+# starts at the tier picked by route_page and moves up one tier whenever its
+# result fails validate_page; "full" is the configuration every page used
+# before routing, and its results are always accepted. Light pages stay on
+# MODEL with a small thinking budget unless NARRATOR_ROUTING_FLASH=1 also
+# moves them to the cheaper LIGHT_MODEL.
+LIGHT_MODEL = "gemini-2.5-flash"
+TIERS = {
+    "light": {
+        "model": LIGHT_MODEL if os.getenv("NARRATOR_ROUTING_FLASH", "0") == "1" else MODEL,
+        "thinking_budget": 2048,
+    },
+    "standard": {"model": MODEL, "thinking_budget": 8192},
+    "full": {"model": MODEL, "thinking_budget": THINKING_BUDGET},
+}
+TIER_ORDER = ["light", "standard", "full"]
+
+# Thresholds of the complexity signals measured by page_features, on a copy
+# of the page scaled to "analysis_edge". Ink is whatever is at least
+# "ink_contrast" gray levels darker than the paper around it, so shadows of
+# phone photos and pale ruling do not count. Densities are fractions of the
+# page's pixels; "diagram_lines" is the length of vertical strokes longer
+# than a few ruled lines (wires, axes, boxes) in page heights. A light page
+# must come back with at least "min_description_chars", plus
+# "chars_per_ink_percent" per percent of ink on the page.
+ROUTER_SETTINGS = {
+    "enabled": os.getenv("NARRATOR_PAGE_ROUTING", "1") != "0",
+    "analysis_edge": 1024,
+    "ink_contrast": 35,
+    "light_ink_density": 0.03,
+    "light_edge_density": 0.04,
+    "light_max_edge": page_preprocessor.SMALL_IMAGE_EDGE,
+    "dense_ink_density": 0.095,
+    "dense_edge_density": 0.12,
+    "diagram_lines": 1.5,
+    "min_description_chars": 200,
+    "chars_per_ink_percent": 40,
+}
+
+DEFAULT_LOG_PATH = os.environ.get("NARRATOR_ROUTING_LOG", ".cache/routing.jsonl")
+
+_tier_stats = {
+    tier: {"requests": 0, "accepted": 0, "escalated": 0, "failed": 0,
+           "input_tokens": 0, "output_tokens": 0, "thinking_tokens": 0}
+    for tier in TIER_ORDER
+}
+_tier_latency = {tier: resilience.LatencyHistogram() for tier in TIER_ORDER}
+_stats_lock = threading.Lock()
+
+_INK_RUN = re.compile(rb"\x00+")
+
+
+def _vertical_strokes(ink: Image.Image) -> float:
+    """Total length of vertical ink strokes that could belong to a diagram, in page heights.
+
+    Handwriting strokes are shorter than a twentieth of the page, and margin
+    lines and page edges run longer than half of it; both are left out.
+    """
+    columns = ink.transpose(Image.Transpose.ROTATE_90)
+    width, height = columns.size
+    data = columns.tobytes()
+    shortest, longest = max(2, width // 20), width // 2
+    total = 0
+    for offset in range(0, len(data), width):
+        for stroke in _INK_RUN.findall(data[offset:offset + width]):
+            if shortest <= len(stroke) <= longest:
+                total += len(stroke)
+    return total / width
+
+
+def page_features(prepared: Dict[str, Any]) -> Dict[str, Any]:
+    """Measure cheap complexity signals of a prepared page.
+
+    Args:
+        prepared: Page as returned by page_preprocessor.prepare_page
+
+    Returns:
+        Dict with "ink_density", "edge_density", "diagram_lines", "long_edge"
+        and "image_tokens" (the image signals are None if Pillow cannot read the page)
+    """
+    features = {
+        "ink_density": None,
+        "edge_density": None,
+        "diagram_lines": None,
+        "long_edge": max(prepared.get("width") or 0, prepared.get("height") or 0) or None,
+        "image_tokens": prepared.get("image_tokens"),
+    }
+    try:
+        with Image.open(io.BytesIO(prepared["data"])) as source:
+            image = source.convert("L")
+    except (OSError, ValueError):
+        return features
+
+    edge = ROUTER_SETTINGS["analysis_edge"]
+    image.thumbnail((edge, edge), Image.BILINEAR)
+    pixels = image.size[0] * image.size[1]
+
+    # Darkness relative to the brightest pixel nearby, i.e. the local paper
+    contrast = ImageChops.subtract(image.filter(ImageFilter.MaxFilter(9)), image)
+    contrast_level = ROUTER_SETTINGS["ink_contrast"]
+    ink = contrast.point(lambda level: 0 if level > contrast_level else 255)
+    edges = contrast.filter(ImageFilter.FIND_EDGES)
+
+    features.update(
+        ink_density=round(ink.histogram()[0] / pixels, 4),
+        edge_density=round(sum(edges.histogram()[contrast_level:]) / pixels, 4),
+        diagram_lines=round(_vertical_strokes(ink), 2),
+    )
+    return features
+
+
+def route_page(features: Dict[str, Any]) -> str:
+    """Pick the cheapest tier likely to digitize a page well.
+
+    Returns:
+        str: Key of TIERS
+    """
+    settings = ROUTER_SETTINGS
+    if not settings["enabled"] or features["ink_density"] is None:
+        return "full"
+    if features["diagram_lines"] >= settings["diagram_lines"]:
+        return "full"
+    if features["ink_density"] >= settings["dense_ink_density"]:
+        return "full"
+    if features["edge_density"] >= settings["dense_edge_density"]:
+        return "full"
+    # A clipping this small holds a few words at most
+    small = (features["long_edge"] or 0) <= settings["light_max_edge"]
+    sparse = (
+        features["ink_density"] < settings["light_ink_density"]
+        and features["edge_density"] < settings["light_edge_density"]
+    )
+    if small or sparse:
+        return "light"
+    return "standard"
+
+
+def escalation_path(tier: str) -> List[str]:
+    """Tiers a page routed to tier may be tried with, in order."""
+    return TIER_ORDER[TIER_ORDER.index(tier):]
+
+
+def validate_page(parsed_data: Any, features: Dict[str, Any]) -> Optional[str]:
+    """Check that a page result is complete enough to keep.
+
+    Returns:
+        None if the result is acceptable, otherwise what is wrong with it
+    """
+    if not isinstance(parsed_data, dict):
+        return "response is not a JSON object"
+    description = parsed_data.get("Description")
+    images = parsed_data.get("Images", [])
+    if not isinstance(description, str) or not description.strip():
+        return "missing Description"
+    if not isinstance(images, list) or not all(isinstance(prompt, str) for prompt in images):
+        return "Images is not a list of strings"
+
+    min_chars = ROUTER_SETTINGS["min_description_chars"]
+    if features["ink_density"]:
+        min_chars += int(ROUTER_SETTINGS["chars_per_ink_percent"] * features["ink_density"] * 100)
+    if len(description) < min_chars:
+        return f"description too short ({len(description)} < {min_chars} chars)"
+    return None
+
+
+def record_attempt(
+    page: str,
+    tier: str,
+    features: Dict[str, Any],
+    latency: float,
+    usage: Optional[structured_output.Usage],
+    outcome: str,
+    log_path: Optional[str] = None
+):
+    """Add one request to the per-tier totals and the routing log.
+
+    Every request is appended to the routing log as a JSON line with the
+    page's features, so the thresholds in ROUTER_SETTINGS can be tuned
+    against real runs.
+
+    Args:
+        page: Page label
+        tier: Tier the request was sent with
+        features: Result of page_features
+        latency: Seconds the request took, including retries
+        usage: Token usage of the response, or None if the request failed
+        outcome: "accepted", "escalated" or "failed"
+        log_path: Routing log file (default: DEFAULT_LOG_PATH)
+    """
+    usage = (usage or structured_output.Usage()).to_dict()
+    _tier_latency[tier].record(latency)
+    with _stats_lock:
+        stats = _tier_stats[tier]
+        stats["requests"] += 1
+        stats[outcome] += 1
+        for name in ("input_tokens", "output_tokens", "thinking_tokens"):
+            stats[name] += usage[name]
+
+    log_path = log_path or DEFAULT_LOG_PATH
+    entry = dict(
+        page=page,
+        tier=tier,
+        model=TIERS[tier]["model"],
+        thinking_budget=TIERS[tier]["thinking_budget"],
+        outcome=outcome,
+        latency=round(latency, 3),
+        time=time.time(),
+        features=features,
+        **usage,
+    )
+    try:
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        with _stats_lock, open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        print(f"      ⚠ Could not write routing log {log_path}: {e}")
+
+
+def print_report():
+    """Print the requests, latency and token counts of each tier in this run."""
+    with _stats_lock:
+        stats = {tier: dict(counts) for tier, counts in _tier_stats.items()}
+    if not any(counts["requests"] for counts in stats.values()):
+        return
+    print("Page routing:")
+    for tier in TIER_ORDER:
+        counts = stats[tier]
+        if not counts["requests"]:
+            continue
+        hist = _tier_latency[tier]
+        print(
+            f"  • {tier} ({TIERS[tier]['model']}, thinking {TIERS[tier]['thinking_budget']}): "
+            f"{counts['requests']} request(s), {counts['accepted']} accepted, "
+            f"{counts['escalated']} escalated, {counts['failed']} failed, "
+            f"p50 {hist.quantile(0.5):.1f}s, p95 {hist.quantile(0.95):.1f}s, "
+            f"{counts['input_tokens']} in / {counts['output_tokens']} out / "
+            f"{counts['thinking_tokens']} thinking tokens"
+        )
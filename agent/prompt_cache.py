@@ -0,0 +1,380 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Iterator, Optional, Tuple
+
+from google.genai import types
+
+from agent import genai_client, resilience
+
+
+# Lifetime of a cached system prompt; handles are renewed "refresh_margin"
+# seconds before they expire so no request races the expiry.
+CACHE_SETTINGS = {
+    "ttl": int(os.getenv("NARRATOR_PROMPT_CACHE_TTL", "3600")),
+    "refresh_margin": 120,
+    "enabled": os.getenv("NARRATOR_PROMPT_CACHE", "1") != "0",
+}
+
+
+def _prompt_text(system_instruction: Any) -> str:
+    """Flatten a system_instruction (string, Part or list of Parts) to its text."""
+    if system_instruction is None:
+        return ""
+    if isinstance(system_instruction, str):
+        return system_instruction
+    if isinstance(system_instruction, (list, tuple)):
+        return "".join(_prompt_text(part) for part in system_instruction)
+    return getattr(system_instruction, "text", None) or ""
+
+
+class GeminiCacheBackend:
+    """Registers system prompts as Gemini cached content."""
+
+    def apply(self, config: types.GenerateContentConfig, handle: str) -> types.GenerateContentConfig:
+        """Point a request config at cached content instead of the inline prompt."""
+        return config.model_copy(update={"system_instruction": None, "cached_content": handle})
+
+    def create(self, model: str, system_instruction: Any, ttl: int) -> Tuple[str, float]:
+        cached = genai_client.get_client().caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                display_name="notion-narrator-system-prompt",
+                ttl=f"{ttl}s",
+            ),
+        )
+        return cached.name, _expiry(cached, ttl)
+
+    async def acreate(self, model: str, system_instruction: Any, ttl: int) -> Tuple[str, float]:
+        cached = await genai_client.get_client().aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                display_name="notion-narrator-system-prompt",
+                ttl=f"{ttl}s",
+            ),
+        )
+        return cached.name, _expiry(cached, ttl)
+
+
+def _expiry(cached: Any, ttl: int) -> float:
+    expire_time = getattr(cached, "expire_time", None)
+    return expire_time.timestamp() if expire_time is not None else time.time() + ttl
+
+
+class LocalCacheBackend:
+    """Offline stand-in for GeminiCacheBackend.
+
+    Hands out local handles with the same expiry and invalidation rules but
+    leaves the prompt inline in the request, so runs and tests behave exactly
+    like uncached ones while the cache bookkeeping and token report are
+    exercised. Set "fail" to simulate a model without caching support.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.created = []
+
+    def apply(self, config: types.GenerateContentConfig, handle: str) -> types.GenerateContentConfig:
+        return config
+
+    def create(self, model: str, system_instruction: Any, ttl: int) -> Tuple[str, float]:
+        if self.fail:
+            raise RuntimeError(f"context caching is not available for {model}")
+        handle = f"cachedContents/local-{len(self.created) + 1}"
+        self.created.append((handle, model, hashlib.sha256(_prompt_text(system_instruction).encode("utf-8")).hexdigest()))
+        return handle, time.time() + ttl
+
+    async def acreate(self, model: str, system_instruction: Any, ttl: int) -> Tuple[str, float]:
+        return self.create(model, system_instruction, ttl)
+
+
+class PromptCache:
+    """Keeps one cached-content handle per (model, system prompt).
+
+    A handle is reused until it is about to expire or the prompt text changes
+    (its hash is part of the key). If a model refuses to cache (e.g. the
+    prompt is under its minimum size) the prompt is sent inline from then on.
+    """
+
+    def __init__(self, backend: Optional[Any] = None):
+        self.backend = backend or GeminiCacheBackend()
+        self.handles = {}
+        self.unavailable = set()
+        self.lock = threading.Lock()
+        # One creation in flight per key: a lock per key for threads, and per
+        # key and event loop for coroutines, so a slow create holds up only
+        # the requests waiting for the same prompt
+        self.create_locks = {}
+        self.async_create_locks = weakref.WeakKeyDictionary()
+        self.stats = {"requests": 0, "cached_requests": 0, "input_tokens": 0, "cached_tokens": 0}
+
+    def _key(self, model: str, system_instruction: Any) -> Tuple[str, str]:
+        return model, hashlib.sha256(_prompt_text(system_instruction).encode("utf-8")).hexdigest()
+
+    def _valid_handle(self, key: Tuple[str, str]) -> Optional[str]:
+        with self.lock:
+            entry = self.handles.get(key)
+        if entry and entry["expires"] - CACHE_SETTINGS["refresh_margin"] > time.time():
+            return entry["name"]
+        return None
+
+    def _store(self, key: Tuple[str, str], name: str, expires: float, system_instruction: Any):
+        with self.lock:
+            self.handles[key] = {
+                "name": name,
+                "expires": expires,
+                # Rough size of the prompt, used when the backend reports no usage
+                "tokens": len(_prompt_text(system_instruction)) // 4,
+            }
+
+    def _create_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self.lock:
+            return self.create_locks.setdefault(key, threading.Lock())
+
+    def _async_create_lock(self, key: Tuple[str, str]) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            return self.async_create_locks.setdefault(loop, {}).setdefault(key, asyncio.Lock())
+
+    def _unavailable(self, model: str, error: Exception):
+        # A transient failure only skips the cache for this request
+        if resilience.is_retryable(error):
+            return
+        with self.lock:
+            if model in self.unavailable:
+                return
+            self.unavailable.add(model)
+        print(f"   ⚠ Prompt caching unavailable for {model} ({error}); sending prompts inline")
+
+    def handle(self, model: str, system_instruction: Any) -> Optional[str]:
+        """Return a live cached-content handle for the prompt, creating it if needed."""
+        if not CACHE_SETTINGS["enabled"] or not system_instruction or model in self.unavailable:
+            return None
+        key = self._key(model, system_instruction)
+        name = self._valid_handle(key)
+        if name:
+            return name
+        with self._create_lock(key):
+            # Another thread may have registered it while we waited
+            name = self._valid_handle(key)
+            if name:
+                return name
+            if model in self.unavailable:
+                return None
+            try:
+                name, expires = self.backend.create(model, system_instruction, CACHE_SETTINGS["ttl"])
+            except Exception as e:
+                self._unavailable(model, e)
+                return None
+            self._store(key, name, expires, system_instruction)
+        return name
+
+    async def ahandle(self, model: str, system_instruction: Any) -> Optional[str]:
+        """Async form of handle."""
+        if not CACHE_SETTINGS["enabled"] or not system_instruction or model in self.unavailable:
+            return None
+        key = self._key(model, system_instruction)
+        name = self._valid_handle(key)
+        if name:
+            return name
+        async with self._async_create_lock(key):
+            # Another task may have registered it while we waited
+            name = self._valid_handle(key)
+            if name:
+                return name
+            if model in self.unavailable:
+                return None
+            try:
+                name, expires = await self.backend.acreate(model, system_instruction, CACHE_SETTINGS["ttl"])
+            except Exception as e:
+                self._unavailable(model, e)
+                return None
+            self._store(key, name, expires, system_instruction)
+        return name
+
+    def invalidate(self, name: str):
+        """Forget a handle the service no longer recognizes."""
+        with self.lock:
+            for key, entry in list(self.handles.items()):
+                if entry["name"] == name:
+                    del self.handles[key]
+
+    def record_usage(self, response: Any, handle: Optional[str]):
+        """Add the input token counts of a response to the run totals."""
+        usage = getattr(response, "usage_metadata", None)
+        input_tokens = getattr(usage, "prompt_token_count", None) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+        if handle and not cached_tokens and isinstance(self.backend, LocalCacheBackend):
+            with self.lock:
+                entry = next((e for e in self.handles.values() if e["name"] == handle), None)
+            cached_tokens = min(input_tokens, entry["tokens"]) if entry and input_tokens else 0
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["cached_requests"] += int(bool(handle))
+            self.stats["input_tokens"] += input_tokens
+            self.stats["cached_tokens"] += cached_tokens
+
+    def print_report(self):
+        """Print cached versus uncached input tokens of this run."""
+        with self.lock:
+            stats = dict(self.stats)
+        if not stats["requests"]:
+            return
+        print(
+            f"Prompt cache: {stats['cached_requests']}/{stats['requests']} request(s) on cached prompts, "
+            f"{stats['cached_tokens']} cached + {stats['input_tokens'] - stats['cached_tokens']} uncached input tokens"
+        )
+
+
+def _is_cache_error(error: Exception) -> bool:
+    """True if a request failed because its cached content is gone or invalid."""
+    code = getattr(error, "code", None)
+    return code in (400, 403, 404) and "cache" in str(error).lower()
+
+
+_prompt_caches = {}
+_prompt_caches_lock = threading.Lock()
+
+
+def get_prompt_cache() -> PromptCache:
+    """Return the prompt cache of this process."""
+    with _prompt_caches_lock:
+        pid = os.getpid()
+        if pid not in _prompt_caches:
+            _prompt_caches[pid] = PromptCache()
+        return _prompt_caches[pid]
+
+
+def configure(backend: Any):
+    """Replace the prompt cache of this process with one using the given backend.
+
+    Args:
+        backend: GeminiCacheBackend, LocalCacheBackend or an object with the same methods
+    """
+    with _prompt_caches_lock:
+        _prompt_caches[os.getpid()] = PromptCache(backend)
+
+
+def generate_content(model: str, contents: Any, config: types.GenerateContentConfig):
+    """Call generate_content with the config's system prompt served from the cache.
+
+    Falls back to the inline prompt when caching is unavailable or the
+    service rejects the handle (e.g. it expired early).
+
+    Args:
+        model: Model the request is sent to
+        contents: Request contents
+        config: Request config carrying the system_instruction
+
+    Returns:
+        The GenerateContentResponse
+    """
+    cache = get_prompt_cache()
+    client = genai_client.get_client()
+    handle = cache.handle(model, config.system_instruction)
+    if handle:
+        try:
+            response = client.models.generate_content(
+                model=model, contents=contents, config=cache.backend.apply(config, handle)
+            )
+            cache.record_usage(response, handle)
+            return response
+        except Exception as e:
+            if not _is_cache_error(e):
+                raise
+            cache.invalidate(handle)
+
+    response = client.models.generate_content(model=model, contents=contents, config=config)
+    cache.record_usage(response, None)
+    return response
+
+
+async def agenerate_content(model: str, contents: Any, config: types.GenerateContentConfig):
+    """Async form of generate_content."""
+    cache = get_prompt_cache()
+    client = genai_client.get_client()
+    handle = await cache.ahandle(model, config.system_instruction)
+    if handle:
+        try:
+            response = await client.aio.models.generate_content(
+                model=model, contents=contents, config=cache.backend.apply(config, handle)
+            )
+            cache.record_usage(response, handle)
+            return response
+        except Exception as e:
+            if not _is_cache_error(e):
+                raise
+            cache.invalidate(handle)
+
+    response = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+    cache.record_usage(response, None)
+    return response
+
+
+def generate_content_stream(model: str, contents: Any, config: types.GenerateContentConfig) -> Iterator[Any]:
+    """Streaming form of generate_content, yielding response chunks as they arrive.
+
+    A rejected handle can only be replaced by the inline prompt before the
+    first chunk; the usage of the last chunk is added to the run totals.
+    """
+    cache = get_prompt_cache()
+    client = genai_client.get_client()
+    handle = cache.handle(model, config.system_instruction)
+    if handle:
+        stream = client.models.generate_content_stream(
+            model=model, contents=contents, config=cache.backend.apply(config, handle)
+        )
+        try:
+            first = next(stream, None)
+        except Exception as e:
+            if not _is_cache_error(e):
+                raise
+            cache.invalidate(handle)
+        else:
+            last = first
+            if first is not None:
+                yield first
+                for last in stream:
+                    yield last
+            cache.record_usage(last, handle)
+            return
+
+    last = None
+    for last in client.models.generate_content_stream(model=model, contents=contents, config=config):
+        yield last
+    cache.record_usage(last, None)
+
+
+async def agenerate_content_stream(model: str, contents: Any, config: types.GenerateContentConfig) -> AsyncIterator[Any]:
+    """Async form of generate_content_stream."""
+    cache = get_prompt_cache()
+    client = genai_client.get_client()
+    handle = await cache.ahandle(model, config.system_instruction)
+    if handle:
+        try:
+            stream = await client.aio.models.generate_content_stream(
+                model=model, contents=contents, config=cache.backend.apply(config, handle)
+            )
+            first = await anext(stream, None)
+        except Exception as e:
+            if not _is_cache_error(e):
+                raise
+            cache.invalidate(handle)
+        else:
+            last = first
+            if first is not None:
+                yield first
+                async for last in stream:
+                    yield last
+            cache.record_usage(last, handle)
+            return
+
+    last = None
+    async for last in await client.aio.models.generate_content_stream(model=model, contents=contents, config=config):
+        yield last
+    cache.record_usage(last, None)
@@ -0,0 +1,439 @@
+import asyncio
+import bisect
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from agent import scheduler
+
+
+# "deadline" bounds the whole call including retries. Hedging launches one
+# duplicate request once an attempt runs longer than the model's
+# "hedge_quantile" latency, provided "hedge_min_samples" calls were recorded.
+DEFAULT_POLICY = {
+    "max_attempts": 5,
+    "base_delay": 2.0,
+    "max_delay": 60.0,
+    "deadline": 600.0,
+    "hedge": False,
+    "hedge_quantile": 0.95,
+    "hedge_min_samples": 20,
+}
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300]
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call does not succeed before its deadline."""
+
+
+class EmptyResponse(Exception):
+    """Raised by attempt functions when the model returned no usable output."""
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    status_code = getattr(error, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Classify an exception raised by a model call.
+
+    HTTP 408/409/429/5xx, connection and timeout errors and empty responses are
+    retryable; everything else (bad request, auth, not found, bugs) is fatal.
+    """
+    if isinstance(error, (EmptyResponse, ConnectionError, TimeoutError)):
+        return True
+    code = _status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    try:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Return the server-requested delay in seconds, if the error carries one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    # google.rpc.RetryInfo in the error body, e.g. {"retryDelay": "30s"}
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+            if isinstance(delay, str) and delay.endswith("s"):
+                try:
+                    return float(delay[:-1])
+                except ValueError:
+                    pass
+    return None
+
+
+def backoff_delay(attempt: int, error: BaseException, policy: Dict) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's retry-after."""
+    delay = random.uniform(0, min(policy["max_delay"], policy["base_delay"] * (2 ** (attempt - 1))))
+    server_delay = retry_after(error)
+    if server_delay is not None:
+        delay = max(delay, server_delay)
+    return delay
+
+
+class LatencyHistogram:
+    """Latency histogram of one model, with a window of recent samples for quantiles."""
+
+    def __init__(self, window: int = 500):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(model: str) -> LatencyHistogram:
+    """Return the latency histogram of a model."""
+    with _histograms_lock:
+        if model not in _histograms:
+            _histograms[model] = LatencyHistogram()
+        return _histograms[model]
+
+
+def print_latency_report():
+    """Print the per-model latency histograms recorded so far."""
+    with _histograms_lock:
+        models = sorted(_histograms.items())
+    for model, hist in models:
+        if not len(hist):
+            continue
+        print(
+            f"{model}: {sum(hist.counts)} calls, p50 {hist.quantile(0.5):.1f}s, "
+            f"p95 {hist.quantile(0.95):.1f}s, max {max(hist.samples):.1f}s"
+        )
+        lower = 0
+        for upper, count in zip(LATENCY_BUCKETS + [float("inf")], hist.counts):
+            if count:
+                print(f"  • {lower:>5}-{upper:<5}s: {count}")
+            lower = upper
+
+
+def _hedge_threshold(model: str, policy: Dict) -> Optional[float]:
+    hist = histogram(model)
+    if not policy["hedge"] or len(hist) < policy["hedge_min_samples"]:
+        return None
+    return hist.quantile(policy["hedge_quantile"])
+
+
+class _TimerQueue:
+    """One thread running the deadline, retry and hedge timers of every call.
+
+    Timers are [due, sequence, action] entries in a heap; cancelling removes
+    the entry. Actions run on the timer thread and must return quickly.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        threading.Thread(target=self._run, name="resilience-timers", daemon=True).start()
+
+    def schedule(self, delay: float, action: Callable) -> list:
+        entry = [time.monotonic() + delay, next(self.sequence), action]
+        with self.condition:
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                self.condition.notify()
+        return entry
+
+    def cancel(self, entry: list):
+        with self.condition:
+            try:
+                self.heap.remove(entry)
+            except ValueError:
+                return
+            heapq.heapify(self.heap)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                action = heapq.heappop(self.heap)[2]
+            try:
+                action()
+            except Exception as e:
+                print(f"   ✗ Resilience timer action failed: {e}")
+
+
+_timer_queues = {}
+_timer_queues_lock = threading.Lock()
+
+
+def _timer_queue() -> _TimerQueue:
+    """Return the timer queue of this process."""
+    with _timer_queues_lock:
+        pid = os.getpid()
+        if pid not in _timer_queues:
+            _timer_queues[pid] = _TimerQueue()
+        return _timer_queues[pid]
+
+
+class _ResilientCall:
+    """State of one call across its attempts (see submit)."""
+
+    def __init__(self, model, fn, args, kwargs, policy, on_discard):
+        self.model = model
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.policy = policy
+        self.on_discard = on_discard
+        self.future = Future()
+        self.deadline = time.monotonic() + policy["deadline"]
+        self.attempts = 0
+        self.in_flight = 0
+        self.hedged = False
+        self.finished = False
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.timers = []
+
+    def start(self):
+        self._schedule(self.policy["deadline"], self._expire)
+        self._launch()
+
+    def _schedule(self, delay: float, action: Callable):
+        with self.lock:
+            if self.finished:
+                return
+            self.timers.append(_timer_queue().schedule(delay, action))
+
+    def _timed_attempt(self):
+        start = time.monotonic()
+        result = self.fn(*self.args, **self.kwargs)
+        histogram(self.model).record(time.monotonic() - start)
+        return result
+
+    def _launch(self, hedge: bool = False):
+        with self.lock:
+            if self.finished:
+                return
+            if hedge and (self.hedged or self.in_flight != 1):
+                return
+            self.attempts += 1
+            self.in_flight += 1
+            self.hedged = self.hedged or hedge
+        attempt = scheduler.get_scheduler().submit(self.model, self._timed_attempt)
+        attempt.add_done_callback(self._on_attempt_done)
+
+        threshold = _hedge_threshold(self.model, self.policy)
+        if not hedge and threshold is not None:
+            self._schedule(threshold, lambda: self._launch(hedge=True))
+
+    def _finish(self, result: Any = None, error: Optional[BaseException] = None):
+        with self.lock:
+            if self.finished:
+                return False
+            self.finished = True
+            timers, self.timers = self.timers, []
+        queue = _timer_queue()
+        for timer in timers:
+            queue.cancel(timer)
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+        return True
+
+    def _on_attempt_done(self, attempt: Future):
+        with self.lock:
+            self.in_flight -= 1
+            others_in_flight = self.in_flight > 0
+        error = attempt.exception()
+
+        if error is None:
+            result = attempt.result()
+            if not self._finish(result) and self.on_discard is not None:
+                self.on_discard(result)
+            return
+
+        self.last_error = error
+        if not is_retryable(error):
+            self._finish(error=error)
+            return
+        if others_in_flight:
+            return
+
+        remaining = self.deadline - time.monotonic()
+        if self.attempts >= self.policy["max_attempts"] or remaining <= 0:
+            self._finish(error=error)
+            return
+        delay = backoff_delay(self.attempts, error, self.policy)
+        if delay >= remaining:
+            self._finish(error=error)
+            return
+        print(f"   ↻ {self.model} attempt {self.attempts} failed ({error}); retrying in {delay:.1f}s")
+        self._schedule(delay, self._launch)
+
+    def _expire(self):
+        message = f"{self.model} call exceeded its {self.policy['deadline']:g}s deadline"
+        if self.last_error is not None:
+            message += f" (last error: {self.last_error})"
+        self._finish(error=DeadlineExceeded(message))
+
+
+def submit(
+    model: str,
+    fn: Callable,
+    *args,
+    policy: Optional[Dict] = None,
+    on_discard: Optional[Callable[[Any], None]] = None,
+    **kwargs
+) -> Future:
+    """Run fn(*args, **kwargs) on the shared scheduler with retries, deadline and hedging.
+
+    Deadlines, retries and hedges run from one shared timer thread, so no
+    thread sleeps while a call backs off. With hedging enabled fn may run
+    twice concurrently: it must not write to a shared location, and
+    on_discard receives the result of the losing attempt so it can be
+    cleaned up.
+
+    Args:
+        model: Model the request is sent to
+        fn: Function performing one attempt
+        policy: Overrides of DEFAULT_POLICY
+        on_discard: Called with the result of attempts that finish after the call resolved
+
+    Returns:
+        Future resolving to the first successful result
+    """
+    call_policy = dict(DEFAULT_POLICY, **(policy or {}))
+    resilient_call = _ResilientCall(model, fn, args, kwargs, call_policy, on_discard)
+    resilient_call.start()
+    return resilient_call.future
+
+
+def call(model: str, fn: Callable, *args, policy: Optional[Dict] = None, **kwargs) -> Any:
+    """Blocking form of submit. Must not be called from a scheduler worker thread."""
+    return submit(model, fn, *args, policy=policy, **kwargs).result()
+
+
+async def acall(
+    model: str,
+    coro_fn: Callable,
+    *args,
+    limiter: scheduler.AsyncLimiter,
+    policy: Optional[Dict] = None,
+    on_discard: Optional[Callable[[Any], None]] = None,
+    **kwargs
+) -> Any:
+    """Async counterpart of call for coroutine functions.
+
+    Args:
+        model: Model the request is sent to
+        coro_fn: Coroutine function performing one attempt
+        limiter: Per-model limits of the running event loop
+        policy: Overrides of DEFAULT_POLICY
+        on_discard: Called with the result of a losing hedged attempt
+
+    Returns:
+        Result of the first successful attempt
+    """
+    call_policy = dict(DEFAULT_POLICY, **(policy or {}))
+    deadline = time.monotonic() + call_policy["deadline"]
+
+    async def attempt():
+        async with limiter.slot(model):
+            start = time.monotonic()
+            result = await coro_fn(*args, **kwargs)
+            histogram(model).record(time.monotonic() - start)
+            return result
+
+    attempts = 0
+    while True:
+        attempts += 1
+        tasks = {asyncio.ensure_future(attempt())}
+        threshold = _hedge_threshold(model, call_policy)
+        try:
+            remaining = deadline - time.monotonic()
+            done, _ = await asyncio.wait(
+                tasks,
+                timeout=min(threshold, remaining) if threshold is not None else remaining,
+            )
+            if not done and threshold is not None and threshold < remaining:
+                tasks.add(asyncio.ensure_future(attempt()))
+                done, _ = await asyncio.wait(
+                    tasks, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED
+                )
+            if not done:
+                for task in tasks:
+                    task.cancel()
+                raise DeadlineExceeded(f"{model} call exceeded its {call_policy['deadline']:g}s deadline")
+
+            finished = done.pop()
+            error = finished.exception()
+            if error is None:
+                for task in tasks - {finished}:
+                    if on_discard is not None:
+                        task.add_done_callback(
+                            lambda t: not t.cancelled() and t.exception() is None and on_discard(t.result())
+                        )
+                return finished.result()
+            # A failed hedge pair: wait for the other attempt before retrying
+            for task in tasks - {finished}:
+                try:
+                    return await asyncio.wait_for(task, timeout=max(0.0, deadline - time.monotonic()))
+                except Exception:
+                    pass
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        remaining = deadline - time.monotonic()
+        if not is_retryable(error) or attempts >= call_policy["max_attempts"]:
+            raise error
+        delay = backoff_delay(attempts, error, call_policy)
+        if delay >= remaining:
+            raise error
+        print(f"   ↻ {model} attempt {attempts} failed ({error}); retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
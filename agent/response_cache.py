@@ -0,0 +1,180 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+
+DEFAULT_CACHE_PATH = os.environ.get("NARRATOR_RESPONSE_CACHE", ".cache/responses.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_prompt_version ON responses (model, prompt_version);
+CREATE TABLE IF NOT EXISTS runs (
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    hits INTEGER NOT NULL,
+    misses INTEGER NOT NULL
+);
+"""
+
+
+def cache_key(
+    data: bytes,
+    model: str,
+    prompt_version: str,
+    thinking_budget: Optional[int] = None,
+    mime_type: str = ""
+) -> str:
+    """Build the cache key of a model response to an uploaded file.
+
+    Args:
+        data: Bytes sent to the model (e.g. the prepared page image)
+        model: Model the request is sent to
+        prompt_version: Version of the system prompt and response schema
+        thinking_budget: Thinking budget of the request
+        mime_type: Mime type the bytes were sent as
+
+    Returns:
+        str: Hex digest identifying the response
+    """
+    digest = hashlib.sha256(data)
+    digest.update(f"\0{model}\0{prompt_version}\0{thinking_budget}\0{mime_type}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """SQLite store of model responses, shared by every thread of a process.
+
+    Hits and misses are counted for the current run; record_run() saves the
+    counts so runs can be compared later.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or DEFAULT_CACHE_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response of key, counting a hit or a miss."""
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def get_any(self, keys: List[str]) -> Optional[str]:
+        """Return the cached response of the first key found, counting one hit or miss."""
+        with self.lock:
+            for key in keys:
+                row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, model: str, prompt_version: str, response: str):
+        """Store a response that was parsed successfully."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, prompt_version, response, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, prompt_version, response, time.time()),
+            )
+
+    def invalidate(self, prompt_version: Optional[str] = None, model: Optional[str] = None) -> int:
+        """Delete cached responses of a prompt version and/or model.
+
+        Returns:
+            int: Number of deleted responses
+        """
+        clauses, params = [], []
+        if prompt_version is not None:
+            clauses.append("prompt_version = ?")
+            params.append(prompt_version)
+        if model is not None:
+            clauses.append("model = ?")
+            params.append(model)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock, self.connection:
+            return self.connection.execute(f"DELETE FROM responses{where}", params).rowcount
+
+    def record_run(self):
+        """Save the hit and miss counts of this run and start counting a new one."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO runs (started_at, finished_at, hits, misses) VALUES (?, ?, ?, ?)",
+                (self.started_at, time.time(), self.hits, self.misses),
+            )
+            self.started_at = time.time()
+            self.hits = 0
+            self.misses = 0
+
+    def print_report(self):
+        """Print the hit and miss counts of this run."""
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        if hits or misses:
+            print(f"Response cache: {hits} hit(s), {misses} miss(es) ({self.path})")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path: Optional[str] = None) -> ResponseCache:
+    """Return the response cache of this process."""
+    key = (os.getpid(), path or DEFAULT_CACHE_PATH)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ResponseCache(path)
+        return _caches[key]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the model response cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    invalidate_parser = subparsers.add_parser("invalidate", help="Delete cached responses")
+    invalidate_parser.add_argument("--prompt-version", help="Only responses made with this prompt version")
+    invalidate_parser.add_argument("--model", help="Only responses of this model")
+    invalidate_parser.add_argument("--all", action="store_true", help="Delete every cached response")
+
+    stats_parser = subparsers.add_parser("stats", help="Show cache contents and recent runs")
+
+    for subparser in (invalidate_parser, stats_parser):
+        subparser.add_argument("--cache", default=None, help=f"Cache file (default: {DEFAULT_CACHE_PATH})")
+    args = parser.parse_args()
+
+    cache = get_cache(args.cache)
+    if args.command == "invalidate":
+        if not (args.prompt_version or args.model or args.all):
+            parser.error("invalidate needs --prompt-version, --model or --all")
+        deleted = cache.invalidate(args.prompt_version, args.model)
+        print(f"✓ Deleted {deleted} cached response(s)")
+    else:
+        for model, prompt_version, count in cache.connection.execute(
+            "SELECT model, prompt_version, COUNT(*) FROM responses GROUP BY model, prompt_version"
+        ):
+            print(f"  • {model} (prompt version {prompt_version}): {count} response(s)")
+        for started_at, hits, misses in cache.connection.execute(
+            "SELECT started_at, hits, misses FROM runs ORDER BY started_at DESC LIMIT 10"
+        ):
+            print(f"  • run {time.strftime('%Y-%m-%d %H:%M', time.localtime(started_at))}: {hits} hit(s), {misses} miss(es)")
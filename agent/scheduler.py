@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+# Per-model limits: "concurrency" is the number of requests in flight and
+# "rpm" the sustained request rate, with bursts of up to "burst" requests.
+MODEL_LIMITS = {
+    "gemini-2.5-pro": {"concurrency": 4, "rpm": 60, "burst": 4},
+    "gemini-2.5-flash": {"concurrency": 8, "rpm": 120, "burst": 8},
+    "gemini-2.5-flash-image": {"concurrency": 3, "rpm": 30, "burst": 3},
+    "gemini-2.5-flash-preview-tts": {"concurrency": 6, "rpm": 60, "burst": 6},
+}
+DEFAULT_LIMIT = {"concurrency": 2, "rpm": 30, "burst": 2}
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at a fixed rate."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token and return how many seconds the caller must wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """Block until one token is available."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Scheduler:
+    """Process-wide scheduler for model requests.
+
+    Each model gets its own worker pool, sized to its concurrency limit, and
+    its own token bucket. A backlog of image requests therefore never occupies
+    the slots of TTS or text requests.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict]] = None):
+        self.limits = dict(MODEL_LIMITS if limits is None else limits)
+        self._executors = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _limit(self, model: str) -> Dict:
+        return self.limits.get(model, DEFAULT_LIMIT)
+
+    def _lane(self, model: str):
+        with self._lock:
+            if model not in self._executors:
+                limit = self._limit(model)
+                self._executors[model] = ThreadPoolExecutor(
+                    max_workers=limit["concurrency"],
+                    thread_name_prefix=f"sched-{model}",
+                )
+                self._buckets[model] = TokenBucket(limit["rpm"], limit.get("burst", limit["concurrency"]))
+            return self._executors[model], self._buckets[model]
+
+    def bucket(self, model: str) -> TokenBucket:
+        """Return the rate limiter of a model."""
+        return self._lane(model)[1]
+
+    def submit(self, model: str, fn: Callable, *args, **kwargs) -> Future:
+        """Run fn(*args, **kwargs) under the concurrency and rate limit of model.
+
+        fn must not wait on other work submitted for the same model.
+
+        Returns:
+            Future resolving to the return value of fn
+        """
+        executor, bucket = self._lane(model)
+
+        def run():
+            bucket.acquire()
+            return fn(*args, **kwargs)
+
+        return executor.submit(run)
+
+    def shutdown(self, wait: bool = True):
+        """Shut down every model pool."""
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+            self._buckets.clear()
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+
+class AsyncLimiter:
+    """Per-model limits for coroutines running on one event loop.
+
+    Concurrency is bounded by an asyncio semaphore per model, and requests draw
+    from the same token buckets as the shared scheduler, so sync and async
+    stages together stay under one rate limit per model.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict]] = None):
+        self.limits = dict(get_scheduler().limits if limits is None else limits)
+        self._semaphores = {}
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        """Hold one request slot of model for the duration of the block."""
+        if model not in self._semaphores:
+            limit = self.limits.get(model, DEFAULT_LIMIT)
+            self._semaphores[model] = asyncio.Semaphore(limit["concurrency"])
+        async with self._semaphores[model]:
+            wait = get_scheduler().bucket(model).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """Return the scheduler shared by every stage of the pipeline."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def configure(limits: Dict[str, Dict]):
+    """Replace the per-model limits of the shared scheduler.
+
+    Args:
+        limits: Mapping of model name to {"concurrency", "rpm", "burst"}; models
+            not listed keep their current limits
+    """
+    global _scheduler
+    with _scheduler_lock:
+        merged = dict(MODEL_LIMITS if _scheduler is None else _scheduler.limits)
+        merged.update(limits)
+        if _scheduler is not None:
+            _scheduler.shutdown(wait=False)
+        _scheduler = Scheduler(merged)
@@ -0,0 +1,288 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+
+from agent import explentory_json_genrator, input_encoder, prompt_cache, resilience, response_cache, structured_output
+
+
+# Folders whose script request would exceed "min_tokens" input tokens are
+# written in map-reduce mode: "chunk_tokens" worth of pages per map request,
+# all drafted concurrently, then one cheap "reduce_model" request to order
+# the drafted sections, drop duplicates and add transitions.
+MAPREDUCE_SETTINGS = {
+    "min_tokens": int(os.getenv("NARRATOR_MAPREDUCE_MIN_TOKENS", "12000")),
+    "chunk_tokens": int(os.getenv("NARRATOR_SCRIPT_CHUNK_TOKENS", "6000")),
+    "reduce_model": "gemini-2.5-flash",
+    "reduce_thinking_budget": 1024,
+    "preview_chars": 240,
+}
+
+REDUCE_PROMPT = """
+You are the editor of an educational video script that was drafted in parts.
+You receive a numbered list of the drafted sections, in the order of the notes
+they came from, each shortened to its opening words.
+
+Return a JSON object with:
+- "order": the section numbers in the order they should be narrated. Keep the
+  order of the notes unless a section clearly belongs elsewhere.
+- "drop": numbers of sections that repeat an earlier section (for example a
+  second introduction, hook or conclusion) and should be removed.
+- "transitions": for sections that start a new part abruptly, one or two
+  spoken sentences leading into the section from the one before it, as
+  {"section": number, "text": sentence}.
+
+Do not rewrite sections. Respond with the JSON object only.
+"""
+
+REDUCE_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    required=["order", "drop", "transitions"],
+    properties={
+        "order": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.INTEGER)),
+        "drop": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.INTEGER)),
+        "transitions": types.Schema(
+            type=types.Type.ARRAY,
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                required=["section", "text"],
+                properties={
+                    "section": types.Schema(type=types.Type.INTEGER),
+                    "text": types.Schema(type=types.Type.STRING),
+                },
+            ),
+        ),
+    },
+)
+
+
+def needs_mapreduce(text_input: str) -> bool:
+    """True if a folder's script request is large enough to be written in map-reduce mode."""
+    return input_encoder.estimate_tokens(text_input) > MAPREDUCE_SETTINGS["min_tokens"]
+
+
+def _page_prompts(input_data: Dict[str, Any]) -> Optional[List[List[str]]]:
+    """The image prompts of every page, in figure order, from input_encoder.figure_prompts.
+
+    Returns None if the folder's placeholders do not account for its prompts.
+    """
+    mapping = input_encoder.figure_prompts(input_data)
+    if mapping is None:
+        return None
+    return [[figures[number] for number in sorted(figures)] for figures in mapping]
+
+
+def plan_chunks(input_data: Dict[str, Any], chunk_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Group a folder's pages into map chunks of about chunk_tokens input tokens.
+
+    Pages stay in order and are never split. Once a chunk is half full, a page
+    opening with a top-level heading starts a new chunk, so chunks follow the
+    topics of the notes where they can.
+
+    Each page's image prompts go into the chunk holding the page. If the
+    prompts cannot be matched to pages, every chunk carries all of them in
+    its "image_prompts", as compact_input does for a whole folder.
+
+    Args:
+        input_data: Folder JSON with "descriptions" and "image_prompts"
+        chunk_tokens: Token budget of a chunk (default: MAPREDUCE_SETTINGS["chunk_tokens"])
+
+    Returns:
+        List of folder-JSON-shaped dicts, one per chunk
+    """
+    chunk_tokens = chunk_tokens or MAPREDUCE_SETTINGS["chunk_tokens"]
+    descriptions = input_data.get("descriptions", [])
+    page_prompts = _page_prompts(input_data)
+    shared = [] if page_prompts is not None else list(input_data.get("image_prompts", []))
+    shared_tokens = input_encoder.estimate_tokens("\n".join(shared))
+    chunks = []
+    current = {"descriptions": [], "image_prompts": list(shared)}
+    current_tokens = shared_tokens
+    for index, entry in enumerate(descriptions):
+        prompts = page_prompts[index] if page_prompts is not None else []
+        tokens = input_encoder.estimate_tokens(
+            explentory_json_genrator.build_text_input({"descriptions": [entry], "image_prompts": prompts})
+        )
+        new_topic = entry.get("description", "").lstrip().startswith("# ")
+        if current["descriptions"] and (
+            current_tokens + tokens > chunk_tokens
+            or (new_topic and current_tokens >= chunk_tokens / 2)
+        ):
+            chunks.append(current)
+            current = {"descriptions": [], "image_prompts": list(shared)}
+            current_tokens = shared_tokens
+        current["descriptions"].append(entry)
+        current["image_prompts"].extend(prompts)
+        current_tokens += tokens
+    if current["descriptions"]:
+        chunks.append(current)
+    return chunks
+
+
+def _map_input(chunk: Dict[str, Any], index: int, count: int) -> str:
+    """User message of one map request: the chunk plus where it sits in the video."""
+    if index == 0:
+        position = "Open the video with your hook, but do not write a conclusion."
+    elif index == count - 1:
+        position = "Continue the video without a new introduction or hook, and end it with the conclusion."
+    else:
+        position = "Continue the video without a new introduction or hook, and do not write a conclusion."
+    return (
+        explentory_json_genrator.build_text_input(chunk)
+        + f"\nThese notes are part {index + 1} of {count} of one video. "
+        + "Write the sections for this part only. " + position + "\n"
+    )
+
+
+def _map_key(text_input: str) -> str:
+    return response_cache.cache_key(
+        text_input.encode("utf-8"),
+        explentory_json_genrator.MODEL,
+        f"{explentory_json_genrator.PROMPT_VERSION}-map",
+        None,
+        "text/plain",
+    )
+
+
+def _reduce_input(sections: List[Dict[str, Any]]) -> str:
+    preview = MAPREDUCE_SETTINGS["preview_chars"]
+    lines = []
+    for number, section in enumerate(sections):
+        content = " ".join(section.get("content", "").split())
+        lines.append(f"[{number}] (part {section['part'] + 1}) {content[:preview]}")
+    return "\n".join(lines)
+
+
+def _check_edits(edits: Any) -> Dict[str, Any]:
+    """Return the reduce edits if they have the shape of REDUCE_SCHEMA, else raise ValueError."""
+    if not isinstance(edits, dict):
+        raise ValueError(f"expected an object, got {type(edits).__name__}")
+    for field in ("order", "drop"):
+        numbers = edits.get(field, [])
+        if not isinstance(numbers, list) or not all(type(number) is int for number in numbers):
+            raise ValueError(f'"{field}" is not a list of section numbers')
+    transitions = edits.get("transitions", [])
+    if not isinstance(transitions, list) or not all(
+        isinstance(item, dict) and type(item.get("section")) is int and isinstance(item.get("text"), str)
+        for item in transitions
+    ):
+        raise ValueError('"transitions" is not a list of {section, text} objects')
+    return edits
+
+
+def reduce_sections(sections: List[Dict[str, Any]], timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Order drafted sections, drop repeated ones and add transitions.
+
+    Only the opening words of every section are sent, to a cheap model; the
+    edits are applied locally. Sections the model leaves out of the order
+    (without dropping them) keep their place, and if the request fails or
+    returns edits of the wrong shape the sections are kept in note order.
+
+    Args:
+        sections: Drafted sections in note order, each with a "part" index
+        timeout: Seconds allowed for the request, retries included
+
+    Returns:
+        Final sections with image_description and content
+    """
+    model = MAPREDUCE_SETTINGS["reduce_model"]
+    config = types.GenerateContentConfig(
+        thinking_config=types.ThinkingConfig(thinking_budget=MAPREDUCE_SETTINGS["reduce_thinking_budget"]),
+        response_mime_type="application/json",
+        response_schema=REDUCE_SCHEMA,
+        system_instruction=[types.Part.from_text(text=REDUCE_PROMPT)],
+    )
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=_reduce_input(sections))])]
+
+    def request():
+        response = prompt_cache.generate_content(model, contents, config)
+        return structured_output.from_response(response, model)
+
+    policy = {"deadline": timeout} if timeout else None
+    try:
+        edits = _check_edits(resilience.call(model, request, policy=policy).data)
+    except Exception as e:
+        print(f"   ⚠ Reduce pass failed ({e}); keeping sections in note order")
+        edits = {}
+
+    valid = range(len(sections))
+    dropped = {number for number in edits.get("drop", []) if number in valid}
+    order = []
+    for number in edits.get("order", []) + list(valid):
+        if number in valid and number not in dropped and number not in order:
+            order.append(number)
+    transitions = {
+        item["section"]: item["text"].strip()
+        for item in edits.get("transitions", [])
+        if item["section"] in valid and item["text"].strip()
+    }
+
+    script = []
+    for number in order:
+        content = sections[number]["content"]
+        if number in transitions:
+            content = f"{transitions[number]} {content}"
+        script.append({"image_description": sections[number]["image_description"], "content": content})
+    if dropped:
+        print(f"   Reduce pass dropped {len(dropped)} repeated section(s)")
+    return script
+
+
+def generate_script(input_data: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Write a folder's script in map-reduce mode.
+
+    Every chunk from plan_chunks is drafted by its own concurrent request
+    through resilience.submit, so the folder takes about as long as its
+    slowest chunk plus the reduce pass. A failing chunk is retried on its
+    own; drafted chunks are kept in the response cache, so when a chunk
+    still fails, running the folder again only pays for that chunk.
+
+    Args:
+        input_data: Folder JSON with "descriptions" and "image_prompts"
+        timeout: Seconds allowed per request, retries included
+
+    Returns:
+        Script dict with a "sections" list
+
+    Raises:
+        RuntimeError: If a chunk could not be drafted
+    """
+    chunks = plan_chunks(input_data)
+    print(f"   Map-reduce: {len(input_data.get('descriptions', []))} page(s) in {len(chunks)} chunk(s)")
+    cache = response_cache.get_cache()
+    policy = {"deadline": timeout} if timeout else None
+    model = explentory_json_genrator.MODEL
+
+    drafts = [None] * len(chunks)
+    pending = {}
+    for index, chunk in enumerate(chunks):
+        text_input = _map_input(chunk, index, len(chunks))
+        key = _map_key(text_input)
+        cached = cache.get(key)
+        if cached is not None:
+            drafts[index] = structured_output.load_stored(cached)
+        else:
+            pending[index] = (key, resilience.submit(model, explentory_json_genrator.generate, text_input, policy=policy))
+
+    failed = []
+    for index, (key, future) in pending.items():
+        try:
+            drafts[index] = future.result().data
+        except Exception as e:
+            print(f"   ✗ Chunk {index + 1}/{len(chunks)} failed: {e}")
+            failed.append(index + 1)
+            continue
+        cache.put(key, model, f"{explentory_json_genrator.PROMPT_VERSION}-map", json.dumps(drafts[index], ensure_ascii=False))
+    if failed:
+        raise RuntimeError(f"chunk(s) {failed} of {len(chunks)} failed; the other chunks are cached")
+
+    sections = [
+        dict(section, part=index)
+        for index, draft in enumerate(drafts)
+        for section in draft.get("sections", [])
+    ]
+    return {"sections": reduce_sections(sections, timeout)}
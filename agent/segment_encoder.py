@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from agent import audio_assembler
+
+
+# Encoder settings for still-image segments. Every segment of a video must be
+# encoded with the same settings so the segments can be joined by stream copy.
+# Segments carry video only; the narration is muxed once as a single track.
+DEFAULT_SEGMENT_SETTINGS = {
+    "layout": "video-only",
+    "width": 1024,
+    "height": 1024,
+    "fps": 1,
+    "video_codec": "libx264",
+    "preset": "veryfast",
+    "tune": "stillimage",
+    "crf": 23,
+    "gop": 600,
+    "pix_fmt": "yuv420p",
+    "audio_codec": "aac",
+    "audio_bitrate": "128k",
+    "audio_sample_rate": 24000,
+    "audio_channels": 1,
+}
+
+MANIFEST_NAME = "manifest.json"
+
+
+def find_ffmpeg() -> Optional[str]:
+    """Locate an ffmpeg executable.
+
+    Checks the FFMPEG_BINARY environment variable (the same one moviepy uses),
+    then PATH, then the binary bundled with imageio-ffmpeg.
+
+    Returns:
+        str: Path to ffmpeg or None if it is not available
+    """
+    env_binary = os.environ.get("FFMPEG_BINARY")
+    if env_binary and env_binary != "auto-detect" and shutil.which(env_binary):
+        return shutil.which(env_binary)
+
+    system_binary = shutil.which("ffmpeg")
+    if system_binary:
+        return system_binary
+
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def _hash_file(digest, path: str):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+
+def segment_cache_key(image_path: str, audio_path: str, settings: Optional[Dict] = None) -> str:
+    """Build the cache key of a section segment.
+
+    Segments carry video only, so the key covers the image bytes, the
+    encoder settings and the narration length in frames, which is all the
+    segment depends on (ffmpeg rounds "-t" to whole frames). A new narration
+    of the same length reuses the segment.
+
+    Returns:
+        str: Hex digest identifying the encoded segment
+    """
+    settings = settings or DEFAULT_SEGMENT_SETTINGS
+    frames = round(audio_assembler.read_wav_info(audio_path)["duration"] * settings["fps"])
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    digest.update(f"\0{frames}\0".encode("utf-8"))
+    _hash_file(digest, image_path)
+    return digest.hexdigest()
+
+
+def narration_key(audio_paths: List[str]) -> str:
+    """Build the key of a video's narration track from the bytes of its section narrations."""
+    digest = hashlib.sha256()
+    for path in audio_paths:
+        digest.update(b"\0")
+        _hash_file(digest, path)
+    return digest.hexdigest()
+
+
+def load_manifest(segments_dir: Path) -> Dict:
+    """Load the segment manifest of the last successful mux (empty if none)."""
+    manifest_path = Path(segments_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(segments_dir: Path, manifest: Dict):
+    """Atomically write the segment manifest."""
+    manifest_path = Path(segments_dir) / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _run_ffmpeg(ffmpeg: str, args: List[str]):
+    """Run ffmpeg with the given arguments, raising RuntimeError on failure."""
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y"] + args
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.strip()}")
+
+
+def encode_still_segment(
+    image_path: str,
+    duration: float,
+    output_path: str,
+    settings: Optional[Dict] = None,
+    ffmpeg: Optional[str] = None
+) -> float:
+    """Encode one section as a static-image video segment.
+
+    The image is looped at a low frame rate with x264's still-image tuning and
+    a long GOP, so a section is mostly a single keyframe followed by empty
+    P-frames. The segment is cut to the exact length of the narration and is
+    written under a temporary name first, so an interrupted encode never leaves
+    a truncated segment behind.
+
+    Args:
+        image_path: Path to the section image
+        duration: Length of the section narration in seconds
+        output_path: Path where the segment will be written
+        settings: Encoder settings (default: DEFAULT_SEGMENT_SETTINGS)
+        ffmpeg: Path to ffmpeg (default: auto-detected)
+
+    Returns:
+        float: Duration of the segment in seconds
+    """
+    settings = settings or DEFAULT_SEGMENT_SETTINGS
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not found")
+
+    width, height = settings["width"], settings["height"]
+    video_filter = (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format={settings['pix_fmt']}"
+    )
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+    _run_ffmpeg(ffmpeg, [
+        "-loop", "1",
+        "-framerate", str(settings["fps"]),
+        "-i", str(image_path),
+        "-vf", video_filter,
+        "-c:v", settings["video_codec"],
+        "-preset", settings["preset"],
+        "-tune", settings["tune"],
+        "-crf", str(settings["crf"]),
+        "-g", str(settings["gop"]),
+        "-bf", "0",
+        "-r", str(settings["fps"]),
+        "-an",
+        "-t", f"{duration:.6f}",
+        "-movflags", "+faststart",
+        str(tmp_path),
+    ])
+    os.replace(tmp_path, output_path)
+    return duration
+
+
+def _concat_entry(path: str) -> str:
+    """Quote a path for an ffmpeg concat list file."""
+    escaped = str(Path(path).resolve()).replace("'", "'\\''")
+    return f"file '{escaped}'"
+
+
+def _audio_track_args(audio_track: str, settings: Dict) -> List[str]:
+    """ffmpeg arguments that copy input 0's video and encode audio_track as its sound."""
+    return [
+        "-i", str(audio_track),
+        "-map", "0:v:0",
+        "-map", "1:a:0",
+        "-c:v", "copy",
+        "-c:a", settings["audio_codec"],
+        "-b:a", settings["audio_bitrate"],
+        "-ar", str(settings["audio_sample_rate"]),
+        "-ac", str(settings["audio_channels"]),
+        "-shortest",
+    ]
+
+
+def mux_audio_track(
+    video_path: str,
+    audio_track: str,
+    output_path: str,
+    settings: Optional[Dict] = None,
+    ffmpeg: Optional[str] = None
+) -> str:
+    """Add a narration track to a silent video, copying the video stream as-is.
+
+    Args:
+        video_path: Path of the silent video
+        audio_track: Path of the assembled narration WAV
+        output_path: Path of the muxed video
+        settings: Encoder settings (default: DEFAULT_SEGMENT_SETTINGS)
+        ffmpeg: Path to ffmpeg (default: auto-detected)
+
+    Returns:
+        str: Path to the muxed video
+    """
+    settings = settings or DEFAULT_SEGMENT_SETTINGS
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not found")
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+    _run_ffmpeg(
+        ffmpeg,
+        ["-i", str(video_path)] + _audio_track_args(audio_track, settings)
+        + ["-movflags", "+faststart", str(tmp_path)]
+    )
+    os.replace(tmp_path, output_path)
+    return str(output_path)
+
+
+def concat_segments(
+    segments: List[Tuple[str, float]],
+    output_path: str,
+    audio_track: Optional[str] = None,
+    settings: Optional[Dict] = None,
+    ffmpeg: Optional[str] = None
+) -> str:
+    """Join encoded segments into one video without re-encoding.
+
+    Each segment is given an explicit outpoint equal to its narration length,
+    so the frame-rate rounding of a low-fps segment never shifts the start of
+    the next one. The video stream is copied as-is; the narration track, if
+    given, is the only thing encoded here.
+
+    Args:
+        segments: List of (segment_path, duration) in playback order
+        output_path: Path of the final video
+        audio_track: Path of the assembled narration WAV (default: no audio)
+        settings: Encoder settings (default: DEFAULT_SEGMENT_SETTINGS)
+        ffmpeg: Path to ffmpeg (default: auto-detected)
+
+    Returns:
+        str: Path to the final video
+    """
+    settings = settings or DEFAULT_SEGMENT_SETTINGS
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not found")
+
+    output_path = Path(output_path)
+    list_path = output_path.with_suffix(".concat.txt")
+    tmp_path = output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+    lines = []
+    for segment_path, duration in segments:
+        lines.append(_concat_entry(segment_path))
+        lines.append(f"outpoint {duration:.6f}")
+    list_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    args = ["-f", "concat", "-safe", "0", "-i", str(list_path)]
+    if audio_track:
+        args += _audio_track_args(audio_track, settings)
+    else:
+        args += ["-c", "copy"]
+    args += ["-movflags", "+faststart", str(tmp_path)]
+
+    try:
+        _run_ffmpeg(ffmpeg, args)
+        os.replace(tmp_path, output_path)
+    finally:
+        list_path.unlink(missing_ok=True)
+    return str(output_path)
@@ -0,0 +1,191 @@
+import json
+import os
+import re
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from agent import resilience
+
+
+# Raw SDK responses are only written to disk when this directory is set.
+ARCHIVE_SETTINGS = {
+    "dir": os.getenv("NARRATOR_RAW_ARCHIVE") or None,
+}
+
+_FENCE = re.compile(r"^\s*```(?:json|JSON)?\s*|\s*```\s*$")
+_decoder = json.JSONDecoder()
+
+
+@dataclass
+class Usage:
+    """Token counts of one model response."""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    thinking_tokens: int = 0
+    cached_tokens: int = 0
+
+    @classmethod
+    def from_response(cls, response: Any) -> "Usage":
+        usage = getattr(response, "usage_metadata", None)
+        return cls(
+            input_tokens=getattr(usage, "prompt_token_count", None) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", None) or 0,
+            thinking_tokens=getattr(usage, "thoughts_token_count", None) or 0,
+            cached_tokens=getattr(usage, "cached_content_token_count", None) or 0,
+        )
+
+    def to_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class ModelResult:
+    """Parsed output of a structured-output request, with its token usage.
+
+    "data" is the JSON object the model returned, as parsed by the SDK
+    against the response schema (or by extract_json when the SDK could not).
+    """
+
+    data: Any
+    usage: Usage
+    model: str
+    response_id: Optional[str] = None
+    archive_path: Optional[str] = None
+
+
+def extract_json(text: str) -> Any:
+    """Parse the JSON value in a model's text output.
+
+    Accepts plain JSON, JSON wrapped in a Markdown code fence, and JSON with
+    stray text around it; the first complete object or array is returned.
+
+    Raises:
+        json.JSONDecodeError: If the text holds no JSON object or array
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    stripped = _FENCE.sub("", text)
+    start = min((i for i in (stripped.find("{"), stripped.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        raise json.JSONDecodeError("no JSON object in model output", text, 0)
+    return _decoder.raw_decode(stripped, start)[0]
+
+
+def archive_raw(response: Any, model: str, archive_dir: Optional[str] = None) -> Optional[str]:
+    """Save the full SDK response, without null fields, if archiving is enabled.
+
+    Returns:
+        Path of the archived response, or None if archiving is off
+    """
+    archive_dir = archive_dir or ARCHIVE_SETTINGS["dir"]
+    if not archive_dir:
+        return None
+    name = getattr(response, "response_id", None) or uuid.uuid4().hex
+    path = Path(archive_dir) / f"{model}-{name}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(response.model_dump_json(exclude_none=True, indent=2), encoding="utf-8")
+    return str(path)
+
+
+def from_response(response: Any, model: str) -> ModelResult:
+    """Build the typed result of a GenerateContentResponse.
+
+    Uses the object the SDK already parsed against the response schema, so
+    the response is never serialized and parsed back.
+
+    Raises:
+        resilience.EmptyResponse: If the model returned no output (retryable)
+        json.JSONDecodeError: If the output is not JSON
+    """
+    data = getattr(response, "parsed", None)
+    if not isinstance(data, (dict, list)):
+        text = response.text
+        if not text or not text.strip():
+            raise resilience.EmptyResponse("model returned no output")
+        data = extract_json(text)
+    return ModelResult(
+        data=data,
+        usage=Usage.from_response(response),
+        model=model,
+        response_id=getattr(response, "response_id", None),
+        archive_path=archive_raw(response, model),
+    )
+
+
+class ArrayItemParser:
+    """Incremental parser of a streamed JSON object holding one array of objects.
+
+    Fed the text of a response as it arrives, it returns each object of the
+    top-level object's array (e.g. each of {"sections": [...]}) as soon as
+    its closing brace is received. Only the text of the open item is kept
+    besides the full response.
+    """
+
+    def __init__(self):
+        self.text = []
+        self.item = []
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.items = 0
+
+    def feed(self, text: str) -> List[Any]:
+        """Consume the next piece of the response and return the items it completed.
+
+        Raises:
+            json.JSONDecodeError: If a completed item is not valid JSON
+        """
+        self.text.append(text)
+        completed = []
+        for char in text:
+            in_item = len(self.stack) > 2
+            if in_item:
+                self.item.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.stack == ["{", "["] and char == "{":
+                    self.item = [char]
+                self.stack.append(char)
+            elif char in "}]" and self.stack:
+                self.stack.pop()
+                if in_item and len(self.stack) == 2:
+                    completed.append(json.loads("".join(self.item)))
+                    self.item = []
+        self.items += len(completed)
+        return completed
+
+    def close(self) -> Any:
+        """Parse the complete response once the stream has ended.
+
+        Raises:
+            resilience.EmptyResponse: If the stream held no output (retryable)
+            json.JSONDecodeError: If the stream ended before the object was complete
+        """
+        text = "".join(self.text)
+        if not text.strip():
+            raise resilience.EmptyResponse("model returned no output")
+        return extract_json(text)
+
+
+def load_stored(stored: str) -> Any:
+    """Parse a stored response: the data itself, or a full SDK dump from older runs."""
+    data = extract_json(stored)
+    if not isinstance(data, dict) or "candidates" not in data:
+        return data
+    if data.get("parsed"):
+        return data["parsed"]
+    parts = data["candidates"][0]["content"]["parts"]
+    return extract_json("".join(part["text"] for part in parts if part.get("text")))
@@ -1,84 +1,199 @@
 import json
+import multiprocessing
 import os
+import time
+import uuid
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, Tuple, Optional
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple, Optional
 from dotenv import load_dotenv
-from agent import create_image, voice_genrator
+from agent import (
+    asset_store,
+    audio_assembler,
+    create_image,
+    genai_client,
+    narration,
+    resilience,
+    segment_encoder,
+    voice_genrator,
+)
 
 load_dotenv(override=True)
 
+# Bump when the wording around a section's image description changes, so
+# cached images generated from the old template are not reused.
+IMAGE_PROMPT_VERSION = "1"
+IMAGE_PROMPT_TEMPLATE = (
+    "Generate an image in a modern educational infographic style, using clean typography "
+    "and stylized scientific or technical illustrations. IF description requires multiple "
+    "images try combine them into a single image. {image_description}"
+)
+AUDIO_PROMPT_VERSION = "1"
 
-def _generate_image(image_description: str, image_path: Path, idx: int) -> Optional[str]:
-    """Generate image for a section.
+
+def image_asset(image_description: str) -> Tuple[str, str]:
+    """Build the full image prompt of a section and its asset store key.
+    
+    Returns:
+        Tuple of (prompt, key)
+    """
+    prompt = IMAGE_PROMPT_TEMPLATE.format(image_description=image_description)
+    key = asset_store.asset_key(create_image.MODEL, prompt, template_version=IMAGE_PROMPT_VERSION)
+    return prompt, key
+
+
+def audio_asset_key(content: str) -> str:
+    """Build the asset store key of a section narration."""
+    params = {"voice": voice_genrator.VOICE_NAME, "temperature": voice_genrator.TEMPERATURE}
+    # Chunked narrations sound different from single-request ones
+    if len(narration.split_text(content)) > 1:
+        params["chunking"] = dict(narration.CHUNK_SETTINGS, version=narration.CHUNK_VERSION)
+    return asset_store.asset_key(voice_genrator.MODEL, content, params, AUDIO_PROMPT_VERSION)
+
+
+# Asset requests may be hedged: every attempt writes to its own temp file, so a
+# duplicate request can never clobber the winner's output.
+ASSET_CALL_POLICY = {"hedge": True}
+
+
+def _generation_attempt(generate_fn: Callable, payload: str, dest_path: Path) -> str:
+    """Run one generation attempt into a private temp file next to dest_path.
+    
+    Returns:
+        str: Path of the temp file holding the generated asset
+    """
+    tmp_path = dest_path.with_name(f".{dest_path.stem}.{uuid.uuid4().hex[:8]}{dest_path.suffix}")
+    try:
+        generated = generate_fn(payload, str(tmp_path))
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if not generated or not tmp_path.exists():
+        tmp_path.unlink(missing_ok=True)
+        raise resilience.EmptyResponse("model returned no data")
+    return str(tmp_path)
+
+
+def _discard_attempt(tmp_path: str):
+    Path(tmp_path).unlink(missing_ok=True)
+
+
+def _submit_asset(
+    kind: str,
+    idx: int,
+    model: str,
+    generate_fn: Callable,
+    payload: str,
+    dest_path: Path,
+    key: str
+) -> Future:
+    """Fetch an asset from the store or submit its generation with retries.
     
     Args:
-        image_description: Description of the image to generate
-        image_path: Path where the image will be saved
+        kind: "Image" or "Audio", for logging
         idx: Section index for logging
+        model: Model the request is sent to
+        generate_fn: Generator called as generate_fn(payload, output_path)
+        payload: Prompt or text of the asset
+        dest_path: Path where the asset will be saved
+        key: Asset store key of the asset
         
     Returns:
-        str: Path to generated image or None if failed
+        Future resolving to the asset path, or None if generation failed
     """
-    # Check if image already exists
-    if image_path.exists():
-        print(f"Image for section {idx} already exists. Skipping generation.")
-        return str(image_path)
-    
-    enhanced_description = (
-        "Generate an image in a modern educational infographic style, using clean typography "
-        "and stylized scientific or technical illustrations. IF description requires multiple "
-        f"images try combine them into a single image. {image_description}"
+    asset_future = Future()
+    
+    # Reuse an asset generated from the same request, in this or any other
+    # course, or one already in place that the store has lost
+    if asset_store.fetch(key, dest_path) or asset_store.adopt(key, dest_path):
+        print(f"{kind} for section {idx} already available. Skipping generation.")
+        asset_future.set_result(str(dest_path))
+        return asset_future
+    
+    print(f"Generating {kind.lower()} for section {idx}...")
+    attempt = resilience.submit(
+        model,
+        _generation_attempt,
+        generate_fn,
+        payload,
+        dest_path,
+        policy=ASSET_CALL_POLICY,
+        on_discard=_discard_attempt,
     )
     
-    print(f"Generating image for section {idx}...")
-    try:
-        generated_image = create_image.generate(enhanced_description, str(image_path))
-        if not generated_image:
-            print(f"Warning: Image generation failed for section {idx}")
-            return None
-        return str(image_path)
-    except Exception as e:
-        print(f"Error generating image for section {idx}: {e}")
-        return None
+    def finish(done: Future):
+        try:
+            # Replacing the name never writes through a hardlink into the store
+            os.replace(done.result(), dest_path)
+            asset_store.put(key, dest_path)
+            asset_future.set_result(str(dest_path))
+        except Exception as e:
+            print(f"Error generating {kind.lower()} for section {idx}: {e}")
+            asset_future.set_result(None)
+    
+    attempt.add_done_callback(finish)
+    return asset_future
 
 
-def _generate_audio(content: str, audio_path: Path, idx: int) -> Optional[str]:
-    """Generate audio for a section.
+def _submit_audio(idx: int, content: str, audio_path: Path) -> Future:
+    """Submit the narration of a section, in concurrent chunks if the text is long.
+    
+    Chunked narrations also get a section_<n>.timings.json file with the offset
+    of every chunk in the section audio.
     
     Args:
+        idx: Section index for logging
         content: Text content to convert to speech
         audio_path: Path where the audio will be saved
-        idx: Section index for logging
         
     Returns:
-        str: Path to generated audio or None if failed
+        Future resolving to the audio path, or None if generation failed
     """
-    # Check if audio already exists
-    if audio_path.exists():
-        print(f"Audio for section {idx} already exists. Skipping generation.")
-        return str(audio_path)
+    key = audio_asset_key(content)
+    chunk_count = len(narration.split_text(content))
+    if chunk_count == 1:
+        return _submit_asset(
+            "Audio", idx, voice_genrator.MODEL, voice_genrator.generate, content, audio_path, key
+        )
+    
+    audio_future = Future()
+    timings_path = audio_path.with_suffix(".timings.json")
+    if asset_store.fetch(key, audio_path) or asset_store.adopt(key, audio_path):
+        asset_store.fetch(key, timings_path) or asset_store.adopt(key, timings_path)
+        print(f"Audio for section {idx} already available. Skipping generation.")
+        audio_future.set_result(str(audio_path))
+        return audio_future
+    
+    print(f"Generating audio for section {idx} in {chunk_count} chunks...")
+    tmp_path = audio_path.with_name(f".{audio_path.stem}.stitched{audio_path.suffix}")
+    tmp_timings_path = timings_path.with_name(f".{timings_path.name}.part")
+    
+    def finish(done: Future):
+        try:
+            with open(tmp_timings_path, "w", encoding="utf-8") as f:
+                json.dump({"chunks": done.result()}, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_timings_path, timings_path)
+            os.replace(tmp_path, audio_path)
+            asset_store.put(key, audio_path)
+            asset_store.put(key, timings_path)
+            audio_future.set_result(str(audio_path))
+        except Exception as e:
+            print(f"Error generating audio for section {idx}: {e}")
+            tmp_timings_path.unlink(missing_ok=True)
+            tmp_path.unlink(missing_ok=True)
+            audio_future.set_result(None)
     
-    print(f"Generating audio for section {idx}...")
-    try:
-        generated_audio = voice_genrator.generate(content, str(audio_path))
-        if not generated_audio:
-            print(f"Warning: Audio generation failed for section {idx}")
-            return None
-        return str(audio_path)
-    except Exception as e:
-        print(f"Error generating audio for section {idx}: {e}")
-        return None
+    narration.submit_chunked(content, str(tmp_path)).add_done_callback(finish)
+    return audio_future
 
 
-def _process_section_assets(
+def _submit_section_assets(
     idx: int,
     section: Dict,
     images_dir: Path,
     audio_dir: Path
-) -> Tuple[int, Optional[str], Optional[str]]:
-    """Process image and audio generation for a section in parallel.
+) -> Optional[Tuple[Future, Future]]:
+    """Submit image and audio generation for a section to the shared scheduler.
     
     Args:
         idx: Section index
@@ -87,41 +202,44 @@ def _process_section_assets(
         audio_dir: Directory for audio
         
     Returns:
-        Tuple of (index, image_path, audio_path)
+        Tuple of (image_future, audio_future), or None if the section is incomplete
     """
     image_description = section.get("image_description", "")
     content = section.get("content", "")
     
     if not image_description or not content:
         print(f"Warning: Section {idx} missing image_description or content. Skipping.")
-        return (idx, None, None)
-    
-    image_path = images_dir / f"section_{idx}.png"
-    audio_path = audio_dir / f"section_{idx}.wav"
+        return None
     
-    # Generate image and audio in parallel using ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        image_future = executor.submit(_generate_image, image_description, image_path, idx)
-        audio_future = executor.submit(_generate_audio, content, audio_path, idx)
-        
-        image_result = image_future.result()
-        audio_result = audio_future.result()
+    image_prompt, image_key = image_asset(image_description)
     
-    return (idx, image_result, audio_result)
+    # Image and audio run in parallel, each under its own model's limits
+    image_future = _submit_asset(
+        "Image", idx, create_image.MODEL, create_image.generate,
+        image_prompt, images_dir / f"section_{idx}.png", image_key,
+    )
+    audio_future = _submit_audio(idx, content, audio_dir / f"section_{idx}.wav")
+    return (image_future, audio_future)
 
 
-def generate_video_from_json(json_path: str, output_dir: str, max_workers: int = 4):
-    """Generate a video from a JSON file containing sections with image descriptions and content.
+def generate_section_assets(
+    json_path: str,
+    output_dir: str,
+    on_section_ready: Optional[Callable[[int, Optional[str], Optional[str]], None]] = None
+) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """Generate the image and audio of every section of a JSON file.
     
-    Uses parallel processing to generate images and audio simultaneously for better performance.
+    All requests go to the shared scheduler, which bounds concurrency and request
+    rate per model across every course being processed.
     
     Args:
         json_path: Path to the JSON file containing sections
         output_dir: Directory where output files will be saved
-        max_workers: Maximum number of parallel workers for section processing (default: 4)
+        on_section_ready: Optional callback called with (index, image_path, audio_path)
+            on the calling thread as soon as each section's assets are done
     
     Returns:
-        str: Path to the final video file
+        Dict mapping section index to (image_path, audio_path)
     """
     # Create output directories
     output_path = Path(output_dir)
@@ -139,27 +257,281 @@ def generate_video_from_json(json_path: str, output_dir: str, max_workers: int =
     if not sections:
         raise ValueError(f"No sections found in {json_path}")
     
-    print(f"\nProcessing {len(sections)} sections from {json_path}...")
-    print(f"Using parallel processing with {max_workers} workers\n")
+    print(f"\nProcessing {len(sections)} sections from {json_path}...\n")
     
-    # Process all sections in parallel
+    # Submit all sections at once
     section_results = {}
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all section processing tasks
-        futures = {
-            executor.submit(_process_section_assets, idx, section, images_dir, audio_dir): idx
-            for idx, section in enumerate(sections)
-        }
+    pending = {}
+    futures = {}
+    for idx, section in enumerate(sections):
+        submitted = _submit_section_assets(idx, section, images_dir, audio_dir)
+        if submitted is None:
+            section_results[idx] = (None, None)
+            continue
+        pending[idx] = submitted
+        for future in submitted:
+            futures[future] = idx
+    
+    # Collect results as each section's image and audio are both done
+    for future in as_completed(futures):
+        idx = futures[future]
+        image_future, audio_future = pending[idx]
+        if idx in section_results or not (image_future.done() and audio_future.done()):
+            continue
+        section_results[idx] = (image_future.result(), audio_future.result())
+        print(f"✓ Section {idx} assets generated")
+        if on_section_ready is not None:
+            on_section_ready(idx, *section_results[idx])
+    
+    return section_results
+
+
+def render_video(
+    section_results: Dict[int, Tuple[Optional[str], Optional[str]]],
+    output_dir: str,
+    engine: str = "ffmpeg"
+) -> str:
+    """Assemble the final video from already generated section assets.
+    
+    The "ffmpeg" engine encodes each section once as a still-image segment and joins the
+    segments by stream copy; the "moviepy" engine composes and renders every frame and is
+    used as a fallback when ffmpeg is unavailable or fails. This is the CPU-bound stage and
+    is safe to run in a worker process.
+    
+    Args:
+        section_results: Mapping of section index to (image_path, audio_path)
+        output_dir: Directory where output files will be saved
+        engine: Video assembly engine, "ffmpeg" or "moviepy" (default: ffmpeg)
+    
+    Returns:
+        str: Path to the final video file
+    """
+    output_path = Path(output_dir)
+    video_output_path = output_path / "final_video.mp4"
+    if engine == "ffmpeg" and segment_encoder.find_ffmpeg():
+        try:
+            _assemble_with_ffmpeg(section_results, output_path, video_output_path)
+        except Exception as e:
+            print(f"\nffmpeg assembly failed ({e}). Falling back to moviepy...")
+            _assemble_with_moviepy(section_results, output_path, video_output_path)
+    else:
+        if engine == "ffmpeg":
+            print("\nffmpeg not found. Falling back to moviepy...")
+        _assemble_with_moviepy(section_results, output_path, video_output_path)
+    
+    print(f"\n✓ Video generation complete: {video_output_path}")
+    return str(video_output_path)
+
+
+def generate_video_from_json(
+    json_path: str,
+    output_dir: str,
+    max_workers: Optional[int] = None,
+    engine: str = "ffmpeg"
+):
+    """Generate a video from a JSON file containing sections with image descriptions and content.
+    
+    Args:
+        json_path: Path to the JSON file containing sections
+        output_dir: Directory where output files will be saved
+        max_workers: Deprecated and ignored; section requests are bounded by the
+            shared scheduler's per-model limits (see scheduler.configure)
+        engine: Video assembly engine, "ffmpeg" or "moviepy" (default: ffmpeg)
+    
+    Returns:
+        str: Path to the final video file
+    """
+    if max_workers is not None:
+        print("⚠ generate_video_from_json(max_workers=...) is deprecated and ignored; "
+              "use scheduler.configure to change per-model concurrency")
+    section_results = generate_section_assets(json_path, output_dir)
+    return render_video(section_results, output_dir, engine)
+
+
+def _encode_section_segment(
+    idx: int,
+    image_path: str,
+    audio_path: str,
+    segments_dir: Path
+) -> Optional[Tuple[str, float, str, str]]:
+    """Encode one section segment unless a segment with the same cache key exists.
+    
+    Args:
+        idx: Section index for logging
+        image_path: Path to the section image
+        audio_path: Path to the section narration
+        segments_dir: Directory holding the cached segments
+    
+    Returns:
+        Tuple of (segment_path, duration, key, audio_path), or None if encoding failed
+    """
+    try:
+        duration = audio_assembler.read_wav_info(audio_path)["duration"]
+        key = segment_encoder.segment_cache_key(image_path, audio_path)
+        segment_path = segments_dir / f"{key}.mp4"
+        if segment_path.exists():
+            print(f"✓ Section {idx} segment unchanged (duration: {duration:.2f}s)")
+        else:
+            segment_encoder.encode_still_segment(image_path, duration, str(segment_path))
+            print(f"✓ Section {idx} segment encoded (duration: {duration:.2f}s)")
+        return (str(segment_path), duration, key, audio_path)
+    except Exception as e:
+        print(f"Error encoding segment for section {idx}: {e}")
+        return None
+
+
+def _mux_segments(
+    encoded_sections: Dict[int, Tuple[str, float, str, str]],
+    output_path: Path,
+    video_output_path: Path
+):
+    """Join encoded section segments and the narration into the final video.
+    
+    The final file is re-muxed only when the ordered list of segments differs from
+    the one recorded in the segment manifest.
+    
+    Args:
+        encoded_sections: Mapping of section index to _encode_section_segment results
+        output_path: Output directory of the video
+        video_output_path: Path of the final video file
+    """
+    if not encoded_sections:
+        raise ValueError("No video segments were encoded successfully")
+    
+    ordered = [encoded_sections[idx] for idx in sorted(encoded_sections.keys())]
+    segments = [(segment_path, duration) for segment_path, duration, _, _ in ordered]
+    keys = [key for _, _, key, _ in ordered]
+    audio_paths = [audio_path for _, _, _, audio_path in ordered]
+    segments_dir = output_path / "segments"
+    
+    # Segments do not cover the narration, so a new narration of the same
+    # length re-muxes without re-encoding
+    narration = segment_encoder.narration_key(audio_paths)
+    manifest = segment_encoder.load_manifest(segments_dir)
+    if video_output_path.exists() and manifest.get("segments") == keys and manifest.get("narration") == narration:
+        print(f"\nAll {len(segments)} segments and the narration unchanged. Keeping {video_output_path}")
+        return
+    
+    print(f"\nJoining {len(segments)} segments into {video_output_path}...")
+    narration_path = audio_assembler.concat_wav(audio_paths, str(output_path / "narration.wav"))
+    segment_encoder.concat_segments(segments, str(video_output_path), audio_track=narration_path)
+    segment_encoder.save_manifest(segments_dir, {"segments": keys, "narration": narration})
+    
+    # Drop segments that are no longer part of the video
+    for stale_segment in segments_dir.glob("*.mp4"):
+        if stale_segment.stem not in keys:
+            stale_segment.unlink(missing_ok=True)
+
+
+def _assemble_with_ffmpeg(
+    section_results: Dict[int, Tuple[Optional[str], Optional[str]]],
+    output_path: Path,
+    video_output_path: Path
+):
+    """Encode each section as a still-image segment and stream-copy them together.
+    
+    Segments are cached under a key built from the image bytes, the narration length
+    and the encoder settings, so a rebuild only re-encodes sections whose key changed.
+    Segments are video-only; the section narrations are joined at the PCM level and
+    encoded once as a single track.
+    
+    Args:
+        section_results: Mapping of section index to (image_path, audio_path)
+        output_path: Output directory of the video
+        video_output_path: Path of the final video file
+    """
+    segments_dir = output_path / "segments"
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    
+    print("\nEncoding section segments...")
+    encoded_sections = {}
+    for idx in sorted(section_results.keys()):
+        image_path, audio_path = section_results[idx]
         
-        # Collect results as they complete
-        for future in as_completed(futures):
-            idx, image_path, audio_path = future.result()
-            section_results[idx] = (image_path, audio_path)
-            print(f"✓ Section {idx} assets generated")
+        if not image_path or not audio_path:
+            print(f"Skipping section {idx} due to missing assets")
+            continue
+        
+        encoded = _encode_section_segment(idx, image_path, audio_path, segments_dir)
+        if encoded:
+            encoded_sections[idx] = encoded
+    
+    _mux_segments(encoded_sections, output_path, video_output_path)
+
+
+def generate_video_pipelined(
+    json_path: str,
+    output_dir: str,
+    encode_workers: int = 2
+) -> str:
+    """Generate a video, encoding each section as soon as its assets are ready.
+    
+    Segment encoding overlaps with the generation of later sections, and the final
+    mux starts once the last segment is done, so wall-clock time approaches
+    max(generation, encoding) instead of their sum. Requires ffmpeg; without it
+    the video is built with the moviepy engine after all assets are generated.
+    
+    Args:
+        json_path: Path to the JSON file containing sections
+        output_dir: Directory where output files will be saved
+        encode_workers: Maximum number of segments encoded at once (default: 2)
+    
+    Returns:
+        str: Path to the final video file
+    """
+    if not segment_encoder.find_ffmpeg():
+        print("\nffmpeg not found. Falling back to moviepy...")
+        return generate_video_from_json(json_path, output_dir, engine="moviepy")
+    
+    output_path = Path(output_dir)
+    video_output_path = output_path / "final_video.mp4"
+    segments_dir = output_path / "segments"
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    
+    encode_futures = {}
+    with ThreadPoolExecutor(max_workers=encode_workers) as encoder:
+        def encode_when_ready(idx: int, image_path: Optional[str], audio_path: Optional[str]):
+            if not image_path or not audio_path:
+                print(f"Skipping section {idx} due to missing assets")
+                return
+            encode_futures[idx] = encoder.submit(
+                _encode_section_segment, idx, image_path, audio_path, segments_dir
+            )
+        
+        generate_section_assets(json_path, output_dir, on_section_ready=encode_when_ready)
+        encoded_sections = {
+            idx: future.result()
+            for idx, future in encode_futures.items()
+            if future.result()
+        }
+    
+    _mux_segments(encoded_sections, output_path, video_output_path)
+    print(f"\n✓ Video generation complete: {video_output_path}")
+    return str(video_output_path)
+
+
+def _assemble_with_moviepy(
+    section_results: Dict[int, Tuple[Optional[str], Optional[str]]],
+    output_path: Path,
+    video_output_path: Path
+):
+    """Compose the sections with moviepy and render every frame (fallback engine).
+    
+    Clip durations come from the WAV headers and the narration is joined at the PCM
+    level, so moviepy never decodes or re-mixes any audio; the finished track is muxed
+    onto the rendered video afterwards.
+    
+    Args:
+        section_results: Mapping of section index to (image_path, audio_path)
+        output_path: Output directory of the video
+        video_output_path: Path of the final video file
+    """
+    from moviepy.editor import ImageClip, concatenate_videoclips
     
     # Create video clips in order
     print("\nCreating video clips...")
     video_clips = []
+    audio_paths = []
     for idx in sorted(section_results.keys()):
         image_path, audio_path = section_results[idx]
         
@@ -167,15 +539,13 @@ def generate_video_from_json(json_path: str, output_dir: str, max_workers: int =
             print(f"Skipping section {idx} due to missing assets")
             continue
         
-        # Create video clip with image and audio
+        # Create a silent image clip lasting as long as the narration
         try:
-            audio_clip = AudioFileClip(str(audio_path))
-            duration = audio_clip.duration
-            
+            duration = audio_assembler.read_wav_info(audio_path)["duration"]
             image_clip = ImageClip(str(image_path)).set_duration(duration)
-            image_clip = image_clip.set_audio(audio_clip)
             
             video_clips.append(image_clip)
+            audio_paths.append(audio_path)
             print(f"✓ Section {idx} clip created (duration: {duration:.2f}s)")
         except Exception as e:
             print(f"Error creating video clip for section {idx}: {e}")
@@ -187,32 +557,47 @@ def generate_video_from_json(json_path: str, output_dir: str, max_workers: int =
     # Concatenate all clips
     print("\nCombining all clips into final video...")
     final_video = concatenate_videoclips(video_clips, method="compose")
+    narration_path = audio_assembler.concat_wav(audio_paths, str(output_path / "narration.wav"))
     
     # Export final video
-    video_output_path = output_path / "final_video.mp4"
     print(f"Exporting video to {video_output_path}...")
+    silent_video_path = output_path / "final_video.silent.mp4"
     final_video.write_videofile(
-        str(video_output_path),
+        str(silent_video_path),
         fps=24,
         codec="libx264",
-        audio_codec="aac"
+        audio=False
     )
+    segment_encoder.mux_audio_track(str(silent_video_path), narration_path, str(video_output_path))
+    silent_video_path.unlink(missing_ok=True)
     
     # Clean up
     final_video.close()
     for clip in video_clips:
         clip.close()
-    
-    print(f"\n✓ Video generation complete: {video_output_path}")
-    return str(video_output_path)
 
 
-def _process_single_video(json_file: Path, base_path: Path) -> Tuple[str, bool, Optional[str]]:
+def _process_single_video(
+    json_file: Path,
+    base_path: Path,
+    engine: str = "ffmpeg",
+    render_executor: Optional[Executor] = None,
+    pipelined: bool = False
+) -> Tuple[str, bool, Optional[str]]:
     """Process a single JSON file to generate a video.
     
+    Videos built by the ffmpeg engine carry a segment manifest and are always
+    revisited, so edited sections are re-encoded and the final file re-muxed.
+    Videos without a manifest are skipped once their final file exists.
+    
     Args:
         json_file: Path to the JSON file
         base_path: Base directory path
+        engine: Video assembly engine, "ffmpeg" or "moviepy" (default: ffmpeg)
+        render_executor: Executor for the render stage. If None, the video is
+            rendered on the calling thread.
+        pipelined: Encode each section as soon as its assets are ready (ffmpeg
+            engine without a render executor only)
         
     Returns:
         Tuple of (filename, success, error_message)
@@ -220,9 +605,10 @@ def _process_single_video(json_file: Path, base_path: Path) -> Tuple[str, bool,
     json_number = json_file.stem
     output_dir = base_path / f"output_{json_number}"
     video_output_path = output_dir / "final_video.mp4"
+    manifest_path = output_dir / "segments" / segment_encoder.MANIFEST_NAME
     
-    # Check if final video already exists
-    if video_output_path.exists():
+    # Check if final video already exists and cannot be rebuilt incrementally
+    if video_output_path.exists() and not (engine == "ffmpeg" and manifest_path.exists()):
         print(f"\n{'='*60}")
         print(f"Video for {json_file.name} already exists. Skipping.")
         print(f"{'='*60}")
@@ -233,7 +619,13 @@ def _process_single_video(json_file: Path, base_path: Path) -> Tuple[str, bool,
     print(f"{'='*60}")
     
     try:
-        generate_video_from_json(str(json_file), str(output_dir))
+        if render_executor is None and pipelined and engine == "ffmpeg":
+            generate_video_pipelined(str(json_file), str(output_dir))
+        elif render_executor is None:
+            generate_video_from_json(str(json_file), str(output_dir), engine=engine)
+        else:
+            section_results = generate_section_assets(str(json_file), str(output_dir))
+            render_executor.submit(render_video, section_results, str(output_dir), engine).result()
         return (json_file.name, True, None)
     except Exception as e:
         error_msg = f"Error processing {json_file.name}: {e}"
@@ -241,17 +633,76 @@ def _process_single_video(json_file: Path, base_path: Path) -> Tuple[str, bool,
         return (json_file.name, False, str(e))
 
 
+def _cpu_times_per_core() -> Optional[List[Tuple[float, float]]]:
+    """Return (busy, total) CPU time counters for every core, or None if unavailable."""
+    try:
+        import psutil
+        return [
+            (sum(times) - times.idle - getattr(times, "iowait", 0.0), sum(times))
+            for times in psutil.cpu_times(percpu=True)
+        ]
+    except ImportError:
+        pass
+    
+    try:
+        with open("/proc/stat", "r") as f:
+            lines = [line.split() for line in f if line.startswith("cpu") and line[3].isdigit()]
+    except OSError:
+        return None
+    
+    counters = []
+    for fields in lines:
+        values = [float(v) for v in fields[1:9]]
+        idle = values[3] + values[4]  # idle + iowait
+        counters.append((sum(values) - idle, sum(values)))
+    return counters
+
+
+def _print_cpu_utilization(start: Optional[List[Tuple[float, float]]], wall_time: float):
+    """Print per-core utilization since the given counters were taken."""
+    end = _cpu_times_per_core()
+    print(f"\nWall time: {wall_time:.1f}s")
+    if not start or not end or len(start) != len(end):
+        print("Per-core utilization not available on this platform")
+        return
+    
+    utilization = []
+    for (busy_start, total_start), (busy_end, total_end) in zip(start, end):
+        total = total_end - total_start
+        utilization.append(100.0 * (busy_end - busy_start) / total if total > 0 else 0.0)
+    
+    print(f"CPU utilization: {sum(utilization) / len(utilization):.1f}% average over {len(utilization)} cores")
+    for core, percent in enumerate(utilization):
+        print(f"  • core {core:>2}: {percent:5.1f}%")
+
+
 def process_all_videos(
     base_dir: str = "vlsi/video",
     max_workers: int = 2,
-    parallel: bool = True
+    parallel: bool = True,
+    engine: str = "ffmpeg",
+    render_mode: str = "thread",
+    render_workers: Optional[int] = None,
+    pipelined: bool = False
 ):
     """Process all JSON files in the base directory and generate videos.
     
+    In "process" render mode, asset generation (API-bound) stays on threads while
+    clip composition and encoding (CPU-bound) run in a pool of worker processes,
+    so rendering is not serialized by the GIL.
+    
     Args:
         base_dir: Base directory containing JSON files (default: vlsi/video)
-        max_workers: Maximum number of videos to process in parallel (default: 2)
+        max_workers: Maximum number of videos to process in parallel (default: 2).
+            In process mode this caps the asset generation stage.
         parallel: Whether to process multiple videos in parallel (default: True)
+        engine: Video assembly engine, "ffmpeg" or "moviepy" (default: ffmpeg)
+        render_mode: "thread" to render on the asset threads, or "process" to render
+            in worker processes (default: thread)
+        render_workers: Maximum number of render processes in process mode
+            (default: number of CPU cores)
+        pipelined: In thread mode with the ffmpeg engine, encode each section as soon
+            as its assets are ready instead of after all sections (default: False)
     """
     base_path = Path(base_dir)
     
@@ -270,17 +721,36 @@ def process_all_videos(
     if parallel:
         print(f"Max parallel videos: {max_workers}")
     
-    if parallel and len(json_files) > 1:
+    if parallel and render_mode == "process":
+        render_workers = render_workers or os.cpu_count() or 1
+        print(f"Render processes: {render_workers}")
+    
+    cpu_start = _cpu_times_per_core()
+    start_time = time.perf_counter()
+    
+    if parallel and (len(json_files) > 1 or render_mode == "process"):
         # Process videos in parallel
         results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {
-                executor.submit(_process_single_video, json_file, base_path): json_file
-                for json_file in json_files
-            }
-            
-            for future in as_completed(futures):
-                results.append(future.result())
+        # Spawned, not forked: asset threads, scheduler lanes and connection
+        # pools are already running, and a fork would copy their held locks
+        render_executor = (
+            ProcessPoolExecutor(max_workers=render_workers, mp_context=multiprocessing.get_context("spawn"))
+            if render_mode == "process" else None
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        _process_single_video, json_file, base_path, engine, render_executor, pipelined
+                    ): json_file
+                    for json_file in json_files
+                }
+                
+                for future in as_completed(futures):
+                    results.append(future.result())
+        finally:
+            if render_executor is not None:
+                render_executor.shutdown()
         
         # Print summary
         print(f"\n{'='*60}")
@@ -300,7 +770,11 @@ def process_all_videos(
     else:
         # Process videos sequentially
         for json_file in json_files:
-            _process_single_video(json_file, base_path)
+            _process_single_video(json_file, base_path, engine, pipelined=pipelined)
+    
+    _print_cpu_utilization(cpu_start, time.perf_counter() - start_time)
+    resilience.print_latency_report()
+    genai_client.print_connection_stats()
     
     print(f"\n{'='*60}")
     print("All videos processed!")
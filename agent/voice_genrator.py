@@ -3,11 +3,15 @@
 
 import base64
 import mimetypes
-import os
 import re
 import struct
-from google import genai
+import time
 from google.genai import types
+from agent import audio_assembler, genai_client
+
+MODEL = "gemini-2.5-flash-preview-tts"
+VOICE_NAME = "Kore"
+TEMPERATURE = 1
 
 
 def save_binary_file(file_name, data):
@@ -17,21 +21,8 @@ def save_binary_file(file_name, data):
     print(f"File saved to to: {file_name}")
 
 
-def generate(text_input: str, output_path: str = None):
-    """Generate audio from text input.
-    
-    Args:
-        text_input: The text to convert to speech
-        output_path: Optional path where to save the audio. If None, uses default naming.
-    
-    Returns:
-        str: Path to the saved audio file
-    """
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
-
-    model = "gemini-2.5-flash-preview-tts"
+def _build_request(text_input: str):
+    """Build the contents and config of a speech generation request."""
     contents = [
         types.Content(
             role="user",
@@ -41,53 +32,150 @@ def generate(text_input: str, output_path: str = None):
         ),
     ]
     generate_content_config = types.GenerateContentConfig(
-        temperature=1,
+        temperature=TEMPERATURE,
         response_modalities=[
             "audio",
         ],
         speech_config=types.SpeechConfig(
             voice_config=types.VoiceConfig(
                 prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                    voice_name="Kore"
+                    voice_name=VOICE_NAME
                 )
             )
         ),
     )
+    return contents, generate_content_config
+
 
-    file_index = 0
-    saved_file_path = None
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
+def _chunk_audio(chunk):
+    """Return the inline audio data carried by a stream chunk, or None."""
+    if (
+        chunk.candidates is None
+        or chunk.candidates[0].content is None
+        or chunk.candidates[0].content.parts is None
     ):
-        if (
-            chunk.candidates is None
-            or chunk.candidates[0].content is None
-            or chunk.candidates[0].content.parts is None
+        return None
+    if chunk.candidates[0].content.parts[0].inline_data and chunk.candidates[0].content.parts[0].inline_data.data:
+        return chunk.candidates[0].content.parts[0].inline_data
+    print(chunk.text)
+    return None
+
+
+class _NarrationStream:
+    """Collects the audio chunks of one response into a single file.
+
+    Raw PCM chunks are appended to one StreamingWavWriter as they arrive, so
+    nothing is buffered in memory and no chunk overwrites another. Audio that
+    already comes in a container format is saved as is.
+    """
+
+    def __init__(self, output_path: str = None):
+        self.output_path = output_path
+        self.started = time.monotonic()
+        self.writer = None
+        self.saved_file_path = None
+        self.file_index = 0
+
+    def feed(self, chunk):
+        inline_data = _chunk_audio(chunk)
+        if inline_data is None:
+            return
+
+        file_extension = mimetypes.guess_extension(inline_data.mime_type)
+        if file_extension is not None:
+            file_name = self.output_path or f"ENTER_FILE_NAME_{self.file_index}{file_extension}"
+            save_binary_file(file_name, inline_data.data)
+            self.saved_file_path = file_name
+            self.file_index += 1
+            return
+
+        parameters = parse_audio_mime_type(inline_data.mime_type)
+        layout = (parameters["rate"], 1, parameters["bits_per_sample"])
+        if self.writer is None:
+            file_name = self.output_path or f"ENTER_FILE_NAME_{self.file_index}.wav"
+            self.writer = audio_assembler.StreamingWavWriter(file_name, *layout, started=self.started)
+        elif layout != self.writer.layout:
+            raise ValueError(f"Audio format changed mid-stream: {inline_data.mime_type}")
+        self.writer.write(inline_data.data)
+
+    def finish(self):
+        """Finalize the file and return its path."""
+        if self.writer is None:
+            return self.saved_file_path
+        self.writer.close()
+        metrics = self.writer.metrics()
+        print(
+            f"Audio streamed to: {self.writer.output_path} ({metrics['duration']:.1f}s, "
+            f"first audio after {metrics['time_to_first_audio']:.2f}s, "
+            f"{metrics['bytes_per_second'] / 1024:.0f} KB/s)"
+        )
+        return self.writer.output_path
+
+    def abort(self):
+        """Delete the partial file of a failed stream."""
+        if self.writer is not None:
+            self.writer.abort()
+
+
+def generate(text_input: str, output_path: str = None):
+    """Generate audio from text input.
+    
+    PCM is written to disk as the response streams in; the WAV header is
+    finalized once the stream ends.
+    
+    Args:
+        text_input: The text to convert to speech
+        output_path: Optional path where to save the audio. If None, uses default naming.
+    
+    Returns:
+        str: Path to the saved audio file
+    """
+    client = genai_client.get_client()
+
+    contents, generate_content_config = _build_request(text_input)
+
+    narration = _NarrationStream(output_path)
+    try:
+        for chunk in client.models.generate_content_stream(
+            model=MODEL,
+            contents=contents,
+            config=generate_content_config,
+        ):
+            narration.feed(chunk)
+    except BaseException:
+        narration.abort()
+        raise
+    
+    return narration.finish()
+
+
+async def agenerate(text_input: str, output_path: str = None):
+    """Async version of generate, built on the async genai client.
+    
+    Args:
+        text_input: The text to convert to speech
+        output_path: Optional path where to save the audio. If None, uses default naming.
+    
+    Returns:
+        str: Path to the saved audio file
+    """
+    client = genai_client.get_client()
+
+    contents, generate_content_config = _build_request(text_input)
+
+    narration = _NarrationStream(output_path)
+    try:
+        async for chunk in await client.aio.models.generate_content_stream(
+            model=MODEL,
+            contents=contents,
+            config=generate_content_config,
         ):
-            continue
-        if chunk.candidates[0].content.parts[0].inline_data and chunk.candidates[0].content.parts[0].inline_data.data:
-            inline_data = chunk.candidates[0].content.parts[0].inline_data
-            data_buffer = inline_data.data
-            file_extension = mimetypes.guess_extension(inline_data.mime_type)
-            if file_extension is None:
-                file_extension = ".wav"
-                data_buffer = convert_to_wav(inline_data.data, inline_data.mime_type)
-            
-            if output_path:
-                file_name = output_path
-            else:
-                file_name = f"ENTER_FILE_NAME_{file_index}"
-                file_name = f"{file_name}{file_extension}"
-            
-            save_binary_file(file_name, data_buffer)
-            saved_file_path = file_name
-            file_index += 1
-        else:
-            print(chunk.text)
+            narration.feed(chunk)
+    except BaseException:
+        narration.abort()
+        raise
     
-    return saved_file_path
+    return narration.finish()
 
 def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
     """Generates a WAV file header for the given audio data and parameters.